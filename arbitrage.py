@@ -3,20 +3,48 @@ arbitrage.py
 
 Check for arbitrage opportunities.
 
-USAGE:  python arbitrage.py [--all]
+USAGE:  python arbitrage.py [--all | --list] [--min-roi X]
+                            [--max-skew SECONDS] [--workers W]
 
---all   Display all arbitrage opportunities, not just profitable ones
+--all       Display all arbitrage opportunities, not just profitable ones
+--list      Only list the profitable chains, without offering to execute
+            them. This is answered by the warm service (see service.py)
+            when it is running
+--min-roi   Only look closer at chains whose ROI can be above X
+            (default MIN_ROI), 1% is 0.01
+--max-skew  Fetch every book concurrently into one snapshot first, and
+            skip chains whose books were fetched further apart than this
+--workers   List the profitable chains found by workers instead, either
+            W local worker processes or the comma separated HOST:PORT of
+            running workers (see distributed.py)
 """
 
 from models import *
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from decimal import *
+import math
+import book_refresher
+import chain_cache
+import service
 import utils
 import sys
+import time
 
 # the coinex transaction fee
 TRANSAC_FEE = 0.002
 # the minimum amount of to_currency required for a transaction
 MIN_TRANSAC = 0.01
+# the number of price levels of each side of a book that are kept, only
+# the best one is used to evaluate chains
+TOP_OF_BOOK_DEPTH = 1
+# chains whose ROI cannot be above this are not evaluated further
+MIN_ROI = 0
+# allowance for the Decimal rounding of get_roi() over the float bound
+PRUNE_SLACK = 1e-6
+
+# counts of the chains seen and pruned by the last scan
+scan_stats = {'chains': 0, 'pruned': 0, 'skewed': 0}
 
 
 class SmartExchange(Exchange):
@@ -25,24 +53,43 @@ class SmartExchange(Exchange):
     via a weighted average
     """
 
-    def __init__(self, exc):
+    def __init__(self, exc, depth=TOP_OF_BOOK_DEPTH, snapshot=None):
         """
         Make a new SmartExchange around the given exchange
+        depth: the number of price levels of each side of the book to keep,
+               or None for the whole book
+        snapshot: a book_refresher.BookSnapshot to read the book from
+                  instead of fetching it
         """
         self._loaded = exc._loaded
         self.id = exc.id
         self.from_currency = exc.from_currency
         self.to_currency = exc.to_currency
+        self.depth = depth
+        self.snapshot = snapshot
 
     def get_orders(self):
         """
-        Memoize getting the orders
+        Memoize getting the orders, keeping only the top of the book
         """
         if hasattr(self, '_orders'):
             return self._orders
-        self._orders = super().get_orders()
+        if self.snapshot is not None:
+            self._orders = list(self.snapshot.get(self.id) or ())
+            self._fetched_at = self.snapshot.fetched_at.get(self.id)
+        else:
+            self._orders = super().get_orders(depth=self.depth)
+            self._fetched_at = time.time()
         return self._orders
 
+    def get_fetched_at(self):
+        """
+        Get when the book was fetched, in seconds since the epoch, or None
+        if it is missing from the snapshot
+        """
+        self.get_orders()
+        return self._fetched_at
+
     def get_best_offer(self, target_cur):
         """
         Memoize getting the best offer for a currency
@@ -56,6 +103,58 @@ class SmartExchange(Exchange):
         self._best_offers[target_cur.id] = ret
         return ret
 
+    def get_rate_bounds(self):
+        """
+        Get the float factors an amount is multiplied by, after fees, when
+        trading at the top of the book
+        Returns (buy, sell) where buy converts from_currency to to_currency
+        and sell converts back, either None if that side is empty
+        NOTE: this is memoized
+        """
+        if hasattr(self, '_rate_bounds'):
+            return self._rate_bounds
+        tfee = 1 - TRANSAC_FEE
+        bids = asks = False
+        for ordr in self.get_orders():
+            if ordr.bid is True:
+                bids = True
+            else:
+                asks = True
+        buy = sell = None
+        if asks:
+            buy = tfee / float(self.get_lowest_ask().rate)
+        if bids:
+            sell = float(self.get_highest_bid().rate) * tfee
+        self._rate_bounds = (buy, sell)
+        return self._rate_bounds
+
+    def get_top(self):
+        """
+        Get the top of the book as the (bid rate, bid amount, ask rate,
+        ask amount) floats chain_roi() takes, where the amounts are
+        unfilled amounts at the best rate and an empty side is None
+        NOTE: this is memoized
+        """
+        if hasattr(self, '_top'):
+            return self._top
+        bid = ask = None
+        bid_amt = ask_amt = 0.0
+        for ordr in self.get_orders():
+            rate = float(ordr.rate)
+            left = float(ordr.amount - ordr.filled)
+            if ordr.bid is True:
+                if bid is None or rate > bid:
+                    bid, bid_amt = rate, 0.0
+                if rate == bid:
+                    bid_amt += left
+            else:
+                if ask is None or rate < ask:
+                    ask, ask_amt = rate, 0.0
+                if rate == ask:
+                    ask_amt += left
+        self._top = (bid, bid_amt, ask, ask_amt)
+        return self._top
+
     def convert_to_other(self, amt, target_cur):
         """
         Convert the given amount of coin to the target currency using the most
@@ -141,6 +240,20 @@ class SmartExchange(Exchange):
         )
 
 
+class ChainStopped(Exception):
+    """
+    Raised when a leg of a chain could not be filled before its deadline
+    Attributes:
+        currency: the Currency the chain is left holding
+    """
+
+    def __init__(self, currency):
+        super().__init__(
+            'Order not filled, holding ' + currency.abbreviation
+        )
+        self.currency = currency
+
+
 class ArbitrageChain:
     """
     Defines the series of exchanges through which an arbitrage can be run
@@ -201,6 +314,43 @@ class ArbitrageChain:
         self._roi = Decimal(amt - Decimal(1))
         return self._roi
 
+    def get_roi_bound(self):
+        """
+        Get a cheap upper bound of the return on investment from the top of
+        book rates of each exchange, without any Decimal work.
+        Returns a float, or None if a leg has no orders to trade with
+        """
+        legs = (
+            (self.ex1, True),
+            (self.ex2, self.cur3 == self.ex2.to_currency),
+            (self.ex3, self.cur1 == self.ex3.to_currency)
+        )
+        amt = 1.0
+        for ex, buy in legs:
+            factor = ex.get_rate_bounds()[0 if buy else 1]
+            if factor is None:
+                return None
+            amt *= factor
+        return amt - 1
+
+    def get_skew(self):
+        """
+        Get the seconds between the fetches of the first and the last book
+        of this chain, or None if one is missing
+        """
+        times = [ex.get_fetched_at() for ex in (self.ex1, self.ex2, self.ex3)]
+        if None in times:
+            return None
+        return max(times) - min(times)
+
+    def can_prune(self, min_roi=MIN_ROI):
+        """
+        Returns true if this chain's ROI cannot be above min_roi, so it is
+        not worth evaluating further
+        """
+        bound = self.get_roi_bound()
+        return bound is None or bound + PRUNE_SLACK <= min_roi
+
     def get_max_transfer(self):
         """
         Get the max that can be transferred through this chain
@@ -272,26 +422,47 @@ class ArbitrageChain:
         self._min_transfer = ret
         return ret
 
-    def can_execute(self):
+    def can_execute(self, session=None):
         """
         Returns true if the user currently has some of the first currency and
         this chain's max is greater than the min.
-        NOTE: this memoizes the wallet balances
+        session: the coinex_api.Session of the account, defaults to the
+                 default one
+        NOTE: this reads the cached balances of the account
         """
         if self.get_min_transfer() >= self.get_max_transfer():
             return False
-        if not hasattr(ArbitrageChain, '_bals') or not ArbitrageChain._bals:
-            ArbitrageChain._bals = Wallet.get_balances()
-        for bal in ArbitrageChain._bals:
-            if bal.currency == self.cur1 and bal.amount > 0:
-                print("{0} {1}".format(bal.currency.abbreviation, bal.amount))
-                return True
+        bal = Wallet.get_balance(self.cur1, session)
+        if bal is not None and bal.amount > 0:
+            print("{0} {1}".format(bal.currency.abbreviation, bal.amount))
+            return True
         return False
 
-    def perform_chain_operation(self, amt, target_cur, exchange):
+    def executable_by(self, sessions):
+        """
+        Get the coinex_api.Sessions of the accounts that can execute this
+        chain, checking their balances concurrently
+        NOTE: the books are read once and shared by every account
+        """
+        # fill the memoized books before the threads share them
+        if self.get_min_transfer() >= self.get_max_transfer():
+            return []
+        sessions = list(sessions)
+        if not sessions:
+            return []
+        with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+            able = list(pool.map(self.can_execute, sessions))
+        return [s for s, ok in zip(sessions, able) if ok]
+
+    def perform_chain_operation(self, amt, target_cur, exchange,
+                                session=None):
         """
-        Trade the given amount (of not target_cur) over the exchange.
+        Trade the given amount (of not target_cur) over the exchange,
+        giving the order utils.FILL_DEADLINE seconds to fill.
+        session: the coinex_api.Session to trade as, defaults to the
+                 default one
         Returns the amount of target_cur that we now have
+        Raises ChainStopped if none of it was filled
         """
         tfee = Decimal(1 - Decimal(TRANSAC_FEE))
 
@@ -309,28 +480,35 @@ class ArbitrageChain:
         # amount must always be in terms of the 'to_currency',
         # convert if needed
         if exchange.to_currency != from_cur:
-            amt = self.ex1.convert_to_other(amt, target_cur)
+            amt = exchange.convert_to_other(amt, target_cur)
 
         ordr = best.get_compliment(max_amt=amt)
+        ordr.session = session
         try:
-            ordr.submit()
+            result = utils.execute_order(ordr)
         except Exception as e:
             if hasattr(e, 'read'):
                 print(e.read())
             raise e
-        if (ordr.complete is not True):
-            print("waiting for order to complete")
-            ordr = utils.wait_for_order_to_complete(ordr.id)
-        amt *= tfee
+        print(str(result))
+        if result.filled == 0:
+            raise ChainStopped(from_cur)
+        # filled is in units of to_currency
+        if target_cur == exchange.to_currency:
+            amt = result.filled * tfee
+        else:
+            amt = result.filled * ordr.rate * tfee
         print("now have {0} of {1}".format(
             str(amt),
             target_cur.abbreviation
         ))
         return amt
 
-    def execute(self):
+    def execute(self, session=None):
         """
         Perform the trades necessary to complete this chain
+        session: the coinex_api.Session to trade as, defaults to the
+                 default one
         """
         while True:
             try:
@@ -342,23 +520,30 @@ class ArbitrageChain:
             except InvalidOperation:
                 print("Invalid amount. Enter again.")
 
-        amt = self.perform_chain_operation(
-            amt,
-            self.cur2,
-            self.ex1
-        )
-        amt = self.perform_chain_operation(
-            amt,
-            self.cur3,
-            self.ex2
-        )
-        amt = self.perform_chain_operation(
-            amt,
-            self.cur1,
-            self.ex3
-        )
-        # reset the record of balances
-        ArbitrageChain._bals = None
+        try:
+            amt = self.perform_chain_operation(
+                amt,
+                self.cur2,
+                self.ex1,
+                session
+            )
+            amt = self.perform_chain_operation(
+                amt,
+                self.cur3,
+                self.ex2,
+                session
+            )
+            amt = self.perform_chain_operation(
+                amt,
+                self.cur1,
+                self.ex3,
+                session
+            )
+        except ChainStopped as e:
+            # the holdings stay in the last currency reached
+            print("stopped, an order did not fill in time. "
+                  "Holding {0}".format(e.currency.abbreviation))
+            return
         print("finished")
 
     def __str__(self):
@@ -423,71 +608,393 @@ def valid(exc, cur1, cur2=None, exclude=None, exclude_cur=None):
     return cur1 in curs
 
 
-def get_chains():
+class ChainSet:
+    """
+    Every arbitrage chain, kept as parallel int32 arrays rather than
+    objects. ArbitrageChains are only built for the chains asked for.
+    Attributes:
+        exchanges: the list of SmartExchanges the legs index into
+        leg1, leg2, leg3: arrays of the exchange index of each leg
+        flags: arrays of the chain_cache.BUY2 and BUY3 leg directions
+    len(chain_set), iter(chain_set) : the chain tuples, as
+                                      chain_topology() gives them
+    chain(i)          : build the ArbitrageChain of chain i
+    subset(indices)   : a ChainSet of some of the chains
+    rois()            : the float ROI of every chain
+    select(min_roi)   : the indices of the chains worth evaluating
+    """
+
+    def __init__(self, exchanges, leg1, leg2, leg3, flags):
+        self.exchanges = exchanges
+        self.leg1 = leg1
+        self.leg2 = leg2
+        self.leg3 = leg3
+        self.flags = flags
+
+    @classmethod
+    def load(cls, snapshot=None):
+        """
+        Get the ChainSet of every exchange, from the cached topology
+        snapshot: a book_refresher.BookSnapshot to evaluate the chains on
+        """
+        excs = Exchange.get_all()
+        exchanges = [SmartExchange(ex, snapshot=snapshot) for ex in excs]
+        index = dict((ex.id, i) for i, ex in enumerate(excs))
+        pairs = [
+            (ex.id, ex.from_currency.id, ex.to_currency.id) for ex in excs
+        ]
+        topology = chain_cache.get_topology(pairs, chain_topology)
+        ret = cls(
+            exchanges,
+            array('i', map(index.__getitem__, topology.ex1)),
+            array('i', map(index.__getitem__, topology.ex2)),
+            array('i', map(index.__getitem__, topology.ex3)),
+            array('i', topology.flags)
+        )
+        topology.close()
+        return ret
+
+    def __len__(self):
+        return len(self.leg1)
+
+    def _row(self, i):
+        """
+        Get chain i as a chain_topology() tuple of exchange indices
+        """
+        flags = self.flags[i]
+        return (
+            self.leg1[i],
+            self.leg2[i],
+            self.leg3[i],
+            bool(flags & chain_cache.BUY2),
+            bool(flags & chain_cache.BUY3)
+        )
+
+    def __iter__(self):
+        excs = self.exchanges
+        for i in range(len(self)):
+            ex1, ex2, ex3, buy2, buy3 = self._row(i)
+            yield excs[ex1].id, excs[ex2].id, excs[ex3].id, buy2, buy3
+
+    def chain(self, i):
+        """
+        Build the ArbitrageChain of chain i
+        """
+        excs = self.exchanges
+        return ArbitrageChain(
+            excs[self.leg1[i]],
+            excs[self.leg2[i]],
+            excs[self.leg3[i]]
+        )
+
+    def subset(self, indices):
+        """
+        Get a ChainSet of the chains at the given indices
+        """
+        return ChainSet(
+            self.exchanges,
+            array('i', (self.leg1[i] for i in indices)),
+            array('i', (self.leg2[i] for i in indices)),
+            array('i', (self.leg3[i] for i in indices)),
+            array('i', (self.flags[i] for i in indices))
+        )
+
+    def rois(self, transac_fee=TRANSAC_FEE, min_transac=MIN_TRANSAC):
+        """
+        Get the float ROI of every chain at the top of the books, as
+        chain_roi() gives it
+        Returns an array of doubles, NaN where a chain cannot be executed
+        """
+        tops = dict()
+        ret = array('d', bytes(8 * len(self)))
+        for i in range(len(self)):
+            row = self._row(i)
+            for ex in row[:3]:
+                if ex not in tops:
+                    tops[ex] = self.exchanges[ex].get_top()
+            roi = chain_roi(tops, row, transac_fee, min_transac)
+            ret[i] = math.nan if roi is None else roi
+        return ret
+
+    def select(self, min_roi=MIN_ROI, max_skew=None, iter_cb=None):
+        """
+        Get the indices of the chains whose ROI can be above min_roi, from
+        the float bounds of their exchanges, counting the chains seen and
+        pruned in scan_stats as prune_chains() does
+        max_skew: also skip chains whose books were fetched further apart
+                  than this many seconds
+        iter_cb: called once for every chain looked at
+        """
+        scan_stats['chains'] = scan_stats['pruned'] = scan_stats['skewed'] = 0
+        bounds = [None] * len(self.exchanges)
+
+        def factor(ex, buy):
+            if bounds[ex] is None:
+                bounds[ex] = self.exchanges[ex].get_rate_bounds()
+            return bounds[ex][0 if buy else 1]
+
+        ret = []
+        for i in range(len(self)):
+            if iter_cb:
+                iter_cb()
+            scan_stats['chains'] += 1
+            ex1, ex2, ex3, buy2, buy3 = self._row(i)
+            bound = 1.0
+            for ex, buy in ((ex1, True), (ex2, buy2), (ex3, buy3)):
+                f = factor(ex, buy)
+                if f is None:
+                    bound = None
+                    break
+                bound *= f
+            if bound is None or bound - 1 + PRUNE_SLACK <= min_roi:
+                scan_stats['pruned'] += 1
+                continue
+            if max_skew is not None:
+                times = [
+                    self.exchanges[ex].get_fetched_at()
+                    for ex in (ex1, ex2, ex3)
+                ]
+                if None in times or max(times) - min(times) > max_skew:
+                    scan_stats['skewed'] += 1
+                    continue
+            ret.append(i)
+        return ret
+
+
+def get_chains(snapshot=None):
     """
     Get a list of all arbitrage chains
+    snapshot: a book_refresher.BookSnapshot to evaluate the chains on,
+              instead of fetching each book when it is first used
+    NOTE: this builds every ArbitrageChain, scans should use ChainSet
+    """
+    chain_set = ChainSet.load(snapshot)
+    return [chain_set.chain(i) for i in range(len(chain_set))]
+
+
+def chain_topology(pairs):
+    """
+    Enumerate the arbitrage chains over a list of trade pairs, in the same
+    order as get_chains(), without building any exchange objects.
+    pairs: a list of (exchange id, from currency id, to currency id)
+    Returns a list of (ex1 id, ex2 id, ex3 id, buy2, buy3) tuples, where
+    buyN is True when leg N buys the to_currency of its exchange.
+    NOTE: the first leg always buys ex1's to_currency
     """
-    excs = Exchange.get_all()
+    by_cur = dict()
+    for pair in pairs:
+        by_cur.setdefault(pair[1], []).append(pair)
+        by_cur.setdefault(pair[2], []).append(pair)
     ret = []
-    for ex1 in excs:
-        exld = ex1.from_currency
-        viable1 = filter(
-            lambda x: valid(x, ex1.to_currency, exclude=ex1, exclude_cur=exld),
-            excs
-        )
-        for ex2 in viable1:
-            if ex2.to_currency == ex1.to_currency:
-                cur = ex2.from_currency
-            else:
-                cur = ex2.to_currency
-            viable2 = filter(
-                lambda x: valid(x, cur, ex1.from_currency, ex2),
-                excs
-            )
-            for ex3 in viable2:
-                ex1 = SmartExchange(ex1)
-                ex2 = SmartExchange(ex2)
-                ex3 = SmartExchange(ex3)
-                ret.append(ArbitrageChain(ex1, ex2, ex3))
+    for ex1, cur1, cur2 in pairs:
+        for ex2, from2, to2 in by_cur.get(cur2, []):
+            if ex2 == ex1 or cur1 in (from2, to2):
+                continue
+            buy2 = from2 == cur2
+            cur3 = to2 if buy2 else from2
+            for ex3, from3, to3 in by_cur.get(cur3, []):
+                if ex3 == ex2 or cur1 not in (from3, to3):
+                    continue
+                ret.append((ex1, ex2, ex3, buy2, to3 == cur1))
     return ret
 
 
-def get_profitable_chains(len_cb=None, iter_cb=None):
+def chain_roi(tops, chain, transac_fee=TRANSAC_FEE, min_transac=MIN_TRANSAC):
+    """
+    Get the return on investment of a chain from top-of-book data, as
+    ArbitrageChain.get_roi() does from the books.
+    tops: a dict of exchange id to (bid rate, bid amount, ask rate,
+          ask amount) floats, with None for an empty side
+    chain: a tuple as returned by chain_topology()
+    Returns a float of the ROI or None if this chain cannot be executed
+    """
+    tfee = 1 - transac_fee
+    amt = 1.0
+    legs = ((chain[0], True), (chain[1], chain[3]), (chain[2], chain[4]))
+    for ex, buy in legs:
+        top = tops.get(ex)
+        if top is None:
+            return None
+        if buy:
+            # spending from_currency, is_enough() checks the amount bought
+            if top[2] is None or amt / top[2] <= min_transac:
+                return None
+            amt = amt / top[2] * tfee
+        else:
+            if top[0] is None or amt <= min_transac:
+                return None
+            amt = amt * top[0] * tfee
+    return amt - 1
+
+
+def chain_max_transfer(tops, chain, transac_fee=TRANSAC_FEE):
+    """
+    Get the max that can be transferred through a chain from top-of-book
+    data, as ArbitrageChain.get_max_transfer() does from the books.
+    tops: a dict as given to chain_roi()
+    chain: a tuple as returned by chain_topology()
+    Returns a float in units of currency 1, or None if a side is empty
+    """
+    tfee = 1 - transac_fee
+    top1, top2, top3 = tops.get(chain[0]), tops.get(chain[1]), \
+        tops.get(chain[2])
+    if top1 is None or top2 is None or top3 is None:
+        return None
+    if None in (top1[0], top1[2], top2[0], top2[2], top3[0], top3[2]):
+        return None
+
+    def max_currency(top, buy):
+        # what the best level takes, in units of the currency spent
+        if buy:
+            return top[3] * top[2] * tfee
+        return top[1] * tfee
+
+    def convert_back(top, buy, amt):
+        # undo a leg, converting to the currency it spent
+        if buy:
+            return amt * top[0]
+        return amt / top[2]
+
+    max3 = max_currency(top3, chain[4])
+    max3 = convert_back(top2, chain[3], max3) / tfee
+    max3 = convert_back(top1, True, max3) / tfee
+    max2 = max_currency(top2, chain[3])
+    max2 = convert_back(top1, True, max2) / tfee
+    max1 = max_currency(top1, True)
+    return min(max1, max2, max3)
+
+
+def prune_chains(chains, min_roi=MIN_ROI, max_skew=None):
+    """
+    Returns a generator of the chains whose ROI can be above min_roi,
+    counting the chains seen and pruned in scan_stats
+    max_skew: also skip the chains whose books were fetched further apart
+              than this many seconds, counted as skewed
+    """
+    scan_stats['chains'] = scan_stats['pruned'] = scan_stats['skewed'] = 0
+    for chain in chains:
+        scan_stats['chains'] += 1
+        if chain.can_prune(min_roi):
+            scan_stats['pruned'] += 1
+            continue
+        if max_skew is not None:
+            skew = chain.get_skew()
+            if skew is None or skew > max_skew:
+                scan_stats['skewed'] += 1
+                continue
+        yield chain
+
+
+def show_scan_stats(min_roi=MIN_ROI):
+    """
+    Print how many chains the last scan pruned
+    """
+    print('Pruned {0} of {1} chains that cannot beat {2}% ROI'.format(
+        scan_stats['pruned'],
+        scan_stats['chains'],
+        min_roi * 100
+    ))
+    if scan_stats['skewed']:
+        print('Skipped {0} chains whose books were fetched too far '
+              'apart'.format(scan_stats['skewed']))
+
+
+def get_profitable_chains(len_cb=None,
+                          iter_cb=None,
+                          min_roi=MIN_ROI,
+                          snapshot=None,
+                          max_skew=None):
     """
     Get  alist of all profitable arbitrage chains
+    min_roi: only chains with an ROI above this are returned
+    snapshot: the book_refresher.BookSnapshot to evaluate, if any
+    max_skew: skip chains whose books were fetched further apart than
+              this many seconds
     """
-    chains = get_chains()
+    chain_set = ChainSet.load(snapshot)
     if len_cb:
-        len_cb(len(chains))
-    for chain in chains:
-        if iter_cb:
-            iter_cb()
+        len_cb(len(chain_set))
+    # only the chains that survive pruning are built
+    for i in chain_set.select(min_roi, max_skew, iter_cb):
+        chain = chain_set.chain(i)
         roi = chain.get_roi()
-        if roi and roi > 0:
+        if roi and roi > min_roi:
             yield chain
 
 
-def show_all():
+def show_all(min_roi=MIN_ROI, snapshot=None, max_skew=None):
     """
     Print out all possible arbitrages, regardless of profit
+    NOTE: chains that cannot beat min_roi are only listed, not evaluated
     """
     print("-------Getting All Chains-------")
-    chains = get_chains()
+    book_stats.reset()
+    chains = get_chains(snapshot)
+    kept = set(
+        id(chain) for chain in prune_chains(chains, min_roi, max_skew)
+    )
     for chain in chains:
+        if id(chain) not in kept:
+            bound = chain.get_roi_bound()
+            if not chain.can_prune(min_roi):
+                reason = 'books fetched too far apart'
+            elif bound is None:
+                reason = 'pruned, Not Exchangeable'
+            else:
+                reason = 'pruned, at most {0:.4f}%'.format(bound * 100)
+            print('{0} -> {1} -> {2} -> {0} ({3})'.format(
+                chain.cur1.abbreviation,
+                chain.cur2.abbreviation,
+                chain.cur3.abbreviation,
+                reason
+            ))
+            continue
         print(str(chain))
         if chain.can_execute():
             offer_execute_chain(chain)
         else:
             print('This chain cannot be executed')
     print('Found {0} arbitrage chains'.format(len(chains)))
+    show_scan_stats(min_roi)
+    print(str(book_stats))
 
 
-def show_profitable():
+def list_profitable(min_roi=MIN_ROI, snapshot=None, max_skew=None):
+    """
+    Get the profitable arbitrages and the scan report as lines to print
+    """
+    book_stats.reset()
+    ret = [
+        str(chain)
+        for chain in get_profitable_chains(
+            min_roi=min_roi,
+            snapshot=snapshot,
+            max_skew=max_skew
+        )
+    ]
+    ret.append('Found {0} arbitrage chains'.format(len(ret)))
+    ret.append('Pruned {0} of {1} chains that cannot beat {2}% ROI'.format(
+        scan_stats['pruned'],
+        scan_stats['chains'],
+        min_roi * 100
+    ))
+    if scan_stats['skewed']:
+        ret.append('Skipped {0} chains whose books were fetched too far '
+                   'apart'.format(scan_stats['skewed']))
+    return ret
+
+
+def show_profitable(min_roi=MIN_ROI, snapshot=None, max_skew=None):
     """
     Print out only profitable arbitrages
     """
     print("-------Getting Profitable Chains-------")
-    chains = get_profitable_chains()
+    book_stats.reset()
+    chains = get_profitable_chains(
+        min_roi=min_roi,
+        snapshot=snapshot,
+        max_skew=max_skew
+    )
     n = 0
     for chain in chains:
         print(str(chain))
@@ -497,14 +1004,41 @@ def show_profitable():
             print('This chain cannot be executed')
         n += 1
     print('Found {0} arbitrage chains'.format(n))
+    show_scan_stats(min_roi)
+    print(str(book_stats))
 
 
 def main():
+    min_roi = MIN_ROI
+    if '--min-roi' in sys.argv:
+        min_roi = float(sys.argv[sys.argv.index('--min-roi') + 1])
+    if '--workers' in sys.argv:
+        # only distributed scans pay for this import
+        import distributed
+        workers = sys.argv[sys.argv.index('--workers') + 1]
+        print('\n'.join(distributed.scan_lines(workers, min_roi)))
+        return
+    if '--list' in sys.argv:
+        lines = service.request('arbitrage', [
+            arg for arg in sys.argv[1:] if arg != '--list'
+        ])
+        if lines is not None:
+            print('\n'.join(lines))
+            return
+    snapshot = max_skew = None
+    if '--max-skew' in sys.argv:
+        max_skew = float(sys.argv[sys.argv.index('--max-skew') + 1])
+        refresher = book_refresher.BookRefresher(
+            fetch=lambda ex: ex.get_orders(depth=TOP_OF_BOOK_DEPTH)
+        )
+        snapshot = refresher.refresh()
     try:
-        if '--all' in sys.argv:
-            show_all()
+        if '--list' in sys.argv:
+            print('\n'.join(list_profitable(min_roi, snapshot, max_skew)))
+        elif '--all' in sys.argv:
+            show_all(min_roi, snapshot, max_skew)
         else:
-            show_profitable()
+            show_profitable(min_roi, snapshot, max_skew)
     except KeyboardInterrupt:
         print("Exiting")
 
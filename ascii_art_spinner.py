@@ -2,14 +2,30 @@
 ascii_art_spinner.py
 
 Abstracts an ASCII art spinner
+
+The bar is redrawn at most MAX_FPS times a second, and only when the
+number of blocks it shows changes, so ticking it millions of times costs
+next to nothing. Nothing is written when the output is not a terminal.
 """
 
 import sys
+import time
 
 
 WIDTH, HEIGHT = (0, 0)
 progress = 0
-terget = 100
+target = 100
+# the most redraws per second
+MAX_FPS = 10
+# room kept right of the bar for the throughput and ETA
+STATUS_WIDTH = 30
+
+_stream = sys.stdout
+_clock = time.monotonic
+_enabled = False
+_started = 0
+_last_draw = None
+_last_blocks = None
 
 
 def getTerminalSize():
@@ -52,39 +68,96 @@ def getTerminalSize():
     return int(cr[1]), int(cr[0])
 
 
-def clear():
+def _bar_width():
     """
-    Move the buffer backward WIDTH spaces
+    Get the number of cells between the brackets of the bar
     """
-    sys.stdout.write('\b' * WIDTH)
-    sys.stdout.write(' ' * WIDTH)
-    sys.stdout.write('\b' * WIDTH)
+    return max(WIDTH - STATUS_WIDTH - 2, 1)
 
 
-def draw():
-    """
-    Draw the ascii art
-    NOTE: this expects the cursor to be at the beginning
-    """
-    sys.stdout.write('[')
-    blocks = int(progress / target * WIDTH)
-    sys.stdout.write('\u2593' * (blocks))
-    sys.stdout.write('\u2591' * (WIDTH - 2 - blocks))
-    sys.stdout.write(']')
-    sys.stdout.flush()
+def _blocks():
+    if target <= 0:
+        return _bar_width()
+    return min(int(progress / target * _bar_width()), _bar_width())
 
 
-def tick():
+def status(now):
+    """
+    Get the throughput and ETA text shown right of the bar
+    """
+    elapsed = now - _started
+    if elapsed <= 0 or progress == 0:
+        return ' {0}/{1}'.format(progress, target)
+    rate = progress / elapsed
+    left = max(target - progress, 0) / rate
+    return ' {0:.0f}/s ETA {1}'.format(
+        rate,
+        time.strftime('%H:%M:%S', time.gmtime(left))
+    )
+
+
+def draw(now=None):
+    """
+    Draw the ascii art over the current line, in a single write
+    """
+    global _last_draw, _last_blocks
+    if now is None:
+        now = _clock()
+    blocks = _blocks()
+    text = '\r[' + '\u2593' * blocks
+    text += '\u2591' * (_bar_width() - blocks) + ']'
+    text += status(now).ljust(STATUS_WIDTH)[:STATUS_WIDTH]
+    _stream.write(text)
+    _stream.flush()
+    _last_draw = now
+    _last_blocks = blocks
+
+
+def tick(n=1):
+    """
+    Count n more items done, redrawing if it is time to
+    """
     global progress
-    progress += 1
-    clear()
-    draw()
-
-
-def start(target_):
-    global target, WIDTH, HEIGHT
+    progress += n
+    if not _enabled:
+        return
+    if _blocks() == _last_blocks:
+        return
+    now = _clock()
+    if now - _last_draw < 1 / MAX_FPS:
+        return
+    draw(now)
+
+
+def start(target_, stream=None, clock=time.monotonic):
+    """
+    Start a bar for target_ items
+    stream: the file to draw on, defaults to stdout
+    clock: the function returning the current time in seconds
+    """
+    global target, WIDTH, HEIGHT, progress
+    global _stream, _clock, _enabled, _started, _last_blocks
     target = target_
+    progress = 0
+    _stream = sys.stdout if stream is None else stream
+    _clock = clock
+    _enabled = _stream.isatty()
+    _started = clock()
+    _last_blocks = None
+    if not _enabled:
+        return
     WIDTH, HEIGHT = getTerminalSize()
     # keeps things looking nice
     WIDTH -= 1
     draw()
+
+
+def finish():
+    """
+    Draw the bar as it ends and move to the next line
+    """
+    if not _enabled:
+        return
+    draw()
+    _stream.write('\n')
+    _stream.flush()
@@ -0,0 +1,299 @@
+"""
+backtest.py
+
+Replay stored order book snapshots through the arbitrage chain logic to
+see what a set of parameters would have earned.
+
+USAGE:  python backtest.py DIRECTORY [--fee X] [--min-transac X]
+                           [--latency SECONDS] [--slippage X]
+                           [--min-roi X] [--max-trade X]
+
+DIRECTORY      a snapshot directory written by snapshots.SnapshotWriter
+--fee          the transaction fee (default arbitrage.TRANSAC_FEE)
+--min-transac  the minimum transaction (default arbitrage.MIN_TRANSAC)
+--latency      seconds between seeing a chain and trading it
+--slippage     fraction by which every fill rate is worse than the book
+--min-roi      only trade chains whose ROI is above this
+--max-trade    the most of the first currency to put through a chain
+
+Books are evaluated straight from the snapshot columns, no Order objects
+are built, and only the chains touching a changed book are re-evaluated.
+"""
+
+import itertools
+import sys
+
+import arbitrage
+import snapshots
+
+
+# snapshot timestamps are in microseconds
+_SECOND = 1000000
+_UNIT = float(pow(10, 8))
+
+
+def top_of_book(view):
+    """
+    Get the top of a book from its snapshot columns
+    view: a snapshots.BookView
+    Returns (bid rate, bid amount, ask rate, ask amount) floats where the
+    amounts are the unfilled amounts at the best rate, and a side without
+    orders is None
+    """
+    bid = ask = None
+    bid_amt = ask_amt = 0
+    for side, rate, amount, filled in zip(view.side,
+                                          view.rate,
+                                          view.amount,
+                                          view.filled):
+        if side:
+            if bid is None or rate > bid:
+                bid, bid_amt = rate, 0
+            if rate == bid:
+                bid_amt += amount - filled
+        else:
+            if ask is None or rate < ask:
+                ask, ask_amt = rate, 0
+            if rate == ask:
+                ask_amt += amount - filled
+    return (
+        None if bid is None else bid / _UNIT,
+        bid_amt / _UNIT,
+        None if ask is None else ask / _UNIT,
+        ask_amt / _UNIT
+    )
+
+
+def levels(view, bid):
+    """
+    Get one side of a book as a list of (rate, unfilled amount) floats,
+    best rate first
+    """
+    ret = [
+        (rate / _UNIT, (amount - filled) / _UNIT)
+        for side, rate, amount, filled in zip(view.side,
+                                              view.rate,
+                                              view.amount,
+                                              view.filled)
+        if side == bid
+    ]
+    ret.sort(reverse=bid)
+    return ret
+
+
+def fill(view, buy, amt, transac_fee, slippage):
+    """
+    Trade an amount through the depth of a book
+    view: the snapshots.BookView to trade against
+    buy: true to spend from_currency on the asks, false to sell
+         to_currency into the bids
+    amt: the amount of the currency spent
+    Returns the amount received (after fees) and the amount left unfilled
+    """
+    got = 0.0
+    for rate, qty in levels(view, not buy):
+        if amt <= 0:
+            break
+        if buy:
+            rate *= 1 + slippage
+            take = min(qty, amt / rate)
+            amt -= take * rate
+            got += take
+        else:
+            rate *= 1 - slippage
+            take = min(qty, amt)
+            amt -= take
+            got += take * rate
+    # ignore what float rounding leaves of a fully filled trade
+    if amt < 1e-12:
+        amt = 0.0
+    return got * (1 - transac_fee), amt
+
+
+class BacktestReport:
+    """
+    The outcome of a backtest
+    Attributes:
+        books: the number of books replayed
+        evaluations: the number of chain ROIs evaluated
+        detected: the number of profitable chains seen
+        executed: how many of those were fully filled
+        hits: how many executions made money
+        missed: how many detected chains lost money or could not be filled
+        pnl: a dict of currency id to the float profit in that currency
+    """
+
+    def __init__(self):
+        self.books = 0
+        self.evaluations = 0
+        self.detected = 0
+        self.executed = 0
+        self.hits = 0
+        self.missed = 0
+        self.pnl = dict()
+
+    def hit_rate(self):
+        """
+        Get the fraction of detected chains that made money
+        """
+        if self.detected == 0:
+            return 0.0
+        return self.hits / self.detected
+
+    def __str__(self):
+        ret = 'Replayed {0} books, {1} chain evaluations\n'.format(
+            self.books,
+            self.evaluations
+        )
+        ret += 'Detected {0}, executed {1}, hits {2}, missed {3}\n'.format(
+            self.detected,
+            self.executed,
+            self.hits,
+            self.missed
+        )
+        ret += 'Hit rate {0:.2f}%'.format(self.hit_rate() * 100)
+        for cur, amt in sorted(self.pnl.items()):
+            ret += '\nPnL {0:.8f} of currency {1}'.format(amt, cur)
+        return ret
+
+
+class Backtester:
+    """
+    Replays a snapshot store through the arbitrage chains
+    run() : replay and return a BacktestReport
+    """
+
+    def __init__(self,
+                 reader,
+                 pairs,
+                 transac_fee=arbitrage.TRANSAC_FEE,
+                 min_transac=arbitrage.MIN_TRANSAC,
+                 latency=0,
+                 slippage=0,
+                 min_roi=0,
+                 max_trade=None):
+        """
+        reader: the snapshots.SnapshotReader to replay
+        pairs: a list of (exchange id, from currency id, to currency id)
+        transac_fee, min_transac: the arbitrage parameters to evaluate
+        latency: seconds between seeing a chain and its trades filling
+        slippage: fraction by which each fill rate is worse than booked
+        min_roi: only chains with an ROI above this are traded
+        max_trade: the most of currency 1 to trade per chain, or None
+        """
+        self.reader = reader
+        self.transac_fee = transac_fee
+        self.min_transac = min_transac
+        self.latency = int(latency * _SECOND)
+        self.slippage = slippage
+        self.min_roi = min_roi
+        self.max_trade = max_trade
+        self.cur1 = dict((p[0], p[1]) for p in pairs)
+        self.chains = arbitrage.chain_topology(pairs)
+        # exchange id -> indices of the chains that use it
+        self._by_exchange = dict()
+        for i, chain in enumerate(self.chains):
+            for ex in set(chain[:3]):
+                self._by_exchange.setdefault(ex, []).append(i)
+
+    def _execute(self, chain, size, at, report):
+        """
+        Simulate trading size of currency 1 through a chain, filling at
+        the books as of the given time
+        """
+        amt = size
+        legs = ((chain[0], True), (chain[1], chain[3]), (chain[2], chain[4]))
+        for ex, buy in legs:
+            view = self.reader.get_book(ex, at=at)
+            if view is None:
+                report.missed += 1
+                return
+            amt, left = fill(view, buy, amt, self.transac_fee, self.slippage)
+            if left > 0:
+                # the book moved and could not take the whole trade
+                report.missed += 1
+                return
+        report.executed += 1
+        cur = self.cur1[chain[0]]
+        report.pnl[cur] = report.pnl.get(cur, 0.0) + amt - size
+        if amt > size:
+            report.hits += 1
+        else:
+            report.missed += 1
+
+    def run(self, start=None, end=None):
+        """
+        Replay the books stored between start and end (microseconds)
+        Returns a BacktestReport
+        """
+        report = BacktestReport()
+        tops = dict()
+        exchanges = set(self._by_exchange.keys())
+        books = self.reader.iter_books(start, end, exchanges)
+        # books stored at the same time are one consistent view
+        for timestamp, views in itertools.groupby(
+                books,
+                key=lambda view: view.timestamp):
+            dirty = set()
+            for view in views:
+                report.books += 1
+                tops[view.exchange_id] = top_of_book(view)
+                dirty.update(self._by_exchange[view.exchange_id])
+            for i in sorted(dirty):
+                chain = self.chains[i]
+                report.evaluations += 1
+                roi = arbitrage.chain_roi(
+                    tops,
+                    chain,
+                    self.transac_fee,
+                    self.min_transac
+                )
+                if roi is None or roi <= self.min_roi:
+                    continue
+                report.detected += 1
+                size = arbitrage.chain_max_transfer(
+                    tops,
+                    chain,
+                    self.transac_fee
+                )
+                if size is None or size <= 0:
+                    report.missed += 1
+                    continue
+                if self.max_trade is not None:
+                    size = min(size, self.max_trade)
+                self._execute(chain, size, timestamp + self.latency, report)
+        return report
+
+
+def _arg(name, default):
+    """
+    Get the float value of a command line option
+    """
+    if name in sys.argv:
+        return float(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1].startswith('--'):
+        print(__doc__)
+        return
+    import models
+    pairs = [
+        (ex.id, ex.from_currency.id, ex.to_currency.id)
+        for ex in models.Exchange.get_all()
+    ]
+    backtester = Backtester(
+        snapshots.SnapshotReader(sys.argv[1]),
+        pairs,
+        transac_fee=_arg('--fee', arbitrage.TRANSAC_FEE),
+        min_transac=_arg('--min-transac', arbitrage.MIN_TRANSAC),
+        latency=_arg('--latency', 0),
+        slippage=_arg('--slippage', 0),
+        min_roi=_arg('--min-roi', 0),
+        max_trade=_arg('--max-trade', None)
+    )
+    print(str(backtester.run()))
+
+if __name__ == '__main__':
+    main()
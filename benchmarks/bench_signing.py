@@ -0,0 +1,66 @@
+"""
+bench_signing.py
+
+Measure how many private requests per second can be built and signed,
+the way coinex_api used to and with coinex_api.PrivateRequestBuilder
+
+USAGE:  python benchmarks/bench_signing.py
+"""
+
+from hashlib import sha512
+import hmac
+import json
+import os
+import sys
+import timeit
+import urllib.request
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import coinex_api
+
+
+SECRET = b'0123456789abcdef' * 4
+BODY = {
+    'order': {
+        'trade_pair_id': 42,
+        'amount': 123456789,
+        'bid': True,
+        'rate': 1234
+    }
+}
+
+
+def old_request(data):
+    """
+    Build a signed request the way _make_request used to
+    """
+    headers = dict(coinex_api._HEADERS)
+    json.encoder.FLOAT_REPR = lambda o: 'foo'
+    data = json.dumps(data).encode('utf8')
+    hmc = hmac.new(SECRET, digestmod=sha512)
+    hmc.update(data)
+    headers['API-Key'] = 'key'
+    headers['API-Sign'] = hmc.hexdigest()
+    return urllib.request.Request(
+        coinex_api.API_URL + 'orders',
+        data=data,
+        headers=headers
+    )
+
+
+def main():
+    builder = coinex_api.PrivateRequestBuilder(
+        coinex_api.Signer('key', SECRET)
+    )
+    n = 20000
+    old = timeit.timeit(lambda: old_request(BODY), number=n)
+    new = timeit.timeit(lambda: builder.build('orders', BODY), number=n)
+    print('old signing  {0:10.0f} requests/s'.format(n / old))
+    print('builder      {0:10.0f} requests/s'.format(n / new))
+    print('speedup      {0:10.2f}x'.format(old / new))
+
+if __name__ == '__main__':
+    main()
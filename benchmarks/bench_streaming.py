@@ -0,0 +1,133 @@
+"""
+bench_streaming.py
+
+Compare decoding a deep order book response whole, as _make_request
+does, against streaming it with coinex_api.iter_array()
+
+USAGE:  python benchmarks/bench_streaming.py [N]
+
+N   the number of orders in the book (default 50000)
+
+The body arrives in chunks with a short delay between them, like a slow
+connection. Reported are the time until the first order can be used,
+the total time, and the peak memory of turning the body into a list of
+(bid, rate, amount) tuples.
+"""
+
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import coinex_api
+
+
+class SlowStream(io.BytesIO):
+    """
+    A body that is received chunk by chunk
+    """
+
+    def __init__(self, data, chunk_size=16384, delay=0.0005):
+        super().__init__(data)
+        self.chunk_size = chunk_size
+        self.delay = delay
+
+    def read(self, size=-1):
+        time.sleep(self.delay)
+        if size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+            # read() with no size still means the whole body
+            ret = b''
+            while True:
+                data = super().read(size)
+                ret += data
+                if not data:
+                    return ret
+                time.sleep(self.delay)
+        return super().read(size)
+
+
+def make_body(n, seed=0):
+    """
+    Make a JSON body of an orders response with n orders
+    """
+    rnd = random.Random(seed)
+    rows = [
+        {
+            'id': i,
+            'trade_pair_id': 2,
+            'bid': rnd.random() < 0.5,
+            'rate': rnd.randint(1, 10 ** 6),
+            'amount': rnd.randint(1, 10 ** 12),
+            'filled': 0,
+            'cancelled': False,
+            'complete': False,
+            'created_at': '2014-02-01T10:00:00.000Z'
+        }
+        for i in range(n)
+    ]
+    return json.dumps({'orders': rows}).encode()
+
+
+def whole(stream, first):
+    """
+    Decode everything, then build the book
+    """
+    rows = json.loads(stream.read().decode())['orders']
+    book = []
+    for row in rows:
+        if not book:
+            first.append(time.perf_counter())
+        book.append((row['bid'], row['rate'], row['amount']))
+    return book
+
+
+def streamed(stream, first):
+    """
+    Build the book as the orders arrive
+    """
+    book = []
+    for row in coinex_api.iter_array(stream, 'orders'):
+        if not book:
+            first.append(time.perf_counter())
+        book.append((row['bid'], row['rate'], row['amount']))
+    return book
+
+
+def measure(fn, body):
+    """
+    Returns the time to first row, total time and peak memory of fn
+    """
+    first = []
+    stream = SlowStream(body)
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(stream, first)
+    end = time.perf_counter()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first[0] - start, end - start, peak
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    body = make_body(n)
+    print('{0} orders, {1:.1f} MB body'.format(n, len(body) / 1e6))
+    print('{0:10} {1:>14} {2:>12} {3:>12}'.format(
+        '', 'first row ms', 'total ms', 'peak MB'
+    ))
+    for name, fn in (('whole', whole), ('streamed', streamed)):
+        first, total, peak = measure(fn, body)
+        print('{0:10} {1:14.1f} {2:12.1f} {3:12.1f}'.format(
+            name, first * 1000, total * 1000, peak / 1e6
+        ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+bench_valuation.py
+
+Compare valuing a portfolio balance by balance with Decimals against
+market_cap.value_table()
+
+USAGE:  python benchmarks/bench_valuation.py [N]
+
+N   the number of synthetic balances (default 1000)
+"""
+
+from decimal import *
+import os
+import sys
+import timeit
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import market_cap
+from benchmarks import synthetic
+
+
+def decimal_loop(balances, rates, price):
+    """
+    Value balances the way market_cap.main used to, one Decimal at a time
+    """
+    btc = Decimal(0)
+    for bal in balances:
+        btc += Decimal((bal.amount + bal.held) * Decimal(rates[bal.currency.id]))
+    return btc, Decimal(btc * price)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    balances, rates = synthetic.make_balances(n)
+    price = Decimal('600')
+    runs = 20
+    slow = timeit.timeit(
+        lambda: decimal_loop(balances, rates, price),
+        number=runs
+    ) / runs
+    fast = timeit.timeit(
+        lambda: market_cap.value_table(balances, rates, price),
+        number=runs
+    ) / runs
+    print('{0} balances'.format(n))
+    print('decimal loop  {0:10.3f} ms'.format(slow * 1000))
+    print('value_table   {0:10.3f} ms (sorted table included)'.format(
+        fast * 1000
+    ))
+    print('speedup       {0:10.2f}x'.format(slow / fast))
+
+if __name__ == '__main__':
+    main()
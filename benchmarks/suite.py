@@ -0,0 +1,239 @@
+"""
+suite.py
+
+Time the hot paths of models, arbitrage and market_cap over synthetic
+markets of several sizes
+
+USAGE:  python benchmarks/suite.py [--sizes N,N,...] [--repeat N]
+                                   [--output FILE]
+        python benchmarks/suite.py --compare OLD NEW [--threshold X]
+
+--sizes      the numbers of currencies of the markets (default 10,30,100)
+--repeat     how many times each benchmark is timed (default 5)
+--output     write the results as JSON to FILE instead of stdout
+--compare    compare two JSON results, flagging benchmarks that got slower
+--threshold  the fraction a benchmark may slow down before it is flagged
+             as a regression (default 0.25)
+
+Every benchmark is timed repeat times and the best and median times are
+kept. Comparing uses the best times, and exits with status 1 if anything
+regressed.
+"""
+
+from decimal import *
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import arbitrage
+import market_cap
+import models
+import valuation
+from benchmarks import synthetic
+
+
+SIZES = (10, 30, 100)
+REPEAT = 5
+THRESHOLD = 0.25
+
+
+def _reset_chain(chain):
+    """
+    Forget what a chain memoized, keeping the books of its exchanges
+    """
+    chain._roi = None
+    for attr in ('_max_transfer', '_min_transfer'):
+        if hasattr(chain, attr):
+            delattr(chain, attr)
+
+
+def bench_orders(market):
+    """
+    Build Orders from the API rows of every book
+    """
+    rows = [
+        row
+        for pair_id, _, _ in market.pairs
+        for row in market.order_rows(pair_id)
+    ]
+
+    def run():
+        for row in rows:
+            models.Order(API_resp=row)
+    return run, len(rows)
+
+
+def bench_best_offer(market):
+    """
+    Find the highest bid and lowest ask of every book
+    """
+    excs = []
+    for ex in models.Exchange.get_all():
+        ex = arbitrage.SmartExchange(ex, depth=None)
+        ex.get_orders()
+        excs.append(ex)
+
+    def run():
+        for ex in excs:
+            ex.get_highest_bid()
+            ex.get_lowest_ask()
+    return run, len(excs)
+
+
+def bench_get_chains(market):
+    """
+    Enumerate every arbitrage chain
+    """
+    models.Exchange.get_all()
+    return arbitrage.get_chains, len(arbitrage.get_chains())
+
+
+def bench_chain_eval(market):
+    """
+    Evaluate the ROI and transfer limits of every chain
+    """
+    chains = arbitrage.get_chains()
+    for chain in chains:
+        for ex in (chain.ex1, chain.ex2, chain.ex3):
+            ex.get_orders()
+
+    def run():
+        for chain in chains:
+            _reset_chain(chain)
+            chain.get_roi()
+            chain.get_max_transfer()
+            chain.get_min_transfer()
+    return run, len(chains)
+
+
+def bench_valuation(market):
+    """
+    Value every balance through the depth of the books, and tabulate them
+    """
+    excs = models.Exchange.get_all()
+    books = dict((ex.id, ex.get_orders()) for ex in excs)
+    balances = models.Balance.get_own()
+    price = Decimal('600')
+
+    def run():
+        engine = valuation.ValuationEngine(excs)
+        engine.set_books(books)
+        for bal in balances:
+            try:
+                engine.value(bal)
+            except ValueError:
+                pass
+        market_cap.value_table(balances, engine.rates(), price)
+    return run, len(balances)
+
+
+BENCHMARKS = (
+    ('order_construction', bench_orders),
+    ('best_bid_ask', bench_best_offer),
+    ('get_chains', bench_get_chains),
+    ('chain_eval', bench_chain_eval),
+    ('valuation', bench_valuation),
+)
+
+
+def run_suite(sizes=SIZES, repeat=REPEAT):
+    """
+    Run every benchmark at every market size
+    Returns a dict ready to be dumped as JSON
+    """
+    results = []
+    for size in sizes:
+        market = synthetic.make_market(size)
+        with market:
+            for name, bench in BENCHMARKS:
+                fn, items = bench(market)
+                times = sorted(timeit.repeat(fn, number=1, repeat=repeat))
+                results.append({
+                    'name': name,
+                    'size': size,
+                    'items': items,
+                    'best': times[0],
+                    'median': times[len(times) // 2],
+                })
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """
+    Compare two results of run_suite()
+    Returns a list of (name, size, old best, new best, ratio, regressed)
+    for the benchmarks in both
+    """
+    before = dict(((r['name'], r['size']), r) for r in old['results'])
+    ret = []
+    for r in new['results']:
+        prev = before.get((r['name'], r['size']))
+        if prev is None:
+            continue
+        ratio = r['best'] / prev['best'] if prev['best'] else float('inf')
+        ret.append((
+            r['name'],
+            r['size'],
+            prev['best'],
+            r['best'],
+            ratio,
+            ratio > 1 + threshold
+        ))
+    return ret
+
+
+def _arg(name, default):
+    """
+    Get the value of a command line option
+    """
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+def main():
+    if '--help' in sys.argv or '-h' in sys.argv:
+        print(__doc__)
+        return
+    if '--compare' in sys.argv:
+        i = sys.argv.index('--compare')
+        with open(sys.argv[i + 1]) as f:
+            old = json.load(f)
+        with open(sys.argv[i + 2]) as f:
+            new = json.load(f)
+        threshold = float(_arg('--threshold', THRESHOLD))
+        rows = compare(old, new, threshold)
+        print('{0:20} {1:>6} {2:>12} {3:>12} {4:>8}'.format(
+            'benchmark', 'size', 'old ms', 'new ms', 'ratio'
+        ))
+        for name, size, before, after, ratio, regressed in rows:
+            print('{0:20} {1:6} {2:12.3f} {3:12.3f} {4:8.2f}{5}'.format(
+                name, size, before * 1000, after * 1000, ratio,
+                '  REGRESSION' if regressed else ''
+            ))
+        if any(row[5] for row in rows):
+            sys.exit(1)
+        return
+    sizes = [int(n) for n in _arg('--sizes', '').split(',') if n] or SIZES
+    ret = run_suite(sizes, int(_arg('--repeat', REPEAT)))
+    out = json.dumps(ret, indent=2, sort_keys=True)
+    if '--output' in sys.argv:
+        with open(_arg('--output', None), 'w') as f:
+            f.write(out + '\n')
+    else:
+        print(out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+synthetic.py
+
+Generators of synthetic market data for the benchmarks
+"""
+
+from decimal import *
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import chain_cache
+import coinex_api
+import models
+
+
+def _to_int(amt):
+    return int(Decimal(str(amt)).scaleb(8))
+
+
+class SyntheticMarket:
+    """
+    Serves a generated market in place of the coinex.pw API, while used as
+    a context manager
+    Attributes:
+        currencies: a list of (id, abbreviation)
+        pairs: a list of (trade pair id, from currency id, to currency id)
+        books: a dict of trade pair id to a list of (bid, rate, amount)
+        balances: a dict of currency id to (amount, held)
+    """
+
+    def __init__(self, currencies, pairs, books, balances):
+        self.currencies = currencies
+        self.pairs = pairs
+        self.books = books
+        self.balances = balances
+        self._saved = []
+
+    def order_rows(self, trade_pair_id):
+        """
+        Get the book of a trade pair as rows of the orders API call
+        """
+        return [
+            {
+                'id': int(trade_pair_id) * 1000 + i,
+                'trade_pair_id': int(trade_pair_id),
+                'bid': bid,
+                'rate': _to_int(rate),
+                'amount': _to_int(amount),
+                'filled': 0,
+                'cancelled': False,
+                'complete': False,
+                'created_at': '2014-02-01T10:00:00.000Z'
+            }
+            for i, (bid, rate, amount) in enumerate(
+                self.books.get(int(trade_pair_id), [])
+            )
+        ]
+
+    def currency_rows(self):
+        return [
+            {'id': id_, 'name': abbr, 'desc': abbr + 'coin'}
+            for id_, abbr in self.currencies
+        ]
+
+    def trade_pair_rows(self):
+        return [
+            {'id': id_, 'market_id': from_, 'currency_id': to}
+            for id_, from_, to in self.pairs
+        ]
+
+    def balance_rows(self):
+        return [
+            {
+                'currency_id': cur,
+                'amount': _to_int(amt),
+                'held': _to_int(held)
+            }
+            for cur, (amt, held) in sorted(self.balances.items())
+        ]
+
+    def _reset_models(self):
+        models.registry.delete_all(models.Currency)
+        models.registry.delete_all(models.Exchange)
+        models.Currency._loaded = False
+        models.Exchange._loaded = False
+        models.balance_cache.invalidate()
+
+    def _replace(self, module, name, value):
+        self._saved.append((module, name, getattr(module, name)))
+        setattr(module, name, value)
+
+    def __enter__(self):
+        self._reset_models()
+        self._replace(coinex_api, 'currencies', self.currency_rows)
+        self._replace(coinex_api, 'trade_pairs', self.trade_pair_rows)
+        self._replace(coinex_api, 'orders', self.order_rows)
+        self._replace(
+            coinex_api,
+            'iter_orders',
+            lambda id_, depth=None: iter(self.order_rows(id_))
+        )
+        self._replace(coinex_api, 'balances', self.balance_rows)
+        # keep cached chain topologies out of the user's cache
+        self._cache_dir = tempfile.mkdtemp()
+        self._replace(chain_cache, 'CACHE_DIR', self._cache_dir)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._saved:
+            module, name, value = self._saved.pop()
+            setattr(module, name, value)
+        shutil.rmtree(self._cache_dir)
+        self._reset_models()
+        return False
+
+
+def make_currencies(n, seed=0):
+    """
+    Make n Currencies, the first of which is BTC
+    """
+    ret = [models.Currency(1, 'BTC', 'Bitcoin')]
+    for i in range(2, n + 1):
+        ret.append(models.Currency(i, 'C{0:03d}'.format(i), 'Coin'))
+    return ret
+
+
+def make_balances(n, seed=0):
+    """
+    Make n Balances of n different currencies, with random amounts and
+    held amounts
+    Returns the list of Balances and a dict of currency id to a float
+    BTC rate
+    """
+    rnd = random.Random(seed)
+    bals = []
+    rates = dict()
+    for cur in make_currencies(n):
+        amt = Decimal(rnd.randint(0, 10 ** 12)).scaleb(-8)
+        held = Decimal(rnd.randint(0, 10 ** 10)).scaleb(-8)
+        bals.append(models.Balance(cur, amt, held=held))
+        rates[cur.id] = 1.0 if cur.id == 1 else rnd.uniform(1e-8, 1e-2)
+    return bals, rates
+
+
+def make_market(n, links=2, depth=20, seed=0):
+    """
+    Make a market of n currencies where every coin trades against BTC and
+    against links other coins, with depth levels on each side of every book
+    Returns a SyntheticMarket to use as a context manager
+    """
+    rnd = random.Random(seed)
+    currencies = [(cur.id, cur.abbreviation) for cur in make_currencies(n)]
+    # the BTC price of every coin
+    price = dict((id_, rnd.uniform(1e-6, 1e-1)) for id_, _ in currencies)
+    price[1] = 1.0
+    pairs = []
+    seen = set()
+    for id_, _ in currencies[1:]:
+        others = [1] + rnd.sample(
+            [c for c, _ in currencies[1:] if c != id_],
+            min(links, n - 2)
+        )
+        for other in others:
+            key = (min(id_, other), max(id_, other))
+            if key in seen:
+                continue
+            seen.add(key)
+            pairs.append((len(pairs) + 100, key[0], key[1]))
+    books = dict()
+    for pair_id, from_, to in pairs:
+        # from_currency per to_currency, a little off so some chains pay
+        mid = price[to] / price[from_] * rnd.uniform(0.97, 1.03)
+        book = []
+        for level in range(depth):
+            spread = 0.001 * (level + 1)
+            amount = '{0:.8f}'.format(rnd.uniform(1, 1000))
+            book.append((True, '{0:.8g}'.format(mid * (1 - spread)), amount))
+            book.append((False, '{0:.8g}'.format(mid * (1 + spread)), amount))
+        books[pair_id] = book
+    balances = dict(
+        (id_, ('{0:.8f}'.format(rnd.uniform(0, 100)), '0'))
+        for id_, _ in currencies
+    )
+    return SyntheticMarket(currencies, pairs, books, balances)
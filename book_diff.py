@@ -0,0 +1,246 @@
+"""
+book_diff.py
+
+Turn successive fetches of order books into a feed of what changed.
+
+Every fetched book is compared by order id with the previous fetch of the
+same exchange, and the differences are sent to subscribers as compact
+events:
+
+    add     an order appeared
+    update  the unfilled amount of an order changed
+    remove  an order is gone (filled, cancelled or out of the fetched depth)
+    top     the best rate or the amount at the best rate of a side changed
+
+Books that did not change send nothing, so subscribers only do work for
+the books that moved.
+"""
+
+from collections import namedtuple
+from decimal import *
+import sys
+
+import models
+
+
+ADD = 'add'
+UPDATE = 'update'
+REMOVE = 'remove'
+TOP = 'top'
+
+# kind: one of ADD, UPDATE, REMOVE or TOP
+# exchange_id: the id of the exchange of the book
+# order_id: the id of the order, None for TOP
+# bid: true for the bid side
+# rate: the Decimal rate of the order, or the new best rate for TOP (None
+#       once the side is empty)
+# remaining: the Decimal unfilled amount of the order, 0 for REMOVE, or
+#            the unfilled amount at the best rate for TOP
+BookEvent = namedtuple(
+    'BookEvent',
+    ['kind', 'exchange_id', 'order_id', 'bid', 'rate', 'remaining']
+)
+
+
+def _top(book, bid):
+    """
+    Get the (best rate, unfilled amount at it) of one side of a book,
+    (None, 0) if it is empty
+    book: a dict of order id to (bid, rate, remaining)
+    """
+    best = None
+    amt = Decimal(0)
+    for side, rate, remaining in book.values():
+        if side != bid:
+            continue
+        if best is None or (rate > best if bid else rate < best):
+            best, amt = rate, Decimal(0)
+        if rate == best:
+            amt += remaining
+    return best, amt
+
+
+class BookDiffer:
+    """
+    Compares every book with the last one seen of the same exchange
+    subscribe(cb)            : send events to cb(exchange, events)
+    diff(exchange_id, orders): the events between the last book and orders
+    update(exchange, orders) : diff a book and notify the subscribers
+    attach()                 : diff every book fetched by get_orders()
+    """
+
+    def __init__(self):
+        # exchange id -> order id -> (bid, rate, remaining)
+        self._books = dict()
+        # exchange id -> ((bid rate, amount), (ask rate, amount))
+        self._tops = dict()
+        # exchange id -> the last list of Orders
+        self._orders = dict()
+        self._subscribers = []
+
+    def subscribe(self, cb):
+        """
+        Call cb(exchange, events) with the events of every changed book
+        """
+        if cb not in self._subscribers:
+            self._subscribers.append(cb)
+
+    def unsubscribe(self, cb):
+        """
+        Stop calling cb
+        """
+        if cb in self._subscribers:
+            self._subscribers.remove(cb)
+
+    def orders(self, exchange_id):
+        """
+        Get the last list of Orders seen of an exchange, or None
+        """
+        return self._orders.get(exchange_id)
+
+    def top(self, exchange_id):
+        """
+        Get ((bid rate, amount), (ask rate, amount)) of the last book seen
+        of an exchange, or None
+        """
+        return self._tops.get(exchange_id)
+
+    def forget(self, exchange_id):
+        """
+        Drop the last book of an exchange, its next book is all adds
+        """
+        self._books.pop(exchange_id, None)
+        self._tops.pop(exchange_id, None)
+        self._orders.pop(exchange_id, None)
+
+    def diff(self, exchange_id, orders):
+        """
+        Compare a book with the last one seen of the same exchange and
+        remember it
+        orders: the list of models.Order of the book
+        Returns a list of BookEvents, empty if nothing changed
+        """
+        old = self._books.get(exchange_id, {})
+        new = dict(
+            (o.id, (o.bid, o.rate, o.amount - o.filled)) for o in orders
+        )
+        events = []
+        for id_, (bid, rate, remaining) in new.items():
+            prev = old.get(id_)
+            if prev is None:
+                events.append(
+                    BookEvent(ADD, exchange_id, id_, bid, rate, remaining)
+                )
+            elif prev != (bid, rate, remaining):
+                events.append(
+                    BookEvent(UPDATE, exchange_id, id_, bid, rate, remaining)
+                )
+        for id_, (bid, rate, _) in old.items():
+            if id_ not in new:
+                events.append(
+                    BookEvent(REMOVE, exchange_id, id_, bid, rate, Decimal(0))
+                )
+        self._books[exchange_id] = new
+        self._orders[exchange_id] = orders
+        if not events and exchange_id in self._tops:
+            return events
+        tops = (_top(new, True), _top(new, False))
+        empty = (None, Decimal(0))
+        prev = self._tops.get(exchange_id, (empty, empty))
+        for bid, now, before in ((True, tops[0], prev[0]),
+                                 (False, tops[1], prev[1])):
+            if now != before:
+                events.append(
+                    BookEvent(TOP, exchange_id, None, bid, now[0], now[1])
+                )
+        self._tops[exchange_id] = tops
+        return events
+
+    def update(self, exchange, orders):
+        """
+        Diff the book of an exchange and send the events to the
+        subscribers, for use as an orders listener
+        exchange: the models.Exchange
+        orders: the list of models.Order fetched from it
+        Returns the list of BookEvents
+        """
+        events = self.diff(exchange.id, orders)
+        if events:
+            for cb in self._subscribers:
+                cb(exchange, events)
+        return events
+
+    def attach(self):
+        """
+        Diff every book fetched by models.Exchange.get_orders()
+        """
+        models.Exchange.add_orders_listener(self.update)
+
+    def detach(self):
+        """
+        Stop diffing books fetched by models.Exchange.get_orders()
+        """
+        models.Exchange.remove_orders_listener(self.update)
+
+
+class ChangedBooks:
+    """
+    A subscriber that collects the exchanges whose books changed, so only
+    the chains using them are evaluated again
+    Attributes:
+        top_only: only collect exchanges whose top of book changed
+    pop() : get and clear the set of changed exchange ids
+    """
+
+    def __init__(self, top_only=True):
+        self.top_only = top_only
+        self._changed = set()
+
+    def __call__(self, exchange, events):
+        if not self.top_only or any(e.kind == TOP for e in events):
+            self._changed.add(exchange.id)
+
+    def pop(self):
+        ret = self._changed
+        self._changed = set()
+        return ret
+
+
+class EventLog:
+    """
+    A subscriber that writes every event as a line of text
+    Attributes:
+        stream: the file written to
+    """
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+
+    def __call__(self, exchange, events):
+        for e in events:
+            self.stream.write('{0} {1} {2} {3} {4} {5}\n'.format(
+                e.kind,
+                e.exchange_id,
+                '-' if e.order_id is None else e.order_id,
+                'bid' if e.bid else 'ask',
+                e.rate,
+                e.remaining
+            ))
+
+
+class ChangedSnapshots:
+    """
+    A subscriber that stores a book in a snapshots.SnapshotWriter only
+    when it changed, so quiet books take no space
+    """
+
+    def __init__(self, differ, writer):
+        """
+        differ: the BookDiffer subscribed to
+        writer: the snapshots.SnapshotWriter to store books in
+        """
+        self.differ = differ
+        self.writer = writer
+
+    def __call__(self, exchange, events):
+        self.writer.write(exchange.id, self.differ.orders(exchange.id))
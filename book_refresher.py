@@ -0,0 +1,185 @@
+"""
+book_refresher.py
+
+Refresh order books in the background into consistent, read-only
+snapshots.
+
+A BookRefresher thread fetches every book concurrently into a back
+buffer, then swaps it in as the current BookSnapshot with a single
+assignment. Readers take the current snapshot and use it for as long as
+they like: a snapshot is never modified once published, so reading
+needs no lock and every book read from it stays put.
+
+Every book keeps the time it was fetched, so chains whose legs were
+fetched too far apart can be rejected (see BookSnapshot.skew).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import time
+import types
+
+import models
+
+
+# seconds between the start of two refreshes
+REFRESH_INTERVAL = 5
+# the number of books fetched at once
+MAX_WORKERS = 8
+
+
+class BookSnapshot:
+    """
+    A read-only set of order books
+    Attributes:
+        version: the number of the refresh that published it
+        created_at: when it was published
+        books: a read-only dict of exchange id to a tuple of Orders
+        fetched_at: a read-only dict of exchange id to when its book was
+                    fetched
+    """
+
+    def __init__(self, books, fetched_at, version=0, created_at=None):
+        self.version = version
+        self.created_at = time.time() if created_at is None else created_at
+        self.books = types.MappingProxyType(
+            dict((id_, tuple(orders)) for id_, orders in books.items())
+        )
+        self.fetched_at = types.MappingProxyType(dict(fetched_at))
+
+    def get(self, exchange_id):
+        """
+        Get the tuple of Orders of an exchange, or None
+        """
+        return self.books.get(exchange_id)
+
+    def skew(self, exchange_ids):
+        """
+        Get the seconds between the first and last fetch of the books of
+        several exchanges, or None if one of them is missing
+        """
+        times = [self.fetched_at.get(id_) for id_ in exchange_ids]
+        if None in times:
+            return None
+        return max(times) - min(times)
+
+
+class BookRefresher:
+    """
+    Fetches books in the background and publishes them as BookSnapshots
+    Attributes:
+        interval: seconds between the start of two refreshes
+    snapshot()     : the current BookSnapshot
+    refresh()      : fetch every book and publish a new snapshot now
+    start(), stop(): refresh every interval in a background thread
+    """
+
+    def __init__(self,
+                 exchanges=None,
+                 fetch=None,
+                 interval=REFRESH_INTERVAL,
+                 max_workers=MAX_WORKERS,
+                 clock=time.time):
+        """
+        exchanges: the Exchanges to refresh, defaults to all of them
+        fetch: a function of an Exchange returning its list of Orders,
+               defaults to Exchange.get_orders
+        clock: a function returning the current time in seconds
+        """
+        if exchanges is None:
+            exchanges = models.Exchange.get_all()
+        if fetch is None:
+            fetch = lambda ex: ex.get_orders()
+        self.exchanges = list(exchanges)
+        self.fetch = fetch
+        self.interval = interval
+        self.max_workers = max_workers
+        self._clock = clock
+        self._snapshot = BookSnapshot({}, {}, created_at=clock())
+        self._published = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def snapshot(self):
+        """
+        Get the current BookSnapshot
+        NOTE: this takes no lock, a snapshot is never changed once published
+        """
+        return self._snapshot
+
+    def wait(self, timeout=None):
+        """
+        Wait until a first snapshot has been published.
+        Returns true if one was
+        """
+        return self._published.wait(timeout)
+
+    def _fetch(self, ex):
+        orders = self.fetch(ex)
+        return orders, self._clock()
+
+    def refresh(self):
+        """
+        Fetch every book into a back buffer and publish it as the new
+        snapshot. A book that could not be fetched keeps its previous
+        orders and fetch time.
+        Returns the new BookSnapshot
+        """
+        current = self._snapshot
+        books = dict(current.books)
+        fetched_at = dict(current.fetched_at)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [
+                (ex.id, pool.submit(self._fetch, ex))
+                for ex in self.exchanges
+            ]
+            for id_, fut in futures:
+                try:
+                    books[id_], fetched_at[id_] = fut.result()
+                except Exception as e:
+                    sys.stderr.write(
+                        'WARNING: refreshing exchange {0} failed: {1}\n'
+                        .format(id_, e)
+                    )
+        snap = BookSnapshot(
+            books,
+            fetched_at,
+            version=current.version + 1,
+            created_at=self._clock()
+        )
+        # publishing is a single assignment, readers never see a half
+        # built snapshot
+        self._snapshot = snap
+        self._published.set()
+        return snap
+
+    def _run(self):
+        while not self._stopping.is_set():
+            start = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                sys.stderr.write('WARNING: refresh failed: {0}\n'.format(e))
+            wait = self.interval - (time.monotonic() - start)
+            self._stopping.wait(max(wait, 0))
+
+    def start(self):
+        """
+        Start refreshing in a background thread
+        """
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread, waiting for a refresh in progress
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
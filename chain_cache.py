@@ -0,0 +1,196 @@
+"""
+chain_cache.py
+
+Keep the enumerated arbitrage chain topology on disk, so it is only
+computed again when the list of trade pairs changes.
+
+The chains of a trade pair list are kept in one file named after a hash
+of the list:
+
+    CACHE_DIR/chains-<key>.bin
+
+    header  magic, version and number of chains (see _HEADER)
+    ex1     int32 per chain, the exchange id of leg 1
+    ex2     int32 per chain, the exchange id of leg 2
+    ex3     int32 per chain, the exchange id of leg 3
+    flags   int32 per chain, 1 if leg 2 buys, 2 if leg 3 buys
+
+The file is memory-mapped when loaded, so nothing is parsed or copied.
+
+NOTE: columns are written in the native byte order of the machine
+"""
+
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+
+CACHE_DIR = os.environ.get(
+    'COINEX_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'coinex')
+)
+BUY2 = 1
+BUY3 = 2
+
+# magic, version, number of chains
+_HEADER = struct.Struct('=4sii')
+_MAGIC = b'CXCT'
+_VERSION = 1
+
+
+def pairs_key(pairs):
+    """
+    Get the hex key of a trade pair list
+    pairs: a list of (exchange id, from currency id, to currency id)
+    """
+    data = json.dumps([[int(x) for x in pair] for pair in pairs])
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def cache_path(pairs, directory=None):
+    """
+    Get the path of the cache file of a trade pair list
+    """
+    if directory is None:
+        directory = CACHE_DIR
+    return os.path.join(directory, 'chains-' + pairs_key(pairs) + '.bin')
+
+
+class ChainTopology:
+    """
+    The chains of a trade pair list, as parallel int32 columns
+    Attributes:
+        ex1, ex2, ex3: the exchange ids of each leg
+        flags: BUY2 and BUY3 bits of the leg directions
+    Indexing or iterating gives the (ex1, ex2, ex3, buy2, buy3) tuples of
+    arbitrage.chain_topology()
+    """
+
+    def __init__(self, ex1, ex2, ex3, flags, mapped=None):
+        """
+        ex1, ex2, ex3, flags: sequences of ints, such as arrays or
+                              memoryviews
+        mapped: the mmap the columns are views of, if any
+        """
+        self.ex1 = ex1
+        self.ex2 = ex2
+        self.ex3 = ex3
+        self.flags = flags
+        self._mapped = mapped
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Make a ChainTopology from a list of (ex1, ex2, ex3, buy2, buy3)
+        """
+        return cls(
+            array('i', [row[0] for row in rows]),
+            array('i', [row[1] for row in rows]),
+            array('i', [row[2] for row in rows]),
+            array('i', [
+                (BUY2 if row[3] else 0) | (BUY3 if row[4] else 0)
+                for row in rows
+            ])
+        )
+
+    def __len__(self):
+        return len(self.ex1)
+
+    def __getitem__(self, i):
+        flags = self.flags[i]
+        return (
+            self.ex1[i],
+            self.ex2[i],
+            self.ex3[i],
+            bool(flags & BUY2),
+            bool(flags & BUY3)
+        )
+
+    def __iter__(self):
+        for ex1, ex2, ex3, flags in zip(self.ex1,
+                                        self.ex2,
+                                        self.ex3,
+                                        self.flags):
+            yield ex1, ex2, ex3, bool(flags & BUY2), bool(flags & BUY3)
+
+    def close(self):
+        """
+        Release the memory-map, if any
+        """
+        if self._mapped is None:
+            return
+        for col in (self.ex1, self.ex2, self.ex3, self.flags):
+            col.release()
+        self._mapped.close()
+        self._mapped = None
+
+
+def save(path, topology):
+    """
+    Write a ChainTopology to a cache file, atomically
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(topology)))
+        for col in (topology.ex1, topology.ex2, topology.ex3,
+                    topology.flags):
+            array('i', col).tofile(f)
+    os.replace(tmp, path)
+
+
+def load(path):
+    """
+    Memory-map a cache file
+    Returns a ChainTopology, or None if the file is missing or not valid
+    """
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    view = memoryview(mapped)
+    try:
+        magic, version, n = _HEADER.unpack_from(view)
+    except struct.error:
+        magic = None
+    width = array('i').itemsize * n if magic else 0
+    if (magic != _MAGIC or version != _VERSION or
+            len(view) != _HEADER.size + 4 * width):
+        view.release()
+        mapped.close()
+        return None
+    cols = []
+    for i in range(4):
+        start = _HEADER.size + i * width
+        cols.append(view[start:start + width].cast('i'))
+    view.release()
+    return ChainTopology(*cols, mapped=mapped)
+
+
+def get_topology(pairs, build, directory=None):
+    """
+    Get the chain topology of a trade pair list from its cache file,
+    building and saving it if there is none
+    pairs: a list of (exchange id, from currency id, to currency id)
+    build: a function of pairs returning the list of chain tuples, such as
+           arbitrage.chain_topology
+    directory: where cache files are kept, defaults to CACHE_DIR
+    Returns a ChainTopology
+    """
+    path = cache_path(pairs, directory)
+    ret = load(path)
+    if ret is not None:
+        return ret
+    ret = ChainTopology.from_rows(build(pairs))
+    try:
+        save(path, ret)
+    except OSError as e:
+        sys.stderr.write(
+            'WARNING: could not cache the chain topology: {0}\n'.format(e)
+        )
+    return ret
@@ -10,6 +10,9 @@ Example config file structure:
 Key = <KEY HERE>
 Secret = <SECRET HERE>
 
+Further accounts go in sections named 'Credentials <name>', and are used
+through the Session objects of get_sessions().
+
 
 NOTE: the coinex api spec can be found here:
 https://gist.github.com/erundook/8377222
@@ -17,18 +20,41 @@ https://gist.github.com/erundook/8377222
 
 import hmac
 from hashlib import sha512
+from concurrent.futures import ThreadPoolExecutor
+import codecs
 import configparser
+import http.client
+import io
 import json
-import json.encoder
+import threading
+import time
+import urllib.error
 import urllib.request
 from binascii import unhexlify
 import os
+import re
+import select
 from decimal import *
 
 
 # set the decimal precision to 8
 getcontext().prec = 8
 
+# the most requests made at once by the batch calls
+MAX_WORKERS = 8
+# seconds to wait on the server before giving up
+TIMEOUT = 30
+# seconds an idle pooled connection is kept, servers drop them after a while
+IDLE_TIMEOUT = 15
+# bytes read at a time when streaming a response
+STREAM_CHUNK = 16384
+# the query parameter limiting the depth of the orders endpoint, None as
+# the v2 spec does not document one
+ORDERS_DEPTH_PARAM = None
+# private requests per second of each session, and the most made at once
+PRIVATE_RATE = 2
+PRIVATE_BURST = 8
+
 
 def _get_config():
     """
@@ -63,48 +89,527 @@ def _get_secret():
     return _get_config()['Credentials']['Secret'].encode('utf8')
 
 
-def _make_request(page, data=None, private=False):
+# the root of every API url
+API_URL = 'https://coinex.pw/api/v2/'
+# the headers sent with every request
+_HEADERS = {
+    'User-Agent': 'coinex-python-autosell',
+    'Accept': 'application/json',
+    'Content-type': 'application/json'
+}
+# encodes the bodies of private requests, compact and with sorted keys
+_ENCODER = json.JSONEncoder(separators=(',', ':'), sort_keys=True)
+
+
+class Signer:
+    """
+    Signs request bodies with HMAC-SHA512.
+    The HMAC is keyed once and copied for every body, so the secret is
+    not read and the key not hashed again on each request.
+    Attributes:
+        key: the public API key
+    """
+
+    def __init__(self, key, secret):
+        """
+        key: the public API key
+        secret: the secret key, as bytes
+        """
+        self.key = key
+        self._hmac = hmac.new(secret, digestmod=sha512)
+
+    def sign(self, data):
+        """
+        Get the hex signature of a body (bytes)
+        """
+        hmc = self._hmac.copy()
+        hmc.update(data)
+        return hmc.hexdigest()
+
+
+class PrivateRequestBuilder:
+    """
+    Builds signed urllib requests for the private API
+    Attributes:
+        signer: the Signer of the requests
+    """
+
+    def __init__(self, signer):
+        self.signer = signer
+        self._headers = dict(_HEADERS)
+        self._headers['API-Key'] = signer.key
+
+    def encode(self, data):
+        """
+        Get the body of a request for the given data, as bytes
+        """
+        if data is None:
+            return b''
+        return _ENCODER.encode(data).encode('utf8')
+
+    def build(self, page, data=None, method=None):
+        """
+        Build the request for a page
+        'page' is appended to the end of API_URL to get the url
+        'data', if supplied, is turned into JSON and given to the server
+        'method', if supplied, overrides the HTTP method
+        """
+        body = self.encode(data)
+        headers = dict(self._headers)
+        headers['API-Sign'] = self.signer.sign(body)
+        return urllib.request.Request(
+            API_URL + page,
+            data=(body if body else None),
+            headers=headers,
+            method=method
+        )
+
+
+class RateBudget:
+    """
+    A token bucket limiting how fast requests are made. Each request
+    takes a token, and tokens come back at rate per second up to burst.
+    Attributes:
+        rate: requests per second, or None for no limit
+        burst: the most requests made at once after a quiet spell
+    acquire() : wait until a request may be made
+    """
+
+    def __init__(self,
+                 rate=PRIVATE_RATE,
+                 burst=PRIVATE_BURST,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+        """
+        clock: a function returning the current time in seconds
+        sleep: a function sleeping for some seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = burst
+        self._refilled = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if there are none left.
+        Returns the seconds waited
+        NOTE: concurrent callers each reserve their own slot, so they wait
+        one after the other rather than all at once
+        """
+        if self.rate is None:
+            return 0
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._refilled) * self.rate
+            )
+            self._refilled = now
+            self._tokens -= 1
+            wait = max(-self._tokens / self.rate, 0)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+
+class Session:
+    """
+    The private API of one account. Each session signs with its own
+    credentials and has its own RateBudget, while the public endpoints,
+    the connection pool and everything cached from them are shared.
+    Attributes:
+        name: the name of the account
+        builder: the PrivateRequestBuilder of its requests
+        budget: the RateBudget of its requests
+    The private functions of this module are methods of a session, so a
+    session can be used wherever the module is:
+    balances(), open_orders(), submit_order(), order_status(),
+    cancel_order(), submit_orders(), cancel_orders()
+    """
+
+    def __init__(self,
+                 key,
+                 secret,
+                 name=None,
+                 rate=PRIVATE_RATE,
+                 burst=PRIVATE_BURST):
+        """
+        key: the public API key
+        secret: the secret key, as a str or bytes
+        """
+        if isinstance(secret, str):
+            secret = secret.encode('utf8')
+        self.name = name
+        self.builder = PrivateRequestBuilder(Signer(key, secret))
+        self.budget = RateBudget(rate, burst)
+
+    def __repr__(self):
+        return 'Session({0!r})'.format(self.name)
+
+    def balances(self):
+        return balances(session=self)
+
+    def open_orders(self):
+        return open_orders(session=self)
+
+    def submit_order(self, trade_pair_id, amount, bid, rate):
+        return submit_order(trade_pair_id, amount, bid, rate, session=self)
+
+    def order_status(self, order_id):
+        return order_status(order_id, session=self)
+
+    def cancel_order(self, order_id):
+        return cancel_order(order_id, session=self)
+
+    def submit_orders(self, orders):
+        return submit_orders(orders, session=self)
+
+    def cancel_orders(self, order_ids):
+        return cancel_orders(order_ids, session=self)
+
+
+def default_session():
+    """
+    Get the Session of the [Credentials] section of the config file
+    NOTE: this is memoized
+    """
+    if hasattr(default_session, '_session'):
+        return default_session._session
+    default_session._session = Session(_get_key(), _get_secret(), 'default')
+    return default_session._session
+
+
+def get_sessions():
+    """
+    Get a Session for every account of the config file, the default one
+    first and then one per 'Credentials <name>' section
+    NOTE: this is memoized
+    """
+    if hasattr(get_sessions, '_sessions'):
+        return get_sessions._sessions
+    conf = _get_config()
+    ret = []
+    if 'Credentials' in conf:
+        ret.append(default_session())
+    for section in conf.sections():
+        if section.startswith('Credentials '):
+            ret.append(Session(
+                conf[section]['Key'],
+                conf[section]['Secret'],
+                section[len('Credentials '):].strip()
+            ))
+    get_sessions._sessions = ret
+    return ret
+
+
+def _dropped(conn):
+    """
+    Check whether the server has closed an idle connection. An idle
+    connection has nothing to read, unless the server closed it.
+    """
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class ConnectionPool:
+    """
+    Keeps HTTP connections open between requests, so consecutive and
+    concurrent requests to the same host skip the TCP and TLS handshakes.
+    Attributes:
+        max_idle: the most idle connections kept per host
+        idle_timeout: seconds an idle connection is kept
+    """
+
+    def __init__(self,
+                 max_idle=MAX_WORKERS,
+                 timeout=TIMEOUT,
+                 idle_timeout=IDLE_TIMEOUT,
+                 clock=time.monotonic):
+        """
+        clock: a function returning the current time in seconds
+        """
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._clock = clock
+        # (scheme, host) -> list of (connection, when it went idle)
+        self._idle = dict()
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme, host):
+        """
+        Open a new connection
+        """
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _get(self, scheme, host):
+        """
+        Get an idle connection to a host, or None. Connections idle for
+        too long or closed by the server are dropped.
+        """
+        now = self._clock()
+        while True:
+            with self._lock:
+                idle = self._idle.get((scheme, host))
+                if not idle:
+                    return None
+                conn, since = idle.pop()
+            if now - since < self.idle_timeout and not _dropped(conn):
+                return conn
+            conn.close()
+
+    def _put(self, scheme, host, conn):
+        """
+        Return a connection to the pool once its response was read
+        """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, self._clock()))
+                return
+        conn.close()
+
+    def open(self, req):
+        """
+        Send a urllib.request.Request and get its response.
+        Returns the http.client.HTTPResponse, which must be read to the
+        end and given to release() before its connection is reused.
+        Raises urllib.error.HTTPError for error statuses, as urlopen does
+        """
+        scheme, host = req.type, req.host
+        conn = self._get(scheme, host)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect(scheme, host)
+            try:
+                conn.request(
+                    req.get_method(),
+                    req.selector,
+                    body=req.data,
+                    headers=dict(req.header_items())
+                )
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # the server dropped the idle connection before the whole
+                # request got to it, so it is safe to send again
+                if reused:
+                    conn, reused = None, False
+                    continue
+                raise urllib.error.URLError(e)
+            try:
+                rsp = conn.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # the server may have acted on the request, only send
+                # again requests that change nothing
+                if reused and req.get_method() == 'GET':
+                    conn, reused = None, False
+                    continue
+                raise urllib.error.URLError(e)
+        rsp._pool_key = (scheme, host, conn)
+        if rsp.status >= 400:
+            body = rsp.read()
+            self.release(rsp)
+            raise urllib.error.HTTPError(
+                req.full_url,
+                rsp.status,
+                rsp.reason,
+                rsp.headers,
+                io.BytesIO(body)
+            )
+        return rsp
+
+    def release(self, rsp):
+        """
+        Give the connection of a fully read response back to the pool
+        """
+        scheme, host, conn = rsp._pool_key
+        if rsp.will_close:
+            conn.close()
+        else:
+            self._put(scheme, host, conn)
+
+    def discard(self, rsp):
+        """
+        Close the connection of a response that was not read to the end
+        """
+        rsp._pool_key[2].close()
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+        with self._lock:
+            idle, self._idle = self._idle, dict()
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+# the connections shared by every request
+_pool = ConnectionPool()
+
+
+def _make_request(page, data=None, private=False, method=None, session=None):
     """
     Make a request to coinex.pw
 
     'page' is appended to the end of 'https://coinex.pw/api/v2/' to get the url
     'data', if supplied, is turned into JSON and given to the server
     'private' is true when this requires private authentication
+    'method', if supplied, overrides the HTTP method
+    'session', if supplied, is the Session a private request is made as,
+    instead of the default one
     """
-    url = "https://coinex.pw/api/v2/" + page
-    headers = {
-        'User-Agent': 'coinex-python-autosell',
-        'Accept': 'application/json',
-        'Content-type': 'application/json'
-    }
     if private:
-        # if data was supplied convert it into a json string
-        if data is not None:
-            json.encoder.FLOAT_REPR = lambda o: 'foo'
-            data = json.dumps(data)
-        # also format the data correctly
-        else:
-            data = ''
-        data = data.encode('utf8')
-        # construct the headers
-        hmc = hmac.new(_get_secret(), digestmod=sha512)
-        hmc.update(data)
-        headers['API-Key'] = _get_key()
-        headers['API-Sign'] = hmc.hexdigest()
-        # construct the request
-        req = urllib.request.Request(
-            url,
-            data=(data if data else None),
-            headers=headers
-        )
+        if session is None:
+            session = default_session()
+        session.budget.acquire()
+        req = session.builder.build(page, data, method)
     # else not private, just construct the request
     else:
         req = urllib.request.Request(
-            url,
-            headers=headers
+            API_URL + page,
+            headers=_HEADERS,
+            method=method
         )
-    rsp = urllib.request.urlopen(req)
-    return json.loads(rsp.read().decode())
+    rsp = _pool.open(req)
+    try:
+        body = rsp.read()
+    except Exception:
+        # part of the response is left on the connection
+        _pool.discard(rsp)
+        raise
+    _pool.release(rsp)
+    return json.loads(body.decode())
+
+
+def iter_array(stream, key, chunk_size=STREAM_CHUNK):
+    """
+    Decode the array under a key of a JSON object as it is read.
+    Returns a generator of the elements of the array, each decoded as soon
+    as it has been read, so neither the whole body nor the whole tree is
+    ever held in memory.
+    'stream' is a binary file-like object of the JSON
+    'key' is the key of the array, which must hold objects or arrays
+    Raises KeyError if the body has no such array
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf8')()
+    start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+    skip = re.compile(r'[\s,]*').match
+    buf = ''
+    eof = False
+
+    def read():
+        data = stream.read(chunk_size)
+        return utf8.decode(data, final=not data), not data
+
+    # find the start of the array
+    while True:
+        match = start.search(buf)
+        if match is not None:
+            buf = buf[match.end():]
+            break
+        if eof:
+            raise KeyError(key)
+        # keep enough to match a key split over two chunks
+        buf = buf[-(len(key) + 16):]
+        data, eof = read()
+        buf += data
+    pos = 0
+    while True:
+        # skip to the next element
+        pos = skip(buf, pos).end()
+        if pos < len(buf) and buf[pos] == ']':
+            break
+        try:
+            if pos == len(buf):
+                raise ValueError('need more data')
+            obj, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # the element is not all here yet
+            if eof:
+                raise
+            buf = buf[pos:]
+            pos = 0
+            data, eof = read()
+            buf += data
+            continue
+        yield obj
+
+
+class _CountingStream:
+    """
+    Wraps a response, adding the bytes read from it to stream_stats
+    """
+
+    def __init__(self, rsp):
+        self._rsp = rsp
+
+    def read(self, size=-1):
+        data = self._rsp.read(size)
+        with _stats_lock:
+            stream_stats['bytes'] += len(data)
+        return data
+
+
+# the number of bytes and responses streamed so far
+stream_stats = {'bytes': 0, 'responses': 0}
+_stats_lock = threading.Lock()
+
+
+def _stream_request(page, key):
+    """
+    Make a public request to coinex.pw, streaming the array under key in
+    the response.
+    Returns a generator of the elements of the array
+    """
+    req = urllib.request.Request(API_URL + page, headers=_HEADERS)
+    rsp = _pool.open(req)
+    stream = _CountingStream(rsp)
+    done = False
+    try:
+        for obj in iter_array(stream, key):
+            yield obj
+        stream.read()
+        done = True
+        with _stats_lock:
+            stream_stats['responses'] += 1
+    finally:
+        if done:
+            _pool.release(rsp)
+        else:
+            # there is unread data on the connection, it can't be reused
+            _pool.discard(rsp)
+
+
+def _gather(fn, args):
+    """
+    Call fn on each of args concurrently, over the pooled connections.
+    Returns a list in the order of args with what each call returned, or
+    the exception it raised
+    """
+    if not args:
+        return []
+    workers = min(MAX_WORKERS, len(args))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fn, *arg) for arg in args]
+    return [
+        fut.exception() if fut.exception() is not None else fut.result()
+        for fut in futures
+    ]
 
 
 def currencies():
@@ -126,8 +631,21 @@ def orders(trade_pair_id):
     Get a list of open orders for the given trade pair
     trade_pair_id - the id of the trade pair to lookup
     """
-    trade_pair_id = str(int(trade_pair_id))
-    return _make_request('orders?tradePair=' + trade_pair_id)['orders']
+    return list(iter_orders(trade_pair_id))
+
+
+def iter_orders(trade_pair_id, depth=None):
+    """
+    Get a generator of the open orders for the given trade pair, which
+    yields each order as soon as it has arrived
+    trade_pair_id - the id of the trade pair to lookup
+    depth - ask the server for only this many levels per side, when it
+            supports limiting the depth (see ORDERS_DEPTH_PARAM)
+    """
+    page = 'orders?tradePair=' + str(int(trade_pair_id))
+    if depth is not None and ORDERS_DEPTH_PARAM is not None:
+        page += '&{0}={1}'.format(ORDERS_DEPTH_PARAM, int(depth))
+    return _stream_request(page, 'orders')
 
 
 def last_trades(trade_pair_id):
@@ -139,21 +657,25 @@ def last_trades(trade_pair_id):
     return _make_request('trades?tradePair=' + trade_pair_id)['trades']
 
 
-def balances():
+def balances(session=None):
     """
     Get the balances for the current account
+    session - the Session of the account, defaults to default_session()
     """
-    return _make_request('balances', private=True)['balances']
+    return _make_request('balances', private=True,
+                         session=session)['balances']
 
 
-def open_orders():
+def open_orders(session=None):
     """
     Get a list of own open orders
+    session - the Session of the account, defaults to default_session()
     """
-    return _make_request('orders/own', private=True)['orders']
+    return _make_request('orders/own', private=True,
+                         session=session)['orders']
 
 
-def submit_order(trade_pair_id, amount, bid, rate):
+def submit_order(trade_pair_id, amount, bid, rate, session=None):
     """
     Submit an order to coinex.pw
 
@@ -161,6 +683,7 @@ def submit_order(trade_pair_id, amount, bid, rate):
     amount - how much to trade (decimal)
     bid - defines if order is bid (buy/true) or ask (sell/false)
     rate - Exchange rate (decimal)
+    session - the Session of the account, defaults to default_session()
     """
     trade_pair_id = int(trade_pair_id)
     bid = bool(bid)
@@ -174,23 +697,62 @@ def submit_order(trade_pair_id, amount, bid, rate):
     }
     # set the root key to 'order' as per spec
     qry = {'order': qry}
-    return _make_request('orders', data=qry, private=True)['order'][0]
+    return _make_request('orders', data=qry, private=True,
+                         session=session)['order'][0]
 
 
-def order_status(order_id):
+def order_status(order_id, session=None):
     """
     Get the status of a given order ID
+    session - the Session of the account, defaults to default_session()
     """
     order_id = str(int(order_id))
-    return _make_request('orders/' + order_id, private=True)['orders'][0]
+    return _make_request('orders/' + order_id, private=True,
+                         session=session)['orders'][0]
 
 
-def cancel_order(order_id):
+def cancel_order(order_id, session=None):
     """
     Cancel a given order
+    session - the Session of the account, defaults to default_session()
     """
     order_id = str(int(order_id))
     return _make_request(
-        'orders/' + order_id, + '/cancel',
-        private=True
+        'orders/' + order_id + '/cancel',
+        private=True,
+        method='POST',
+        session=session
     )['orders'][0]
+
+
+def submit_orders(orders, session=None):
+    """
+    Submit several orders to coinex.pw at once
+
+    orders - a list of dicts of the arguments of submit_order()
+    session - the Session of the account, defaults to default_session()
+    Returns a list in the order of orders with, for each, the order
+    coinex returned or the exception raised submitting it
+    """
+    return _gather(
+        submit_order,
+        [
+            (o['trade_pair_id'], o['amount'], o['bid'], o['rate'], session)
+            for o in orders
+        ]
+    )
+
+
+def cancel_orders(order_ids, session=None):
+    """
+    Cancel several orders at once
+
+    order_ids - a list of order ids
+    session - the Session of the account, defaults to default_session()
+    Returns a list in the order of order_ids with, for each, the order
+    coinex returned or the exception raised cancelling it
+    """
+    return _gather(
+        cancel_order,
+        [(order_id, session) for order_id in order_ids]
+    )
@@ -0,0 +1,371 @@
+"""
+distributed.py
+
+Scan the arbitrage chains across several worker processes, which may run
+on other machines.
+
+USAGE:  python distributed.py --serve HOST:PORT
+
+--serve     run a worker listening on HOST:PORT, until the coordinator
+            tells it to stop
+
+The coordinator (arbitrage.py --workers) splits the exchanges and their
+chains between the workers. A scan then goes in two rounds:
+
+    fetch   each worker fetches the top of the books of its exchanges and
+            sends them back, a few floats per exchange
+    scan    the coordinator sends every worker all the tops, each worker
+            evaluates its chains and sends back its profitable ones,
+            ranked by ROI, which the coordinator merges
+
+Every chain goes to the worker of the exchange of its first leg, so each
+chain is evaluated exactly once.
+
+Workers and the coordinator must share the secret of the COINEX_AUTHKEY
+environment variable, which authenticates every connection.
+
+NOTE: messages are pickled, only run workers for coordinators you trust
+"""
+
+from array import array
+from multiprocessing import connection
+import heapq
+import multiprocessing
+import os
+import sys
+
+import arbitrage
+import chain_cache
+import models
+
+
+# the secret shared by the coordinator and its workers
+AUTHKEY = os.environ.get('COINEX_AUTHKEY', '').encode() or None
+# seconds the coordinator waits for a local worker to start listening
+START_TIMEOUT = 30
+
+
+def parse_address(text):
+    """
+    Get the (host, port) of a 'HOST:PORT' string
+    """
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def partition(n, workers):
+    """
+    Get the worker of each of n items, dealt out in turn
+    """
+    return [i % workers for i in range(n)]
+
+
+class Worker:
+    """
+    Evaluates its shard of the chains for a coordinator
+    Attributes:
+        exchange_ids: the ids of the exchanges whose books it fetches
+        topology: the chain_cache.ChainTopology of its chains
+    handle(message) : the reply to a message of the coordinator
+    """
+
+    def __init__(self):
+        self.exchange_ids = []
+        self.topology = chain_cache.ChainTopology.from_rows([])
+        self._commands = {
+            'shard': self._shard,
+            'fetch': self._fetch,
+            'scan': self._scan,
+        }
+
+    def handle(self, message):
+        """
+        Run a (command, args...) message
+        Raises KeyError for an unknown command
+        """
+        return self._commands[message[0]](*message[1:])
+
+    def _shard(self, exchange_ids, columns):
+        """
+        Take the exchanges to fetch and the chains to evaluate, as the
+        bytes of the int32 columns of a ChainTopology
+        """
+        self.exchange_ids = list(exchange_ids)
+        cols = []
+        for data in columns:
+            col = array('i')
+            col.frombytes(data)
+            cols.append(col)
+        self.topology = chain_cache.ChainTopology(*cols)
+        return len(self.topology)
+
+    def _fetch(self, depth=arbitrage.TOP_OF_BOOK_DEPTH):
+        """
+        Get the tops of the books of our exchanges, as chain_roi() takes
+        them. An exchange whose book could not be fetched is left out.
+        """
+        ret = dict()
+        for id_ in self.exchange_ids:
+            try:
+                ex = arbitrage.SmartExchange(models.Exchange.get(id_), depth)
+                ret[id_] = ex.get_top()
+            except Exception as e:
+                sys.stderr.write(
+                    'WARNING: fetching exchange {0} failed: {1}\n'
+                    .format(id_, e)
+                )
+        return ret
+
+    def _scan(self, tops, min_roi=arbitrage.MIN_ROI):
+        """
+        Get our chains with an ROI above min_roi, as a list of
+        (roi, chain, max transfer) with the best first
+        """
+        ret = []
+        for row in self.topology:
+            roi = arbitrage.chain_roi(tops, row)
+            if roi is not None and roi > min_roi:
+                ret.append((
+                    roi,
+                    row,
+                    arbitrage.chain_max_transfer(tops, row)
+                ))
+        ret.sort(key=lambda x: -x[0])
+        return ret
+
+
+def serve(address, authkey=None, ready=None):
+    """
+    Run a Worker for coordinators connecting to address, one at a time,
+    until one sends 'stop'
+    ready: a Connection the bound address is sent on once listening
+    """
+    if authkey is None:
+        authkey = AUTHKEY
+    with connection.Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            worker = Worker()
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        message = conn.recv()
+                    except EOFError:
+                        # the coordinator went away, wait for the next one
+                        break
+                    if message[0] == 'stop':
+                        return
+                    try:
+                        conn.send((True, worker.handle(message)))
+                    except Exception as e:
+                        conn.send((False, '{0}: {1}'.format(
+                            type(e).__name__, e
+                        )))
+
+
+def start_local_workers(n, authkey, context=None):
+    """
+    Start n workers in processes of this machine
+    context: the multiprocessing context to start them with
+    Returns the list of (Process, address) of the workers
+    """
+    if context is None:
+        context = multiprocessing.get_context()
+    ret = []
+    for _ in range(n):
+        receive, send = context.Pipe(duplex=False)
+        proc = context.Process(
+            target=serve,
+            args=(('localhost', 0), authkey, send),
+            daemon=True
+        )
+        proc.start()
+        send.close()
+        if not receive.poll(START_TIMEOUT):
+            proc.terminate()
+            raise RuntimeError('A local worker did not start')
+        ret.append((proc, receive.recv()))
+        receive.close()
+    return ret
+
+
+class Coordinator:
+    """
+    Splits the chains between workers and merges what they find
+    Attributes:
+        conns: a Connection to each worker
+    load(pairs)       : split the chains of a trade pair list
+    fetch()           : the tops of every book, fetched by the workers
+    scan(tops)        : the ranked profitable chains of all the workers
+    close(stop=False) : disconnect, stopping the workers if asked
+    """
+
+    def __init__(self, addresses, authkey=None):
+        """
+        addresses: the (host, port) of each worker
+        """
+        if authkey is None:
+            authkey = AUTHKEY
+        self.conns = [
+            connection.Client(address, authkey=authkey)
+            for address in addresses
+        ]
+
+    def _call(self, messages):
+        """
+        Send each worker its message, then wait for all the replies
+        Returns the list of replies, in the order of the workers
+        Raises RuntimeError if a worker failed
+        """
+        for conn, message in zip(self.conns, messages):
+            conn.send(message)
+        ret = []
+        for conn in self.conns:
+            ok, reply = conn.recv()
+            if not ok:
+                raise RuntimeError('A worker failed: ' + reply)
+            ret.append(reply)
+        return ret
+
+    def load(self, pairs=None):
+        """
+        Give each worker its share of the exchanges and of the chains
+        pairs: a list of (exchange id, from currency id, to currency id),
+               defaults to every exchange
+        Returns the number of chains of each worker
+        """
+        if pairs is None:
+            pairs = [
+                (ex.id, ex.from_currency.id, ex.to_currency.id)
+                for ex in models.Exchange.get_all()
+            ]
+        n = len(self.conns)
+        owner = dict(
+            (pair[0], worker)
+            for pair, worker in zip(pairs, partition(len(pairs), n))
+        )
+        topology = chain_cache.get_topology(pairs, arbitrage.chain_topology)
+        shards = [[] for _ in range(n)]
+        for row in topology:
+            shards[owner[row[0]]].append(row)
+        topology.close()
+        messages = []
+        for worker, rows in enumerate(shards):
+            shard = chain_cache.ChainTopology.from_rows(rows)
+            messages.append((
+                'shard',
+                [pair[0] for pair in pairs if owner[pair[0]] == worker],
+                [col.tobytes() for col in (shard.ex1, shard.ex2, shard.ex3,
+                                           shard.flags)]
+            ))
+        return self._call(messages)
+
+    def fetch(self, depth=arbitrage.TOP_OF_BOOK_DEPTH):
+        """
+        Get the tops of every book, each fetched by the worker it belongs to
+        Returns a dict of exchange id to top, as chain_roi() takes
+        """
+        ret = dict()
+        for tops in self._call([('fetch', depth)] * len(self.conns)):
+            ret.update(tops)
+        return ret
+
+    def scan(self, tops=None, min_roi=arbitrage.MIN_ROI, limit=None):
+        """
+        Get the chains with an ROI above min_roi from every worker
+        tops: the tops of the books, as chain_roi() takes them, defaults
+              to fetching them with fetch()
+        limit: the most chains returned
+        Returns a list of (roi, chain, max transfer) with the best first
+        """
+        if tops is None:
+            tops = self.fetch()
+        found = self._call([('scan', tops, min_roi)] * len(self.conns))
+        ret = heapq.merge(*found, key=lambda x: -x[0])
+        if limit is not None:
+            return [x for x, _ in zip(ret, range(limit))]
+        return list(ret)
+
+    def close(self, stop=False):
+        """
+        Disconnect from the workers
+        stop: also tell them to exit
+        """
+        for conn in self.conns:
+            try:
+                if stop:
+                    conn.send(('stop',))
+                conn.close()
+            except OSError:
+                pass
+        self.conns = []
+
+
+def format_result(roi, chain, max_transfer):
+    """
+    Get the line printed for a chain found by a scan
+    """
+    ex1, ex2, ex3 = (models.Exchange.get(id_) for id_ in chain[:3])
+    cur1, cur2 = ex1.from_currency, ex1.to_currency
+    cur3 = ex2.to_currency if chain[3] else ex2.from_currency
+    if max_transfer is None:
+        most = '?'
+    else:
+        most = '{0:.8f}'.format(max_transfer)
+    return '{0} -> {1} -> {2} -> {0} ROI {3:.4f}% max {4} {0}'.format(
+        cur1.abbreviation,
+        cur2.abbreviation,
+        cur3.abbreviation,
+        roi * 100,
+        most
+    )
+
+
+def scan_lines(workers, min_roi=arbitrage.MIN_ROI):
+    """
+    Scan with workers and get the lines to print
+    workers: a number of local worker processes to start, or a comma
+             separated list of the HOST:PORT of running workers
+    """
+    local = []
+    authkey = AUTHKEY
+    if workers.isdigit():
+        if authkey is None:
+            authkey = os.urandom(16)
+        local = start_local_workers(int(workers), authkey)
+        addresses = [address for _, address in local]
+    else:
+        addresses = [parse_address(w) for w in workers.split(',')]
+    coordinator = Coordinator(addresses, authkey)
+    try:
+        counts = coordinator.load()
+        found = coordinator.scan(min_roi=min_roi)
+    finally:
+        coordinator.close(stop=bool(local))
+        for proc, _ in local:
+            proc.join()
+    ret = ['Split {0} chains between {1} workers'.format(
+        sum(counts), len(counts)
+    )]
+    ret.extend(format_result(*x) for x in found)
+    ret.append('Found {0} profitable chains'.format(len(found)))
+    return ret
+
+
+def main():
+    if '--serve' not in sys.argv:
+        print(__doc__)
+        return
+    if AUTHKEY is None:
+        print('Set COINEX_AUTHKEY to the secret shared with the coordinator')
+        return
+    address = parse_address(sys.argv[sys.argv.index('--serve') + 1])
+    try:
+        serve(address)
+    except KeyboardInterrupt:
+        print("Exiting")
+
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,40 @@
 list_balance.py
 
 Because coinex sucks at showing you where your coin is
+
+NOTE: this is answered by the warm service (see service.py) when it is
+running
 """
 import models
+import service
 
 
-def main():
+def balance_lines(balances):
     """
-    list all balances
+    Get the lines to print for a list of Balances
     """
-    for bal in models.Wallet.get_balances():
+    ret = []
+    for bal in balances:
         amt = bal.amount + bal.held
         if amt > 0:
-            print("{0} {1} ({2} held)".format(
+            ret.append("{0} {1} ({2} held)".format(
                 bal.currency.abbreviation,
                 bal.amount + bal.held,
                 bal.held
                 )
             )
+    return ret
+
+
+def main():
+    """
+    list all balances
+    """
+    lines = service.request('balances')
+    if lines is None:
+        lines = balance_lines(models.Wallet.get_balances())
+    for line in lines:
+        print(line)
 
 
 if __name__ == '__main__':
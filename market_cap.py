@@ -4,15 +4,31 @@ market_cap.py
 View the market capitalization of your coinex account.
 Uses bitstamp prices.
 
+USAGE:  python market_cap.py [--table] [--watch N]
+
+--table     Show the value of every coin, most valuable first
+--watch N   Re-value the portfolio every N seconds, printing it whenever
+            it changes
+
 OUTPUT:
 xxxx BTC
 xxxx USD
+
+NOTE: without --watch this is answered by the warm service (see
+service.py) when it is running
 """
 
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import math
+import operator
 import urllib.request
 import models
+import service
+import valuation
 import json
 import sys
+import time
 from decimal import *
 from urllib.error import URLError, HTTPError
 
@@ -20,100 +36,332 @@ from urllib.error import URLError, HTTPError
 # set the decimal precision to 8
 getcontext().prec = 8
 
+# seconds to wait for bitstamp before giving up
+BITSTAMP_TIMEOUT = 10
+# seconds for which a fetched USD/BTC price is reused
+PRICE_TTL = 60
+# the most requests made at once
+MAX_WORKERS = 8
+
 
-def get_bitstamp_price():
+def get_bitstamp_price(max_age=PRICE_TTL):
     """
     Get the price from bitstamp.
     Returns in units of USD/BTC
+    max_age: reuse a price fetched at most this many seconds ago
+    NOTE: this is memoized for max_age seconds
     """
-    req = urllib.request.urlopen('https://www.bitstamp.net/api/ticker/')
+    cached = getattr(get_bitstamp_price, '_cached', None)
+    if cached is not None and time.time() - cached[0] < max_age:
+        return cached[1]
+    req = urllib.request.urlopen(
+        'https://www.bitstamp.net/api/ticker/',
+        timeout=BITSTAMP_TIMEOUT
+    )
     ret = req.read().decode()
     ret = json.loads(ret)
-    return Decimal(ret['last'])
+    ret = Decimal(ret['last'])
+    get_bitstamp_price._cached = (time.time(), ret)
+    return ret
 
 
-def get_balances():
+def get_balances(refresh=False):
     """
     Memoized method to get a list of all balances.
     Also, for our purposes the total amount owned should include
     held, so do that.
+    refresh: read the balances again from models.balance_cache, which
+             only refetches them once its interval has passed
     """
-    if not hasattr(get_balances, '_balances'):
-        bals = models.Wallet.get_balances()
-        for bal in bals:
-            bal.amount += bal.held
-            bal.held = Decimal(0)
-        get_balances._balances = bals
+    if refresh or not hasattr(get_balances, '_balances'):
+        # copies, the cached Balances are kept up to date by the cache
+        get_balances._balances = [
+            models.Balance(bal.currency, bal.amount + bal.held)
+            for bal in models.balance_cache.all()
+        ]
     return get_balances._balances
 
 
-def get_amt_in_btc(bal):
+def get_btc_exchange(currency):
+    """
+    Get the Exchange that trades the given currency for BTC, or None.
+    NOTE: the lookup table is memoized
+    """
+    if not hasattr(get_btc_exchange, '_excs'):
+        excs = dict()
+        for exchange in models.Exchange.get_all():
+            if exchange.from_currency.abbreviation == 'BTC':
+                excs[exchange.to_currency.id] = exchange
+        get_btc_exchange._excs = excs
+    return get_btc_exchange._excs.get(currency.id)
+
+
+def get_books(exchanges, pool=None):
+    """
+    Fetch the orders of several exchanges at once.
+    Returns a dict of exchange id to its list of Orders
+    pool: the ThreadPoolExecutor to use, or None to make one
+    """
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            return get_books(exchanges, pool)
+    futures = dict((ex.id, pool.submit(ex.get_orders)) for ex in exchanges)
+    return dict((id_, fut.result()) for id_, fut in futures.items())
+
+
+def get_amt_in_btc(bal, books=None):
     """
     Get a Decimal representing the BTC value of the given Balance.
     Converts using an exchange if needed.
     Bal - a models.Balance object
+    books - an optional dict of exchange id to orders, as returned by
+            get_books(), used instead of fetching the exchange's orders
     """
     if bal.currency.abbreviation == 'BTC':
         return bal.amount
     # we need to convert. find an appropriate exchange
-    for exchange in models.Exchange.get_all():
-        to_correct = exchange.to_currency == bal.currency
-        from_correct = exchange.from_currency.abbreviation == 'BTC'
-        if to_correct and from_correct:
-            break
-    else:
+    exchange = get_btc_exchange(bal.currency)
+    if exchange is None:
         raise ValueError(
             'An exchange was not found that can convert {0} to BTC'.format(
                 bal.currency.abbreviation
             )
         )
-    ordr = exchange.get_highest_bid()
+    if books is not None and exchange.id in books:
+        bids = [o for o in books[exchange.id] if o.bid is True]
+        ordr = max(bids, key=lambda x: x.rate)
+    else:
+        ordr = exchange.get_highest_bid()
     return Decimal(bal.amount * ordr.rate)
 
 
-def get_amt_in_usd(btc):
+def get_amt_in_usd(btc, price=None):
     """
     Get an amount in USD as a decimal
     btc - a Decimal representing bitcoin amount
+    price - the USD/BTC price, fetched from bitstamp if not given
     returns a Decimal of usd
     """
-    return Decimal(btc * get_bitstamp_price())
+    if price is None:
+        price = get_bitstamp_price()
+    return Decimal(btc * price)
 
 
-def main():
+def get_engine():
     """
-    Get the market cap!
+    Get the ValuationEngine used to value balances.
+    NOTE: this is memoized, so paths are reused while the books are the same
+    """
+    if not hasattr(get_engine, '_engine'):
+        get_engine._engine = valuation.ValuationEngine()
+    return get_engine._engine
+
+
+def fetch_market(balances):
+    """
+    Fetch every book needed to value a list of balances and the bitstamp
+    price concurrently, and give the books to the valuation engine.
+    Only the direct BTC books are needed unless some coin has no direct
+    BTC exchange.
+    Returns the USD/BTC price, or the URLError or OSError raised if
+    bitstamp could not be reached
+    """
+    needed = []
+    for bal in balances:
+        if bal.amount + bal.held == 0 or bal.currency.abbreviation == 'BTC':
+            continue
+        exchange = get_btc_exchange(bal.currency)
+        if exchange is None:
+            # go through other coins, we need the whole graph
+            needed = models.Exchange.get_all()
+            break
+        if exchange not in needed:
+            needed.append(exchange)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        price = pool.submit(get_bitstamp_price)
+        books = get_books(needed, pool)
+        try:
+            price = price.result()
+        except (URLError, OSError) as e:
+            # a read timeout is a TimeoutError rather than a URLError
+            price = e
+    get_engine().set_books(books)
+    return price
+
+
+def get_market_cap(balances):
+    """
+    Value a list of balances, selling them through the depth of the books
+    along their best path to BTC.
+    Returns the BTC value and the USD/BTC price, or the error raised if
+    bitstamp could not be reached
     """
+    price = fetch_market(balances)
+    engine = get_engine()
     btc = Decimal(0)
-    try:
-        for balance in get_balances():
-            try:
-                btc += get_amt_in_btc(balance)
-            except ValueError:
-                sys.stderr.write(
-                    'WARNING: Cannot convert {0} to btc\n'.format(
-                        balance.currency.abbreviation
-                    )
+    for balance in balances:
+        if balance.amount == 0:
+            continue
+        try:
+            btc += engine.value(balance)
+        except ValueError:
+            sys.stderr.write(
+                'WARNING: Cannot convert {0} to btc\n'.format(
+                    balance.currency.abbreviation
                 )
-                # there isn't an exchange for this coin to BTC, ignore it
-                pass
-    except HTTPError as e:
-        print("Error: status code {0}".format(e.code))
-        print("Is coinex down?")
-        return
+            )
+            # there isn't a path for this coin to BTC, ignore it
+            pass
+    return btc, price
 
-    btc_str = '{0:12.8f}'.format(btc)
-    print('{0} BTC'.format(btc_str))
 
+def error_lines(error, site):
+    """
+    Get the lines to print for an error reaching a site
+    error: the URLError or OSError that was raised
+    """
+    if isinstance(error, HTTPError):
+        msg = "Error: status code {0}".format(error.code)
+    elif isinstance(error, URLError):
+        msg = "Error: {0}".format(error.reason)
+    else:
+        msg = "Error: {0}".format(error)
+    return [msg, "Is {0} down?".format(site)]
+
+
+def value_table(balances, rates, price):
+    """
+    Value many balances in one pass over flat float arrays.
+    balances: a list of Balances, held amounts are included
+    rates: a dict of currency id to float BTC per unit, as returned by
+           ValuationEngine.rates()
+    price: the USD/BTC price
+    Returns a list of (abbreviation, amount, btc, usd) rows, most valuable
+    first, and a (btc, usd) tuple of the totals.
+    NOTE: balances of currencies without a rate are left out
+    """
+    known = [bal for bal in balances if bal.currency.id in rates]
+    amounts = array('d', [float(bal.amount + bal.held) for bal in known])
+    btc_rates = array('d', [rates[bal.currency.id] for bal in known])
+    btc = array('d', map(operator.mul, amounts, btc_rates))
+    usd = array('d', map(float(price).__mul__, btc))
+    order = sorted(range(len(known)), key=btc.__getitem__, reverse=True)
+    rows = [
+        (known[i].currency.abbreviation, amounts[i], btc[i], usd[i])
+        for i in order
+    ]
+    return rows, (math.fsum(btc), math.fsum(usd))
+
+
+def sell_rates(balances, engine):
+    """
+    Get the float BTC per unit each balance fetches when sold through the
+    depth of the books, as get_market_cap() values it
+    Returns a dict of currency id to rate, for value_table()
+    NOTE: balances without a path to BTC are left out
+    """
+    ret = dict()
+    for bal in balances:
+        amt = bal.amount + bal.held
+        if amt == 0:
+            continue
+        try:
+            ret[bal.currency.id] = float(engine.value(bal)) / float(amt)
+        except ValueError:
+            pass
+    return ret
+
+
+def show_table(refresh=False):
+    """
+    Get the value of every balance as the lines of a table to print,
+    selling it through the depth of the books as get_market_cap() does
+    refresh: fetch the balances again instead of using the memoized ones
+    """
     try:
-        usd = get_amt_in_usd(btc)
-    except HTTPError as e:
-        print("Error: status code {0}".format(e.code))
-        print("Is bitstramp down?")
-        return
+        balances = get_balances(refresh)
+        price = fetch_market(balances)
+    except (URLError, OSError) as e:
+        return error_lines(e, 'coinex')
+    failed = isinstance(price, Exception)
+    # without a bitstamp price there is no USD column, rather than zeros
+    rows, totals = value_table(
+        balances,
+        sell_rates(balances, get_engine()),
+        0 if failed else price
+    )
+    if failed:
+        fmt = '{0:>6} {1:>20.8f} {2:>16.8f}'
+        ret = ['{0:>6} {1:>20} {2:>16}'.format('COIN', 'AMOUNT', 'BTC')]
+    else:
+        fmt = '{0:>6} {1:>20.8f} {2:>16.8f} {3:>14.2f}'
+        ret = ['{0:>6} {1:>20} {2:>16} {3:>14}'.format(
+            'COIN', 'AMOUNT', 'BTC', 'USD'
+        )]
+    for row in rows:
+        if row[1] > 0:
+            ret.append(fmt.format(*row))
+    if failed:
+        ret.append('{0:>6} {1:>20} {2:>16.8f}'.format(
+            'TOTAL', '', totals[0]
+        ))
+        return ret + error_lines(price, 'bitstamp')
+    ret.append('{0:>6} {1:>20} {2:>16.8f} {3:>14.2f}'.format(
+        'TOTAL', '', *totals
+    ))
+    return ret
+
 
+def show_market_cap(refresh=False):
+    """
+    Get the market cap as the lines to print
+    refresh: fetch the balances again instead of using the memoized ones
+    """
+    try:
+        btc, price = get_market_cap(get_balances(refresh))
+    except (URLError, OSError) as e:
+        return error_lines(e, 'coinex')
+
+    btc_str = '{0:12.8f}'.format(btc)
+    ret = ['{0} BTC'.format(btc_str)]
+
+    if isinstance(price, Exception):
+        return ret + error_lines(price, 'bitstamp')
+
+    usd = get_amt_in_usd(btc, price)
     usd_str = '{0:12.8f}'.format(usd)
-    print('{0} USD'.format(usd_str))
+    ret.append('{0} USD'.format(usd_str))
+    return ret
+
+
+def main():
+    """
+    Get the market cap!
+    """
+    show = show_table if '--table' in sys.argv else show_market_cap
+    if '--watch' not in sys.argv:
+        lines = service.request(
+            'market_cap',
+            ['--table'] if '--table' in sys.argv else []
+        )
+        if lines is None:
+            lines = show()
+        print('\n'.join(lines))
+        return
+    interval = float(sys.argv[sys.argv.index('--watch') + 1])
+    last = None
+    try:
+        while True:
+            # the balances and the bitstamp price are only refetched once
+            # their caches expire, the books are what changes
+            lines = show(refresh=True)
+            if lines != last:
+                print(time.strftime('%Y-%m-%d %H:%M:%S'))
+                print('\n'.join(lines))
+                last = lines
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Exiting")
 
 if __name__ == '__main__':
     main()
@@ -6,11 +6,22 @@ Contains models for the coinex API
 from decimal import *
 import coinex_api
 from datetime import datetime
+from collections import OrderedDict
+import heapq
+import sys
+import threading
+import time
+import weakref
 
 
 # set the decimal precision to 8
 getcontext().prec = 8
 
+# seconds between checking the cached balances against coinex
+BALANCE_REFRESH = 60
+# seconds between reconciling the mirror of own orders with coinex
+OWN_ORDERS_RECONCILE = 30
+
 
 class Balance:
     """
@@ -53,11 +64,17 @@ class Balance:
         return not self.__eq__(other)
 
     @classmethod
-    def get_own(cls):
+    def get_own(cls, session=None):
         """
         Get all own balances
+        session: the coinex_api.Session of the account, defaults to the
+                 default one
+        NOTE: only the balances of the default account are registered
         """
-        bals = coinex_api.balances()
+        if session is None:
+            bals = coinex_api.balances()
+        else:
+            bals = session.balances()
         ret = []
         for bal in bals:
             curr = Currency.get(bal['currency_id'])
@@ -65,10 +82,102 @@ class Balance:
             held = Decimal(bal['held']) / pow(10, 8)
             b = Balance(curr, amt, held=held)
             ret.append(b)
-            registry.put(b)
+            if session is None:
+                registry.put(b)
         return ret
 
 
+def _best_levels(rows, depth):
+    """
+    Keep only the order rows at the best depth rates of each side of a book
+    rows: an iterable of orders as returned by coinex_api
+    Returns the list of kept rows and the number of rows seen
+    """
+    # side -> rate -> rows, and side -> heap of the kept rates, worst first
+    kept = {True: dict(), False: dict()}
+    heaps = {True: [], False: []}
+    seen = 0
+    for row in rows:
+        seen += 1
+        bid = row['bid'] is True
+        levels = kept[bid]
+        if row['rate'] in levels:
+            levels[row['rate']].append(row)
+            continue
+        # the best bids are the highest, the best asks the lowest
+        key = row['rate'] if bid else -row['rate']
+        heap = heaps[bid]
+        if len(heap) < depth:
+            heapq.heappush(heap, key)
+        elif key > heap[0]:
+            worst = heapq.heapreplace(heap, key)
+            del levels[worst if bid else -worst]
+        else:
+            continue
+        levels[row['rate']] = [row]
+    ret = []
+    for levels in kept.values():
+        for level in levels.values():
+            ret.extend(level)
+    return ret, seen
+
+
+class BookStats:
+    """
+    Counts what fetching order books cost
+    Attributes:
+        books: the number of books fetched
+        rows: the number of order rows received
+        kept: the number of Orders built from them
+        build_seconds: the time spent building those Orders
+        start_bytes: coinex_api.stream_stats['bytes'] when last reset
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Start counting from zero
+        """
+        self.books = 0
+        self.rows = 0
+        self.kept = 0
+        self.build_seconds = 0.0
+        self.start_bytes = coinex_api.stream_stats['bytes']
+
+    def add(self, rows, kept, build_seconds):
+        """
+        Count one fetched book
+        """
+        with self._lock:
+            self.books += 1
+            self.rows += rows
+            self.kept += kept
+            self.build_seconds += build_seconds
+
+    def saved_seconds(self):
+        """
+        Estimate the time saved by not building Orders for the rows that
+        were dropped, at the average time it took per kept row
+        """
+        if self.kept == 0:
+            return 0.0
+        return (self.rows - self.kept) * self.build_seconds / self.kept
+
+    def __str__(self):
+        received = coinex_api.stream_stats['bytes'] - self.start_bytes
+        return ('Fetched {0} books, {1:.1f} KB, built {2} of {3} orders, '
+                'saved ~{4:.1f} ms of parsing').format(
+            self.books,
+            received / 1024,
+            self.kept,
+            self.rows,
+            self.saved_seconds() * 1000
+        )
+
+
 class Currency:
     """
     A container for a currency
@@ -133,9 +242,12 @@ class Exchange:
         get_recent_trades() : get a list of recently executed trades
     Exchange.get(int_): get the Exchange for this ID
     Exchange.get_all(): get all Exchanges available
+    Exchange.add_orders_listener(cb): call cb(exchange, orders) on each
+                                      whole book fetched by get_orders()
     """
 
     _loaded = False
+    _orders_listeners = []
 
     def __init__(self, trade_pair_id, from_currency, to_currency):
         """
@@ -167,17 +279,32 @@ class Exchange:
         else:
             raise ValueError("The to_currency was invalid")
 
-    def get_orders(self):
+    def get_orders(self, depth=None):
         """
         Load / get all orders for the current exchange
+        depth: only keep the orders at the best depth rates of each side,
+               no Orders are built for the rest of the book
         """
-        # remove old ones if needed
-        ords = coinex_api.orders(self.id)
+        # build the orders as they stream in
+        ords = coinex_api.iter_orders(self.id, depth=depth)
+        if depth is not None:
+            ords, seen = _best_levels(ords, depth)
+        start = time.perf_counter()
         ret = []
         for order in ords:
             o = Order(API_resp=order)
             registry.put(o)
             ret.append(o)
+        book_stats.add(
+            seen if depth is not None else len(ret),
+            len(ret),
+            time.perf_counter() - start
+        )
+        # listeners record and diff whole books, a trimmed one would look
+        # like every deeper order was gone
+        if depth is None:
+            for cb in Exchange._orders_listeners:
+                cb(self, ret)
         return ret
 
     def get_recent_trades(self):
@@ -226,6 +353,24 @@ class Exchange:
             target_cur.abbreviation
         )
 
+    @classmethod
+    def add_orders_listener(cls, cb):
+        """
+        Register cb to be called as cb(exchange, orders) with every book
+        fetched by get_orders()
+        NOTE: books fetched with a depth are not passed on, only whole ones
+        """
+        if cb not in Exchange._orders_listeners:
+            Exchange._orders_listeners.append(cb)
+
+    @classmethod
+    def remove_orders_listener(cls, cb):
+        """
+        Stop calling a callback registered with add_orders_listener()
+        """
+        if cb in Exchange._orders_listeners:
+            Exchange._orders_listeners.remove(cb)
+
     @classmethod
     def _refresh(cls):
         """
@@ -269,9 +414,18 @@ class Order:
         filled: the amount of this order that has been filled
         cancelled: true if this order is cancelled
         complete: true if this order is completed
+        session: the coinex_api.Session the order is placed as, None for
+                 the default account
     Order.get_own() : get all own orders
+    order.submit(), order.cancel(), order.refresh() : place, cancel or
+        update one of our orders
+    Order.submit_many(orders) : submit several orders at once
+    Order.cancel_many(orders) : cancel several orders at once
     """
 
+    # kept when __init__ is called again with what coinex reported
+    session = None
+
     def __init__(self,
                  API_resp=None,
                  order_id=None,
@@ -332,19 +486,10 @@ class Order:
     def get_own(cls):
         """
         Get all own orders
+        NOTE: this reconciles own_orders, reusing the Orders that did not
+        change
         """
-        ords = coinex_api.open_orders()
-        ret = []
-        for ordr in ords:
-            exc = Exchange.get(ordr['trade_pair_id'])
-            amt = Decimal(ordr['amount']) / pow(10, 8)
-            rate = Decimal(ordr['rate']) / pow(10, 8)
-            ret.append(
-                Order(
-                    API_resp=ordr
-                )
-            )
-        return ret
+        return own_orders.reconcile()
 
     def get_compliment(self, transac_fee=Decimal('0.002'), max_amt=None):
         """
@@ -363,6 +508,15 @@ class Order:
         )
         return other
 
+    def _api(self):
+        """
+        Get what the private calls of this order are made through, its
+        session or the coinex_api module
+        """
+        if self.session is None:
+            return coinex_api
+        return self.session
+
     def submit(self):
         """
         Submit this order to the coinex api.
@@ -370,15 +524,84 @@ class Order:
         the new ones reported by coinex_api, and
         also returns the parsed JSON returned by coinex
         """
-        ordr = coinex_api.submit_order(
+        ordr = self._api().submit_order(
             trade_pair_id=self.exchange.id,
             amount=self.amount,
             bid=self.bid,
             rate=self.rate
         )
         self.__init__(API_resp=ordr)
+        track_own_order(self)
+        return ordr
+
+    def cancel(self):
+        """
+        Cancel this order.
+        Resets this object's properties to reflect the ones reported by
+        coinex_api, and also returns the parsed JSON returned by coinex
+        """
+        ordr = self._api().cancel_order(self.id)
+        self.__init__(API_resp=ordr)
+        track_own_order(self)
+        return ordr
+
+    def refresh(self):
+        """
+        Fetch the current status of this order.
+        Resets this object's properties to reflect the ones reported by
+        coinex_api, and also returns the parsed JSON returned by coinex
+        """
+        ordr = self._api().order_status(self.id)
+        self.__init__(API_resp=ordr)
+        track_own_order(self)
         return ordr
 
+    @classmethod
+    def submit_many(cls, orders):
+        """
+        Submit several orders to the coinex api at once.
+        Each order that was accepted is reset to reflect the properties
+        reported by coinex_api, as submit() does.
+        NOTE: the orders are all placed as the session of the first one
+        Returns a list in the order of orders with, for each, the parsed
+        JSON returned by coinex or the exception raised submitting it
+        """
+        if not orders:
+            return []
+        rsps = orders[0]._api().submit_orders([
+            {
+                'trade_pair_id': ordr.exchange.id,
+                'amount': ordr.amount,
+                'bid': ordr.bid,
+                'rate': ordr.rate
+            }
+            for ordr in orders
+        ])
+        for ordr, rsp in zip(orders, rsps):
+            if not isinstance(rsp, Exception):
+                ordr.__init__(API_resp=rsp)
+                track_own_order(ordr)
+        return rsps
+
+    @classmethod
+    def cancel_many(cls, orders):
+        """
+        Cancel several orders at once.
+        Each order that was cancelled is reset to reflect the properties
+        reported by coinex_api.
+        NOTE: the orders are all cancelled as the session of the first one
+        Returns a list in the order of orders with, for each, the parsed
+        JSON returned by coinex or the exception raised cancelling it
+        """
+        if not orders:
+            return []
+        rsps = orders[0]._api().cancel_orders([ordr.id for ordr in orders])
+        for ordr, rsp in zip(orders, rsps):
+            if not isinstance(rsp, Exception):
+                ordr.__init__(API_resp=rsp)
+                track_own_order(ordr)
+        return rsps
+
 
 class Wallet:
     """
@@ -399,14 +622,526 @@ class Wallet:
     def get_orders(cls):
         return Order.get_own()
 
+    @classmethod
+    def get_balance(cls, currency, session=None):
+        """
+        Get the cached own Balance of a currency, or None if there is none
+        session: the coinex_api.Session of the account, defaults to the
+                 default one
+        """
+        return get_account(session).balances.get(currency)
+
+
+# marks an order whose fills the refetched balances already include
+_REBASE = object()
+
+
+class BalanceCache:
+    """
+    Keeps the own balances by currency, updated locally as our own orders
+    are submitted, filled and cancelled, and checked against coinex every
+    interval seconds.
+    Attributes:
+        interval: seconds between refreshes, or None to only refresh when
+                  the cache is empty
+        transac_fee: the Decimal fee taken from what a fill credits
+    get(currency)    : the Balance of a currency
+    all()            : the list of all Balances
+    amount(currency) : the Decimal available amount of a currency
+    record(order)    : apply what changed in one of our orders
+    refresh()        : refetch the balances now
+    """
+
+    def __init__(self,
+                 fetch=None,
+                 interval=BALANCE_REFRESH,
+                 transac_fee=Decimal('0.002'),
+                 clock=time.monotonic):
+        """
+        fetch: a function returning a list of Balances, defaults to
+               Balance.get_own
+        clock: a function returning the current time in seconds
+        """
+        self._fetch = fetch
+        self.interval = interval
+        self.transac_fee = Decimal(transac_fee)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._bals = None
+        self._loaded_at = None
+        # open order id -> amount of it already applied as filled, or
+        # _REBASE when the balances were refetched since
+        self._filled = dict()
+        # ids of the orders that finished since the last refresh, and
+        # between the two refreshes before
+        self._finished = set()
+        self._finished_before = set()
+
+    def refresh(self):
+        """
+        Refetch the balances from coinex, replacing the local estimate.
+        The fetched balances already reflect our orders, so the next
+        record of each open order only takes it as the new baseline, and
+        orders that finished before the previous refresh are forgotten.
+        """
+        fetch = self._fetch or Balance.get_own
+        bals = fetch()
+        with self._lock:
+            self._bals = dict((bal.currency.id, bal) for bal in bals)
+            self._loaded_at = self._clock()
+            self._filled = dict.fromkeys(self._filled, _REBASE)
+            self._finished_before = self._finished
+            self._finished = set()
+
+    def invalidate(self):
+        """
+        Drop the balances so the next lookup refetches them
+        """
+        with self._lock:
+            self._bals = None
+
+    def _stale(self):
+        if self._bals is None:
+            return True
+        if self.interval is None:
+            return False
+        return self._clock() - self._loaded_at >= self.interval
+
+    def get(self, currency):
+        """
+        Get the Balance of a currency, or None if there is none
+        currency: a Currency or a currency id
+        """
+        if self._stale():
+            self.refresh()
+        if isinstance(currency, Currency):
+            currency = currency.id
+        return self._bals.get(currency)
+
+    def all(self):
+        """
+        Get the list of all Balances
+        """
+        if self._stale():
+            self.refresh()
+        return list(self._bals.values())
+
+    def amount(self, currency):
+        """
+        Get the Decimal amount of a currency available to trade
+        """
+        bal = self.get(currency)
+        if bal is None:
+            return Decimal(0)
+        return bal.amount
+
+    def _move(self, currency, amount=0, held=0):
+        """
+        Adjust the balance of a currency
+        """
+        bal = self._bals.get(currency.id)
+        if bal is None:
+            bal = Balance(currency, 0)
+            self._bals[currency.id] = bal
+        bal.amount += amount
+        bal.held += held
+
+    def record(self, order):
+        """
+        Apply what changed in one of our orders since it was last recorded:
+        a new order holds what it spends, a fill pays out of the hold and
+        credits what was bought, and a cancel releases what is left held
+        order: an Order as reported by coinex_api
+        NOTE: nothing is applied until the balances are loaded, since the
+        loaded balances already reflect the order. Likewise, the first
+        record of an order after a refresh is only taken as its baseline,
+        so what changed in between shows up at the next refresh
+        NOTE: only record orders placed through this process, as the first
+        time an order is seen it is taken to be new
+        """
+        if order.id is None or order.id < 0:
+            return
+        with self._lock:
+            if (order.id in self._finished or
+                    order.id in self._finished_before):
+                # already finished and applied
+                return
+            known = order.id in self._filled
+            before = self._filled.get(order.id, Decimal(0))
+            done = order.cancelled or order.complete
+            if done:
+                self._filled.pop(order.id, None)
+                self._finished.add(order.id)
+            else:
+                self._filled[order.id] = order.filled
+            if self._bals is None or before is _REBASE:
+                return
+            ex = order.exchange
+            # bids spend from_currency, asks spend to_currency
+            if order.bid:
+                spent, got = ex.from_currency, ex.to_currency
+            else:
+                spent, got = ex.to_currency, ex.from_currency
+
+            def cost(amt):
+                # the amount of the spent currency for amt of to_currency
+                return amt * order.rate if order.bid else amt
+
+            def gain(amt):
+                # the amount of the bought currency for amt of to_currency
+                gross = amt if order.bid else amt * order.rate
+                return gross * (1 - self.transac_fee)
+
+            if not known:
+                # a new order holds all it can spend
+                self._move(spent,
+                           amount=-cost(order.amount),
+                           held=cost(order.amount))
+            delta = order.filled - before
+            if delta > 0:
+                self._move(spent, held=-cost(delta))
+                self._move(got, amount=gain(delta))
+            if done:
+                left = cost(order.amount - order.filled)
+                self._move(spent, amount=left, held=-left)
+
+
+def _held_by(order):
+    """
+    Get the Currency an open order spends and the Decimal amount of it
+    the order still holds
+    """
+    left = order.amount - order.filled
+    # bids spend from_currency, asks spend to_currency
+    if order.bid:
+        return order.exchange.from_currency, left * order.rate
+    return order.exchange.to_currency, left
+
+
+class OwnOrders:
+    """
+    An id-indexed mirror of our own open orders, updated as soon as coinex
+    reports on one of them and reconciled with coinex every interval
+    Attributes:
+        interval: seconds between two reconciles in the background
+        session: the coinex_api.Session of the orders, None for the
+                 default account
+    track(order)          : update the mirror from an order coinex reported
+    get(order_id)         : the open Order of an id, or None
+    reserved(currency)    : the Decimal amount held by open orders
+    outstanding(exchange) : the open Orders on an exchange
+    reconcile()           : replace the mirror with coinex's open orders
+    start(), stop()       : reconcile every interval in a background thread
+    """
+
+    def __init__(self, fetch=None, interval=OWN_ORDERS_RECONCILE,
+                 session=None):
+        """
+        fetch: a function returning the open orders as coinex_api does,
+               defaults to coinex_api.open_orders
+        session: the coinex_api.Session the orders belong to, which the
+                 Orders built by reconcile() are placed as
+        """
+        self._fetch = fetch
+        self.session = session
+        self.interval = interval
+        self._lock = threading.RLock()
+        self._orders = dict()
+        # exchange id -> order id -> Order
+        self._by_exchange = dict()
+        # currency id -> Decimal held
+        self._reserved = dict()
+        # order id -> (currency id, Decimal held) as it was added, since
+        # the Order itself changes when it is refreshed
+        self._held = dict()
+        # a dict of order id -> Order for each running reconcile, of the
+        # orders tracked while it was fetching
+        self._tracking = []
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._orders)
+
+    def _add(self, order):
+        self._orders[order.id] = order
+        self._by_exchange.setdefault(order.exchange.id, {})[order.id] = order
+        cur, held = _held_by(order)
+        self._held[order.id] = (cur.id, held)
+        self._reserved[cur.id] = self._reserved.get(cur.id, 0) + held
+
+    def _remove(self, order_id):
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return
+        orders = self._by_exchange[order.exchange.id]
+        del orders[order_id]
+        if not orders:
+            del self._by_exchange[order.exchange.id]
+        cur_id, held = self._held.pop(order_id)
+        self._reserved[cur_id] -= held
+        if self._reserved[cur_id] == 0:
+            del self._reserved[cur_id]
+
+    def track(self, order):
+        """
+        Update the mirror from one of our orders as coinex reported it,
+        dropping it once it is cancelled or complete
+        """
+        if order.id is None or order.id < 0:
+            return
+        with self._lock:
+            for tracked in self._tracking:
+                tracked[order.id] = order
+            self._remove(order.id)
+            if not order.cancelled and not order.complete:
+                self._add(order)
+
+    def get(self, order_id):
+        """
+        Get the open Order of an id, or None
+        """
+        return self._orders.get(order_id)
+
+    def reserved(self, currency):
+        """
+        Get the Decimal amount of a currency held by our open orders
+        currency: a Currency or a currency id
+        """
+        if isinstance(currency, Currency):
+            currency = currency.id
+        return self._reserved.get(currency, Decimal(0))
+
+    def outstanding(self, exchange):
+        """
+        Get the list of our open Orders on an exchange
+        exchange: an Exchange or an exchange id
+        """
+        if isinstance(exchange, Exchange):
+            exchange = exchange.id
+        return list(self._by_exchange.get(exchange, {}).values())
+
+    def reconcile(self):
+        """
+        Replace the mirror with the open orders coinex reports, reusing the
+        Orders that did not change
+        NOTE: orders tracked while coinex is asked are kept as tracked,
+              since the report may predate them
+        Returns the list of open Orders
+        """
+        fetch = self._fetch or coinex_api.open_orders
+        tracked = dict()
+        with self._lock:
+            self._tracking.append(tracked)
+        try:
+            rows = fetch()
+        finally:
+            with self._lock:
+                self._tracking = [
+                    t for t in self._tracking if t is not tracked
+                ]
+        with self._lock:
+            ret = []
+            for row in rows:
+                if row['id'] in tracked:
+                    continue
+                old = self._orders.get(row['id'])
+                if (old is not None and
+                        old.filled == Decimal(row['filled']) / pow(10, 8) and
+                        old.amount == Decimal(row['amount']) / pow(10, 8)):
+                    ret.append(old)
+                else:
+                    order = Order(API_resp=row)
+                    order.session = self.session
+                    ret.append(order)
+            ret.extend(
+                order for order in tracked.values()
+                if not order.cancelled and not order.complete
+            )
+            for id_ in list(self._orders.keys()):
+                self._remove(id_)
+            for order in ret:
+                if not order.cancelled and not order.complete:
+                    self._add(order)
+        return ret
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                sys.stderr.write(
+                    'WARNING: reconciling own orders failed: {0}\n'.format(e)
+                )
+
+    def start(self):
+        """
+        Reconcile every interval in a background thread
+        """
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+
+class Account:
+    """
+    The cached balances and own orders of one account
+    Attributes:
+        session: the coinex_api.Session of the account, None for the
+                 default one
+        balances: its BalanceCache
+        orders: its OwnOrders
+    """
+
+    def __init__(self, session=None, balances=None, orders=None):
+        self.session = session
+        if balances is None:
+            balances = BalanceCache(fetch=lambda: Balance.get_own(session))
+        if orders is None:
+            orders = OwnOrders(
+                fetch=lambda: session.open_orders(),
+                session=session
+            )
+        self.balances = balances
+        self.orders = orders
+
+
+def get_account(session=None):
+    """
+    Get the Account of a coinex_api.Session, the default account of
+    balance_cache and own_orders for None or coinex_api.default_session()
+    """
+    # a session that was never made cannot be the default one, so the
+    # config file is not read for it
+    if (session is None or
+            session is getattr(coinex_api.default_session, '_session', None)):
+        return default_account
+    with _accounts_lock:
+        ret = _accounts.get(session)
+        if ret is None:
+            ret = _accounts[session] = Account(session)
+        return ret
+
+
+def track_own_order(order):
+    """
+    Apply what coinex reported about one of our orders to the balances and
+    own orders of its account
+    """
+    account = get_account(order.session)
+    account.balances.record(order)
+    account.orders.track(order)
+
+
+class RetentionPolicy:
+    """
+    Describes how the Registry holds on to the models of one class
+    Attributes:
+        max_entries: an int, evict the least recently used model past this
+                     many entries, or None for no cap
+        ttl: number of seconds a model stays in the registry after it was
+             put, or None to keep it forever
+        weak: true to only hold weak references, so the model is dropped as
+              soon as nothing else uses it
+    """
+
+    def __init__(self, max_entries=None, ttl=None, weak=False):
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries should be at least 1")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl should be positive")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.weak = bool(weak)
+
 
 class Registry:
     """
     Maintains a registry of all models
+    Each model class is kept according to its RetentionPolicy, classes
+    without one are held strongly forever.
     """
 
-    def __init__(self):
+    def __init__(self, clock=time.monotonic):
+        """
+        clock: a function returning the current time in seconds, used for
+               the TTL of policies
+        """
         self._dct = {}
+        self._stamps = {}
+        self._policies = {}
+        self._clock = clock
+
+    def set_policy(self, cls, policy):
+        """
+        Set the RetentionPolicy for a model class.
+        Models already in the registry are kept under the new policy.
+        cls: the class of model
+        policy: a RetentionPolicy, or None to hold strongly forever
+        """
+        old = self._dct.pop(cls, {})
+        self._stamps.pop(cls, None)
+        if policy is None:
+            self._policies.pop(cls, None)
+        else:
+            self._policies[cls] = policy
+        for key in list(old.keys()):
+            obj = old.get(key)
+            if obj is not None:
+                self.put(obj)
+
+    def get_policy(self, cls):
+        """
+        Get the RetentionPolicy of a model class, or None if it has none
+        """
+        return self._policies.get(cls)
+
+    def _store(self, cls):
+        """
+        Get (creating if needed) the dict of models for a class
+        """
+        if cls not in self._dct:
+            policy = self._policies.get(cls)
+            if policy is not None and policy.weak:
+                self._dct[cls] = weakref.WeakValueDictionary()
+            else:
+                self._dct[cls] = OrderedDict()
+            if policy is not None and policy.ttl is not None:
+                self._stamps[cls] = {}
+        return self._dct[cls]
+
+    def _expired(self, cls, id_, now):
+        """
+        Returns true if the model of the given class and id outlived its TTL
+        """
+        stamps = self._stamps.get(cls)
+        if stamps is None or id_ not in stamps:
+            return False
+        return now - stamps[id_] > self._policies[cls].ttl
+
+    def _remove(self, cls, id_):
+        """
+        Remove a model from the registry, returning it or None
+        """
+        stamps = self._stamps.get(cls)
+        if stamps is not None:
+            stamps.pop(id_, None)
+        store = self._dct.get(cls)
+        if store is None:
+            return None
+        return store.pop(id_, None)
 
     def get(self, model, id_):
         """
@@ -414,30 +1149,49 @@ class Registry:
         model: the class of model to get
         id_: the id of the model to get
         """
-        if model in self._dct and id_ in self._dct[model]:
-            return self._dct[model][id_]
-        else:
+        store = self._dct.get(model)
+        if store is None:
+            return None
+        ret = store.get(id_)
+        if ret is None:
             return None
+        if self._expired(model, id_, self._clock()):
+            self._remove(model, id_)
+            return None
+        if isinstance(store, OrderedDict):
+            store.move_to_end(id_)
+        return ret
 
     def get_all(self, cls):
         """
         returns a list for all the objects in the registry
         """
-        ret = []
-        dct = self._dct[cls]
-        if dct is not None:
-            for key in dct:
-                ret.append(dct[key])
-        return ret
+        if cls not in self._dct:
+            return []
+        self.purge(cls)
+        return list(self._dct[cls].values())
 
     def put(self, model):
         """
         Put a model into the registry
         """
         cls = model.__class__
-        if not (cls in self._dct):
-            self._dct[cls] = {}
-        self._dct[cls][model.id] = model
+        store = self._store(cls)
+        store[model.id] = model
+        if isinstance(store, OrderedDict):
+            store.move_to_end(model.id)
+        stamps = self._stamps.get(cls)
+        if stamps is not None:
+            stamps[model.id] = self._clock()
+            # weakly held models vanish without telling us, sweep their
+            # stamps every so often
+            if len(stamps) > 2 * len(store) + 64:
+                for key in [k for k in stamps if k not in store]:
+                    del stamps[key]
+        policy = self._policies.get(cls)
+        if policy is not None and policy.max_entries is not None:
+            while len(store) > policy.max_entries:
+                self._remove(cls, next(iter(store.keys())))
 
     def delete(self, obj, model=None):
         """
@@ -447,26 +1201,64 @@ class Registry:
         returns the model that was deleted, or null if none was found
         """
         if isinstance(obj, int):
-            if model in self._dct:
-                if obj in self._dct[model]:
-                    ret = self._dct[model][obj]
-                    self._dct[model][obj] = None
-                    return ret
-        else:
-            cls = obj.__class__
-            if cls in self._dct:
-                if obj.id in self._dct[cls]:
-                    ret = self._dct[cls][obj.id]
-                    self._dct[cls][obj.id] = None
-                    return ret
-        return None
+            return self._remove(model, obj)
+        return self._remove(obj.__class__, obj.id)
 
     def delete_all(self, cls):
         """
         Delete all of a certain class from the registry
         cls: the class to remove
         """
-        self._dct[cls] = {}
+        self._dct.pop(cls, None)
+        self._stamps.pop(cls, None)
+
+    def purge(self, cls=None):
+        """
+        Remove every model that outlived its TTL
+        cls: only purge this class, or all classes if None
+        returns the number of models removed
+        """
+        classes = [cls] if cls is not None else list(self._stamps.keys())
+        now = self._clock()
+        n = 0
+        for klass in classes:
+            stamps = self._stamps.get(klass)
+            if stamps is None:
+                continue
+            for id_ in list(stamps.keys()):
+                if self._expired(klass, id_, now):
+                    if self._remove(klass, id_) is not None:
+                        n += 1
+                elif id_ not in self._dct[klass]:
+                    del stamps[id_]
+        return n
+
+    def stats(self):
+        """
+        Report what the registry holds.
+        Returns a dict of model class to a dict with the number of 'entries'
+        and an estimate of the 'bytes' they use
+        """
+        self.purge()
+        ret = {}
+        for cls, store in self._dct.items():
+            size = sys.getsizeof(store)
+            models = list(store.values())
+            for obj in models:
+                size += sys.getsizeof(obj)
+                if hasattr(obj, '__dict__'):
+                    size += sys.getsizeof(obj.__dict__)
+            ret[cls] = {'entries': len(models), 'bytes': size}
+        return ret
 
 
 registry = Registry()
+book_stats = BookStats()
+balance_cache = BalanceCache()
+own_orders = OwnOrders()
+default_account = Account(balances=balance_cache, orders=own_orders)
+_accounts = dict()
+_accounts_lock = threading.Lock()
+# orders and balances churn on every fetch, only keep them while in use
+registry.set_policy(Order, RetentionPolicy(weak=True))
+registry.set_policy(Balance, RetentionPolicy(weak=True))
@@ -0,0 +1,276 @@
+"""
+scheduler.py
+
+Spend a fixed budget of order book requests on the books that matter.
+
+Every exchange gets a refresh priority from:
+    - how close the ROI of its best chain came to zero (or above),
+    - how often its top of book changed recently,
+    - how long ago it was fetched.
+Each request goes to the exchange of highest priority, so the books of
+near-profitable chains are refreshed more often than the rest without
+raising the total request volume. The age term keeps every book
+refreshed eventually.
+
+USAGE:  python scheduler.py [BUDGET]
+
+BUDGET  the number of book requests per second (default REQUEST_BUDGET)
+"""
+
+import math
+import sys
+import time
+
+import arbitrage
+import book_diff
+import models
+
+
+# the number of book requests per second
+REQUEST_BUDGET = 2.0
+# the ROI below zero at which a chain is half as hot as a profitable one
+ROI_SCALE = 0.01
+# the weight of exchanges whose chains are far from profitable, so they
+# are still refreshed now and then
+MIN_WEIGHT = 0.05
+# seconds of top of book changes per second that double the priority
+CHANGE_WEIGHT = 10.0
+# weight of the newest observation in the change rate average
+RATE_SMOOTHING = 0.3
+
+
+class ExchangeState:
+    """
+    The refresh state of one exchange
+    Attributes:
+        exchange: the models.Exchange
+        last_fetch: when the book was last fetched, or None
+        change_rate: the smoothed number of top of book changes per second
+        closeness: from 0 to 1, how close its best chain is to profit
+        fetches: the number of times the book was fetched
+    """
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.last_fetch = None
+        self.change_rate = 0.0
+        self.closeness = 1.0
+        self.fetches = 0
+
+    def priority(self, now):
+        """
+        Get the float refresh priority at time now, higher goes first
+        """
+        if self.last_fetch is None:
+            return math.inf
+        age = now - self.last_fetch
+        return (
+            age *
+            (MIN_WEIGHT + self.closeness) *
+            (1 + self.change_rate * CHANGE_WEIGHT)
+        )
+
+
+def closeness(roi):
+    """
+    Get from 0 to 1 how close an ROI is to break even, where a profitable
+    ROI is 1 and None (the chain cannot be executed) is 0
+    """
+    if roi is None:
+        return 0.0
+    if roi >= 0:
+        return 1.0
+    return 1 / (1 - roi / ROI_SCALE)
+
+
+def _top_floats(top):
+    """
+    Turn a BookDiffer top into the tops tuple of arbitrage.chain_roi()
+    """
+    (bid, bid_amt), (ask, ask_amt) = top
+    return (
+        None if bid is None else float(bid),
+        float(bid_amt),
+        None if ask is None else float(ask),
+        float(ask_amt)
+    )
+
+
+class RefreshScheduler:
+    """
+    Refreshes the books of the hottest exchanges first, within a budget of
+    requests per second
+    Attributes:
+        budget: the number of requests per second
+        differ: the book_diff.BookDiffer fed every fetched book, subscribe
+                to it to see the changes
+        requests: the number of requests made
+    step() : refresh the hottest book if the budget allows
+    run()  : keep refreshing books within the budget
+    """
+
+    def __init__(self,
+                 exchanges=None,
+                 budget=REQUEST_BUDGET,
+                 fetch=None,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+        """
+        exchanges: the Exchanges to refresh, defaults to all of them
+        fetch: a function of an Exchange returning its list of Orders,
+               defaults to its top of book
+        clock, sleep: the time functions to use
+        """
+        if exchanges is None:
+            exchanges = models.Exchange.get_all()
+        if fetch is None:
+            fetch = lambda ex: ex.get_orders(
+                depth=arbitrage.TOP_OF_BOOK_DEPTH
+            )
+        self.budget = float(budget)
+        self.fetch = fetch
+        self.clock = clock
+        self.sleep = sleep
+        self.differ = book_diff.BookDiffer()
+        self.requests = 0
+        self.states = dict((ex.id, ExchangeState(ex)) for ex in exchanges)
+        self.chains = arbitrage.chain_topology([
+            (ex.id, ex.from_currency.id, ex.to_currency.id)
+            for ex in exchanges
+        ])
+        # exchange id -> indices of the chains that use it
+        self._by_exchange = dict()
+        for i, chain in enumerate(self.chains):
+            for ex in set(chain[:3]):
+                self._by_exchange.setdefault(ex, []).append(i)
+        self._tops = dict()
+        self._rois = [None] * len(self.chains)
+        self._tokens = self.budget
+        self._refilled = clock()
+
+    def rois(self):
+        """
+        Get a list of (chain, ROI) for every chain, as of the books last
+        fetched, where chain is a tuple of arbitrage.chain_topology()
+        """
+        return list(zip(self.chains, self._rois))
+
+    def hottest(self, now=None):
+        """
+        Get the ExchangeState of highest priority
+        """
+        if now is None:
+            now = self.clock()
+        return max(self.states.values(), key=lambda s: s.priority(now))
+
+    def refresh(self, exchange_id):
+        """
+        Fetch the book of an exchange now and update the priorities
+        Returns the list of book_diff.BookEvents
+        """
+        state = self.states[exchange_id]
+        orders = self.fetch(state.exchange)
+        events = self.differ.update(state.exchange, orders)
+        self.requests += 1
+        state.fetches += 1
+        now = self.clock()
+        changes = sum(1 for e in events if e.kind == book_diff.TOP)
+        if state.last_fetch is not None and now > state.last_fetch:
+            observed = changes / (now - state.last_fetch)
+            state.change_rate += RATE_SMOOTHING * (
+                observed - state.change_rate
+            )
+        state.last_fetch = now
+        if changes:
+            self._tops[exchange_id] = _top_floats(
+                self.differ.top(exchange_id)
+            )
+            self._evaluate(exchange_id)
+        return events
+
+    def _evaluate(self, exchange_id):
+        """
+        Re-evaluate the chains of an exchange whose top changed, and the
+        closeness of every exchange on them
+        """
+        touched = set()
+        for i in self._by_exchange.get(exchange_id, []):
+            chain = self.chains[i]
+            if all(ex in self._tops for ex in chain[:3]):
+                self._rois[i] = arbitrage.chain_roi(self._tops, chain)
+            touched.update(chain[:3])
+        for ex in touched:
+            state = self.states.get(ex)
+            if state is None:
+                continue
+            known = [
+                self._rois[i] for i in self._by_exchange[ex]
+                if all(e in self._tops for e in self.chains[i][:3])
+            ]
+            if known:
+                state.closeness = max(closeness(roi) for roi in known)
+
+    def _refill(self, now):
+        # allow one second of requests to build up, and at least one
+        self._tokens = min(
+            max(self.budget, 1),
+            self._tokens + (now - self._refilled) * self.budget
+        )
+        self._refilled = now
+
+    def step(self):
+        """
+        Refresh the hottest book if the budget allows
+        Returns the id of the exchange refreshed, or None
+        """
+        now = self.clock()
+        self._refill(now)
+        if self._tokens < 1 or not self.states:
+            return None
+        self._tokens -= 1
+        state = self.hottest(now)
+        try:
+            self.refresh(state.exchange.id)
+        except Exception as e:
+            sys.stderr.write('WARNING: refreshing exchange {0} failed: {1}\n'
+                             .format(state.exchange.id, e))
+            state.last_fetch = self.clock()
+        return state.exchange.id
+
+    def run(self, duration=None, max_requests=None):
+        """
+        Keep refreshing the hottest books within the budget
+        duration: stop after this many seconds, or run forever
+        max_requests: stop after this many requests
+        """
+        start = self.clock()
+        while True:
+            now = self.clock()
+            if duration is not None and now - start >= duration:
+                break
+            if max_requests is not None and self.requests >= max_requests:
+                break
+            if self.step() is None:
+                self._refill(now)
+                wait = (1 - self._tokens) / self.budget
+                if duration is not None:
+                    wait = min(wait, start + duration - now)
+                self.sleep(max(wait, 0))
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else REQUEST_BUDGET
+    sched = RefreshScheduler(budget=budget)
+    try:
+        while True:
+            sched.run(duration=10)
+            rois = [r for r in sched.rois() if r[1] is not None]
+            rois.sort(key=lambda r: r[1], reverse=True)
+            print('{0} requests, best chains:'.format(sched.requests))
+            for chain, roi in rois[:5]:
+                print('  {0} {1:.4f}%'.format(chain[:3], roi * 100))
+    except KeyboardInterrupt:
+        print("Exiting")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+service.py
+
+A long-running local service that keeps the models, the registry and the
+caches warm, so the scripts do not start cold every time they are run.
+
+USAGE:  python service.py [--socket PATH]
+
+--socket    the Unix domain socket to listen on (default SOCKET_PATH, or
+            the COINEX_SOCKET environment variable)
+
+list_balances.py, market_cap.py and arbitrage.py --list ask the service
+for their output when it is running and do the work themselves when it
+is not.
+
+Requests and responses are one line of JSON each:
+
+    {"command": "market_cap", "args": ["--table"]}
+    {"ok": true, "lines": ["...", "..."]}
+    {"ok": false, "error": "..."}
+
+NOTE: the socket is only accessible to the user running the service, as
+it answers with account balances
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+
+
+SOCKET_PATH = os.environ.get(
+    'COINEX_SOCKET',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coinex.sock')
+)
+# seconds a client waits for the service to answer
+CLIENT_TIMEOUT = 30
+# seconds between refreshes of the books kept for arbitrage scans
+BOOK_REFRESH = 5
+
+
+def request(command, args=(), path=None, timeout=CLIENT_TIMEOUT):
+    """
+    Ask the service to run a command
+    command: the name of the command
+    args: a list of the command line options of the command
+    path: the socket of the service, defaults to SOCKET_PATH
+    Returns the list of lines to print, or None if the service is not
+    running or could not answer
+    """
+    if path is None:
+        path = SOCKET_PATH
+    if not os.path.exists(path):
+        return None
+    msg = json.dumps({'command': command, 'args': list(args)}) + '\n'
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(msg.encode())
+            with sock.makefile('rb') as f:
+                rsp = json.loads(f.readline().decode())
+    except (OSError, ValueError):
+        # not running, or gone away
+        return None
+    if not rsp.get('ok'):
+        sys.stderr.write('WARNING: the service failed: {0}\n'.format(
+            rsp.get('error')
+        ))
+        return None
+    return rsp['lines']
+
+
+def _arg(args, name, default):
+    """
+    Get the float value of an option from a list of arguments
+    """
+    if name in args:
+        return float(args[args.index(name) + 1])
+    return default
+
+
+class Service:
+    """
+    Runs the commands of the clients on warm models and caches
+    Attributes:
+        refresher: the book_refresher.BookRefresher of the arbitrage scans
+    handle(command, args) : the lines of output of a command
+    start(), stop()       : start and stop the background refreshing
+    """
+
+    def __init__(self, book_refresh=BOOK_REFRESH):
+        # only the service pays for these imports
+        import arbitrage
+        import book_refresher
+        import list_balances
+        import market_cap
+        import models
+        self._arbitrage = arbitrage
+        self._list_balances = list_balances
+        self._market_cap = market_cap
+        self._models = models
+        self.refresher = book_refresher.BookRefresher(
+            fetch=lambda ex: ex.get_orders(depth=arbitrage.TOP_OF_BOOK_DEPTH),
+            interval=book_refresh
+        )
+        self._commands = {
+            'ping': self._ping,
+            'balances': self._balances,
+            'market_cap': self._market_cap_lines,
+            'arbitrage': self._arbitrage_lines,
+        }
+
+    def start(self):
+        self.refresher.start()
+
+    def stop(self):
+        self.refresher.stop()
+
+    def handle(self, command, args):
+        """
+        Run a command
+        Returns the list of lines to print
+        Raises KeyError for an unknown command
+        """
+        return self._commands[command](list(args))
+
+    def _ping(self, args):
+        return ['pong']
+
+    def _balances(self, args):
+        return self._list_balances.balance_lines(
+            self._models.balance_cache.all()
+        )
+
+    def _market_cap_lines(self, args):
+        # the balance cache only refetches once its interval has passed
+        if '--table' in args:
+            return self._market_cap.show_table(refresh=True)
+        return self._market_cap.show_market_cap(refresh=True)
+
+    def _arbitrage_lines(self, args):
+        self.refresher.wait()
+        return self._arbitrage.list_profitable(
+            min_roi=_arg(args, '--min-roi', self._arbitrage.MIN_ROI),
+            snapshot=self.refresher.snapshot(),
+            max_skew=_arg(args, '--max-skew', None)
+        )
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline().decode())
+            lines = self.server.service.handle(req['command'],
+                                               req.get('args', []))
+            rsp = {'ok': True, 'lines': [str(line) for line in lines]}
+        except KeyError as e:
+            rsp = {'ok': False, 'error': 'unknown command {0}'.format(e)}
+        except Exception as e:
+            rsp = {'ok': False, 'error': str(e)}
+        self.wfile.write((json.dumps(rsp) + '\n').encode())
+
+
+class ServiceServer(socketserver.UnixStreamServer):
+    """
+    Serves a Service on a Unix domain socket, one request at a time
+    """
+
+    def __init__(self, service, path=None):
+        if path is None:
+            path = SOCKET_PATH
+        if os.path.exists(path):
+            if request('ping', path=path) is not None:
+                raise RuntimeError('The service is already running')
+            # left behind by a service that did not stop cleanly
+            os.remove(path)
+        self.service = service
+        self.path = path
+        # only our user may connect
+        old = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(old)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def main():
+    path = None
+    if '--socket' in sys.argv:
+        path = sys.argv[sys.argv.index('--socket') + 1]
+    service = Service()
+    server = ServiceServer(service, path)
+    service.start()
+    print('Serving on {0}'.format(server.path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting")
+    finally:
+        service.stop()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+"""
+snapshots.py
+
+Keep the order books we fetch on disk for offline analysis and backtests.
+
+Books are appended to segments as fixed-width integer columns, one file
+per column:
+
+    exchange   int32  the trade pair id
+    timestamp  int64  microseconds since the epoch
+    side       int8   1 for a bid, 0 for an ask
+    rate       int64  the rate * 10^8
+    amount     int64  the amount * 10^8
+    filled     int64  the filled amount * 10^8
+
+An index file records the exchange, time and location of every book so
+the reader can find any book without scanning the segments. The reader
+memory-maps the columns and hands out zero-copy memoryviews of them; with
+NumPy available numpy.frombuffer(view) wraps one without copying.
+
+NOTE: columns are written in the native byte order of the machine
+"""
+
+from array import array
+from decimal import *
+import bisect
+import mmap
+import os
+import struct
+import time
+
+import models
+
+
+# the columns of a segment, and their array typecodes
+COLUMNS = (
+    ('exchange', 'i'),
+    ('timestamp', 'q'),
+    ('side', 'b'),
+    ('rate', 'q'),
+    ('amount', 'q'),
+    ('filled', 'q'),
+)
+# the default number of rows in a segment before a new one is started
+SEGMENT_ROWS = 1000000
+
+# exchange id, timestamp, segment, first row, number of rows
+_INDEX_RECORD = struct.Struct('=iqiqi')
+_INDEX_NAME = 'index'
+
+
+def _segment_path(directory, segment, column):
+    """
+    Get the path of a column file of a segment
+    """
+    return os.path.join(
+        directory,
+        'seg-{0:06d}.{1}'.format(segment, column)
+    )
+
+
+def _to_int(amt):
+    """
+    Convert a Decimal (or None) in coin units to an integer in 10^-8 units
+    """
+    if amt is None:
+        return 0
+    return int(Decimal(amt).scaleb(8))
+
+
+def now():
+    """
+    Get the current time as a snapshot timestamp (microseconds)
+    """
+    return int(time.time() * 1000000)
+
+
+def _read_index(directory, offset=0):
+    """
+    Read the index records from the given byte offset onward.
+    Returns a list of records and the offset after the last whole record
+    """
+    fname = os.path.join(directory, _INDEX_NAME)
+    if not os.path.exists(fname):
+        return [], offset
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    n = len(data) // _INDEX_RECORD.size
+    ret = list(_INDEX_RECORD.iter_unpack(data[:n * _INDEX_RECORD.size]))
+    return ret, offset + n * _INDEX_RECORD.size
+
+
+class SnapshotWriter:
+    """
+    Appends order books to a snapshot directory
+    Attributes:
+        directory: where the segments and index are kept
+        segment_rows: the number of rows after which a new segment starts
+    attach() : store every book fetched by models.Exchange.get_orders()
+    close()  : close the files of the current segment and the index
+    NOTE: the column files of the current segment and the index are kept
+    open between writes
+    """
+
+    def __init__(self, directory, segment_rows=SEGMENT_ROWS):
+        self.directory = directory
+        self.segment_rows = int(segment_rows)
+        os.makedirs(directory, exist_ok=True)
+        records, size = _read_index(directory)
+        if records:
+            last = records[-1]
+            self._segment = last[2]
+            self._rows = last[3] + last[4]
+        else:
+            self._segment = 0
+            self._rows = 0
+        # drop a partial index record and any rows written after the last
+        # whole one, which a crash mid-write may have left behind
+        with open(os.path.join(directory, _INDEX_NAME), 'ab') as f:
+            f.truncate(size)
+        for column, typecode in COLUMNS:
+            fname = _segment_path(directory, self._segment, column)
+            if os.path.exists(fname):
+                with open(fname, 'ab') as f:
+                    f.truncate(self._rows * array(typecode).itemsize)
+        # a crash during a rollover may have left columns of the next
+        # segment, which would no longer line up once appended to
+        for fname in os.listdir(directory):
+            if not fname.startswith('seg-'):
+                continue
+            try:
+                segment = int(fname[len('seg-'):].split('.')[0])
+            except ValueError:
+                continue
+            if segment > self._segment:
+                os.remove(os.path.join(directory, fname))
+        # column name -> file of the current segment, opened on first write
+        self._files = dict()
+        self._index = open(os.path.join(directory, _INDEX_NAME), 'ab')
+
+    def _close_segment(self):
+        """
+        Close the column files of the current segment
+        """
+        for f in self._files.values():
+            f.close()
+        self._files = dict()
+
+    def close(self):
+        """
+        Close the files of the current segment and the index
+        """
+        self._close_segment()
+        if not self._index.closed:
+            self._index.close()
+
+    def write(self, exchange_id, orders, timestamp=None):
+        """
+        Append a book to the store
+        exchange_id: the id of the exchange (trade pair) of the book
+        orders: a list of models.Order
+        timestamp: the time of the book in microseconds, defaults to now
+        returns the timestamp
+        """
+        if timestamp is None:
+            timestamp = now()
+        exchange_id = int(exchange_id)
+        timestamp = int(timestamp)
+        n = len(orders)
+        cols = {
+            'exchange': array('i', [exchange_id]) * n,
+            'timestamp': array('q', [timestamp]) * n,
+            'side': array('b', [1 if o.bid else 0 for o in orders]),
+            'rate': array('q', [_to_int(o.rate) for o in orders]),
+            'amount': array('q', [_to_int(o.amount) for o in orders]),
+            'filled': array('q', [_to_int(o.filled) for o in orders]),
+        }
+        if self._rows > 0 and self._rows + n > self.segment_rows:
+            self._close_segment()
+            self._segment += 1
+            self._rows = 0
+        if not self._files:
+            for column, typecode in COLUMNS:
+                fname = _segment_path(self.directory, self._segment, column)
+                self._files[column] = open(fname, 'ab')
+        for column, typecode in COLUMNS:
+            f = self._files[column]
+            cols[column].tofile(f)
+            f.flush()
+        # the index goes last, so a book is only found once all its rows
+        # are written
+        self._index.write(_INDEX_RECORD.pack(
+            exchange_id,
+            timestamp,
+            self._segment,
+            self._rows,
+            n
+        ))
+        self._index.flush()
+        self._rows += n
+        return timestamp
+
+    def record(self, exchange, orders):
+        """
+        Store the book of an exchange, for use as an orders listener
+        exchange: the models.Exchange
+        orders: the list of models.Order fetched from it
+        """
+        self.write(exchange.id, orders)
+
+    def attach(self):
+        """
+        Store every book fetched by models.Exchange.get_orders()
+        """
+        models.Exchange.add_orders_listener(self.record)
+
+    def detach(self):
+        """
+        Stop storing books fetched by models.Exchange.get_orders()
+        """
+        models.Exchange.remove_orders_listener(self.record)
+
+
+class BookView:
+    """
+    A zero-copy view of one stored book
+    Attributes:
+        exchange_id: the id of the exchange
+        timestamp: the time of the book in microseconds
+        side: a memoryview of int8, 1 for bids and 0 for asks
+        rate: a memoryview of int64 rates in 10^-8 units
+        amount: a memoryview of int64 amounts in 10^-8 units
+        filled: a memoryview of int64 filled amounts in 10^-8 units
+    """
+
+    def __init__(self, exchange_id, timestamp, side, rate, amount, filled):
+        self.exchange_id = exchange_id
+        self.timestamp = timestamp
+        self.side = side
+        self.rate = rate
+        self.amount = amount
+        self.filled = filled
+
+    def __len__(self):
+        return len(self.side)
+
+    def rows(self):
+        """
+        Returns a generator of (bid, rate, amount, filled) tuples with the
+        integers of the columns
+        """
+        for i in range(len(self.side)):
+            yield (
+                self.side[i] == 1,
+                self.rate[i],
+                self.amount[i],
+                self.filled[i]
+            )
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot directory through memory-maps
+    Attributes:
+        directory: where the segments and index are kept
+    refresh()                  : pick up books written since opening
+    exchanges()                : the ids of exchanges that have books
+    timestamps(exchange_id)    : the times of an exchange's books
+    get_book(exchange_id, at)  : the book as of a given time
+    iter_books(start, end)     : every book in time order
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._offset = 0
+        # exchange id -> sorted timestamps, and the matching records
+        self._times = {}
+        self._records = {}
+        # (segment, column) -> (mmap, memoryview)
+        self._maps = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Read index records written since the last refresh
+        """
+        records, self._offset = _read_index(self.directory, self._offset)
+        for rec in records:
+            times = self._times.setdefault(rec[0], [])
+            recs = self._records.setdefault(rec[0], [])
+            i = bisect.bisect_right(times, rec[1])
+            times.insert(i, rec[1])
+            recs.insert(i, rec)
+
+    def exchanges(self):
+        """
+        Get a sorted list of the ids of exchanges with stored books
+        """
+        return sorted(self._times.keys())
+
+    def timestamps(self, exchange_id):
+        """
+        Get the sorted list of times at which books of an exchange were
+        stored
+        """
+        return list(self._times.get(exchange_id, []))
+
+    def _column(self, segment, column, typecode, start, count):
+        """
+        Get a zero-copy view of count rows of a column from start
+        """
+        if count == 0:
+            return memoryview(b'').cast(typecode)
+        itemsize = array(typecode).itemsize
+        end = (start + count) * itemsize
+        key = (segment, column)
+        if key not in self._maps or len(self._maps[key][0]) < end:
+            # the segment grew since it was mapped, map it again. The old
+            # map is closed when the last view of it goes away
+            fname = _segment_path(self.directory, segment, column)
+            with open(fname, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[key] = (mm, memoryview(mm))
+        view = self._maps[key][1]
+        return view[start * itemsize:end].cast(typecode)
+
+    def _view(self, rec):
+        """
+        Build the BookView of an index record
+        """
+        exchange_id, timestamp, segment, start, count = rec
+        cols = {}
+        for column, typecode in COLUMNS:
+            if column in ('exchange', 'timestamp'):
+                continue
+            cols[column] = self._column(
+                segment,
+                column,
+                typecode,
+                start,
+                count
+            )
+        return BookView(exchange_id, timestamp, **cols)
+
+    def get_book(self, exchange_id, at=None):
+        """
+        Get the latest book of an exchange stored at or before a time
+        exchange_id: the id of the exchange
+        at: the time in microseconds, or None for the latest book
+        returns a BookView, or None if there is no such book
+        """
+        times = self._times.get(exchange_id)
+        if not times:
+            return None
+        if at is None:
+            i = len(times)
+        else:
+            i = bisect.bisect_right(times, at)
+        if i == 0:
+            return None
+        return self._view(self._records[exchange_id][i - 1])
+
+    def iter_books(self, start=None, end=None, exchange_ids=None):
+        """
+        Returns a generator of BookViews in time order
+        start: only books at or after this time (microseconds)
+        end: only books before this time (microseconds)
+        exchange_ids: only books of these exchanges
+        """
+        if exchange_ids is None:
+            exchange_ids = self._records.keys()
+        recs = []
+        for exchange_id in exchange_ids:
+            for rec in self._records.get(exchange_id, []):
+                if start is not None and rec[1] < start:
+                    continue
+                if end is not None and rec[1] >= end:
+                    continue
+                recs.append(rec)
+        recs.sort(key=lambda rec: (rec[1], rec[0]))
+        for rec in recs:
+            yield self._view(rec)
+
+    def close(self):
+        """
+        Release the memory-maps that are no longer viewed
+        """
+        for mm, view in self._maps.values():
+            view.release()
+            try:
+                mm.close()
+            except BufferError:
+                # a BookView is still using it, it closes with the view
+                pass
+        self._maps = {}
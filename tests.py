@@ -9,6 +9,18 @@ from tests.test_coinex_api import *
 from tests.test_models import *
 from tests.test_arbitrage import *
 from tests.test_market_cap import *
+from tests.test_snapshots import *
+from tests.test_trade_collector import *
+from tests.test_backtest import *
+from tests.test_valuation import *
+from tests.test_book_diff import *
+from tests.test_scheduler import *
+from tests.test_book_refresher import *
+from tests.test_utils import *
+from tests.test_service import *
+from tests.test_ascii_art_spinner import *
+from tests.test_chain_cache import *
+from tests.test_distributed import *
 
 
 if __name__ == '__main__':
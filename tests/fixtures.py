@@ -0,0 +1,150 @@
+"""
+fixtures.py
+
+An in-memory market served in place of the coinex.pw API, so tests can
+run without the network
+"""
+
+from decimal import *
+from unittest import mock
+import shutil
+import tempfile
+
+import chain_cache
+import coinex_api
+import models
+
+
+def _to_int(amt):
+    return int(Decimal(str(amt)).scaleb(8))
+
+
+class FakeMarket:
+    """
+    Patches the public and private coinex_api calls with a fixed market
+    Attributes:
+        currencies: a list of (id, abbreviation)
+        pairs: a list of (trade pair id, from currency id, to currency id)
+        books: a dict of trade pair id to a list of
+               (bid, rate, amount, filled) tuples
+        balances: a dict of currency id to (amount, held)
+        calls: a dict of API function name to how often it was called
+    """
+
+    def __init__(self, currencies, pairs, books=None, balances=None):
+        self.currencies = currencies
+        self.pairs = pairs
+        self.books = books or dict()
+        self.balances = balances or dict()
+        self.calls = dict()
+        self._patches = []
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def order_rows(self, trade_pair_id):
+        """
+        Get the book of a trade pair as rows of the orders API call
+        """
+        self._count('orders')
+        ret = []
+        for i, row in enumerate(self.books.get(int(trade_pair_id), [])):
+            bid, rate, amount = row[:3]
+            filled = row[3] if len(row) > 3 else 0
+            ret.append({
+                'id': int(trade_pair_id) * 1000 + i,
+                'trade_pair_id': int(trade_pair_id),
+                'bid': bid,
+                'rate': _to_int(rate),
+                'amount': _to_int(amount),
+                'filled': _to_int(filled),
+                'cancelled': False,
+                'complete': False,
+                'created_at': '2014-02-01T10:00:00.000Z'
+            })
+        return ret
+
+    def currency_rows(self):
+        self._count('currencies')
+        return [
+            {'id': id_, 'name': abbr, 'desc': abbr + 'coin'}
+            for id_, abbr in self.currencies
+        ]
+
+    def trade_pair_rows(self):
+        self._count('trade_pairs')
+        return [
+            {'id': id_, 'market_id': from_, 'currency_id': to}
+            for id_, from_, to in self.pairs
+        ]
+
+    def balance_rows(self):
+        self._count('balances')
+        return [
+            {
+                'currency_id': cur,
+                'amount': _to_int(amt),
+                'held': _to_int(held)
+            }
+            for cur, (amt, held) in sorted(self.balances.items())
+        ]
+
+    def _reset_models(self):
+        models.registry.delete_all(models.Currency)
+        models.registry.delete_all(models.Exchange)
+        models.Currency._loaded = False
+        models.Exchange._loaded = False
+        models.balance_cache.invalidate()
+
+    def __enter__(self):
+        self._reset_models()
+        fakes = {
+            'currencies': self.currency_rows,
+            'trade_pairs': self.trade_pair_rows,
+            'orders': self.order_rows,
+            'iter_orders': lambda id_, depth=None: iter(self.order_rows(id_)),
+            'balances': self.balance_rows,
+        }
+        for name, fake in fakes.items():
+            patch = mock.patch.object(coinex_api, name, fake)
+            patch.start()
+            self._patches.append(patch)
+        # keep cached chain topologies out of the user's cache
+        self._cache_dir = tempfile.mkdtemp()
+        patch = mock.patch.object(chain_cache, 'CACHE_DIR', self._cache_dir)
+        patch.start()
+        self._patches.append(patch)
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in self._patches:
+            patch.stop()
+        self._patches = []
+        shutil.rmtree(self._cache_dir)
+        self._reset_models()
+        return False
+
+
+def triangle():
+    """
+    A market of three currencies traded in a triangle, where buying LTC
+    with BTC, DOGE with LTC and selling DOGE for BTC is profitable
+    """
+    return FakeMarket(
+        currencies=[(1, 'BTC'), (2, 'LTC'), (3, 'DOGE')],
+        pairs=[(10, 1, 2), (11, 1, 3), (12, 2, 3)],
+        books={
+            # BTC per LTC
+            10: [(True, '0.02', '50'), (False, '0.021', '40'),
+                 (False, '0.021', '10', '5'), (False, '0.022', '100')],
+            # BTC per DOGE
+            11: [(True, '0.0000012', '900000'),
+                 (True, '0.0000011', '1000000'),
+                 (False, '0.0000013', '800000')],
+            # LTC per DOGE
+            12: [(True, '0.000049', '100000'),
+                 (False, '0.00005', '200000'),
+                 (False, '0.000051', '300000')],
+        },
+        balances={1: ('1.5', '0.5'), 2: ('0', '0'), 3: ('1000', '0')}
+    )
@@ -4,6 +4,7 @@ test_arbitrage.py
 Test the coinex arbitrage
 """
 
+import math
 import os
 import sys
 import unittest
@@ -12,7 +13,158 @@ _path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _path not in sys.path:
     sys.path.append(_path)
 
+import arbitrage
 import coinex_api
+from tests import fixtures
+
+
+def tops_of(market):
+    """
+    Get the top-of-book dict of a fixtures.FakeMarket
+    """
+    ret = dict()
+    for pair_id, book in market.books.items():
+        bids = [r for r in book if r[0]]
+        asks = [r for r in book if not r[0]]
+        bid = max(float(r[1]) for r in bids)
+        ask = min(float(r[1]) for r in asks)
+
+        def left(r):
+            return float(r[2]) - float(r[3] if len(r) > 3 else 0)
+        ret[pair_id] = (
+            bid,
+            sum(left(r) for r in bids if float(r[1]) == bid),
+            ask,
+            sum(left(r) for r in asks if float(r[1]) == ask)
+        )
+    return ret
+
+
+class TestArbitrage(unittest.TestCase):
+
+    def test_chain_topology(self):
+        market = fixtures.triangle()
+        with market:
+            chains = arbitrage.get_chains()
+            ids = [(c.ex1.id, c.ex2.id, c.ex3.id) for c in chains]
+        topology = arbitrage.chain_topology(market.pairs)
+        self.assertTrue(
+            [c[:3] for c in topology] == ids,
+            'Topology should match get_chains()'
+        )
+        self.assertTrue(
+            topology[0] == (10, 12, 11, True, False),
+            'Leg directions should follow the currencies'
+        )
+
+    def test_chain_roi(self):
+        market = fixtures.triangle()
+        tops = tops_of(market)
+        with market:
+            chains = arbitrage.get_chains()
+            for chain, row in zip(chains,
+                                  arbitrage.chain_topology(market.pairs)):
+                roi = chain.get_roi()
+                fast = arbitrage.chain_roi(tops, row)
+                if roi is None:
+                    self.assertTrue(fast is None, 'Both not exchangeable')
+                    continue
+                self.assertAlmostEqual(
+                    float(roi), fast, places=5,
+                    msg='ROI should match get_roi()'
+                )
+                self.assertAlmostEqual(
+                    float(chain.get_max_transfer()),
+                    arbitrage.chain_max_transfer(tops, row),
+                    places=4,
+                    msg='Max transfer should match get_max_transfer()'
+                )
+        self.assertTrue(
+            arbitrage.chain_roi(tops, (10, 12, 11, True, False)) > 0.1,
+            'The triangle should be profitable'
+        )
+
+    def test_pruning(self):
+        market = fixtures.triangle()
+        with market:
+            chains = arbitrage.get_chains()
+            profitable = list(arbitrage.get_profitable_chains())
+            self.assertTrue(
+                market.calls['orders'] == 3,
+                'Each book should be fetched once for all chains'
+            )
+            for chain in chains:
+                roi = chain.get_roi()
+                bound = chain.get_roi_bound()
+                if roi is not None:
+                    self.assertTrue(float(roi) <= bound + 1e-6,
+                                    'Bound should be above the ROI')
+            self.assertTrue(
+                [(c.ex1.id, c.ex2.id, c.ex3.id) for c in profitable] ==
+                [(10, 12, 11), (12, 11, 10)],
+                'Only the profitable chains should be kept'
+            )
+            self.assertTrue(
+                arbitrage.scan_stats['pruned'] == 1,
+                'The losing chain should be pruned'
+            )
+            list(arbitrage.get_profitable_chains(min_roi=0.2))
+            self.assertTrue(
+                arbitrage.scan_stats['pruned'] == len(chains),
+                'Nothing beats a 20% ROI'
+            )
+
+    def test_chain_set(self):
+        market = fixtures.triangle()
+        tops = tops_of(market)
+        with market:
+            chain_set = arbitrage.ChainSet.load()
+            topology = arbitrage.chain_topology(market.pairs)
+            self.assertTrue(
+                list(chain_set) == topology,
+                'Iterating should give the chain topology'
+            )
+            for roi, row in zip(chain_set.rois(), topology):
+                fast = arbitrage.chain_roi(tops, row)
+                if fast is None:
+                    self.assertTrue(math.isnan(roi), 'Not exchangeable')
+                else:
+                    self.assertAlmostEqual(roi, fast, places=9,
+                                           msg='ROI should match chain_roi()')
+            selected = chain_set.select()
+            self.assertTrue(len(selected) == 2, 'The loser is pruned')
+            subset = chain_set.subset(selected)
+            self.assertTrue(
+                list(subset) == [topology[i] for i in selected],
+                'A subset should keep the chosen chains'
+            )
+            chain = subset.chain(0)
+            self.assertTrue(
+                (chain.ex1.id, chain.ex2.id, chain.ex3.id) == topology[0][:3],
+                'Chains should be built from the index arrays'
+            )
+            self.assertTrue(
+                chain.ex1 is chain_set.chain(0).ex1,
+                'Built chains should share their exchanges'
+            )
+
+    def test_executable_by(self):
+        class FakeSession:
+            def __init__(self, btc):
+                self.btc = btc
+
+            def balances(self):
+                return [{'currency_id': 1, 'amount': self.btc, 'held': 0}]
+        rich, poor = FakeSession(pow(10, 8)), FakeSession(0)
+        market = fixtures.triangle()
+        with market:
+            chain = arbitrage.get_chains()[0]
+            chain.get_max_transfer()
+            fetched = market.calls['orders']
+            self.assertTrue(chain.executable_by([rich, poor]) == [rich],
+                            'Only accounts with BTC can execute')
+            self.assertTrue(market.calls['orders'] == fetched,
+                            'The books are shared by the accounts')
 
 
 if __name__ == '__main__':
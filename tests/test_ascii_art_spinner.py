@@ -0,0 +1,63 @@
+"""
+test_ascii_art_spinner.py
+
+Test the progress bar
+"""
+
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import ascii_art_spinner
+
+
+class Terminal(io.StringIO):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def isatty(self):
+        return True
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+class TestSpinner(unittest.TestCase):
+
+    def test_not_a_tty(self):
+        out = io.StringIO()
+        ascii_art_spinner.start(1000, stream=out)
+        for _ in range(1000):
+            ascii_art_spinner.tick()
+        ascii_art_spinner.finish()
+        self.assertTrue(out.getvalue() == '', 'Nothing should be written')
+        self.assertTrue(ascii_art_spinner.progress == 1000, 'Counted')
+
+    def test_throttled(self):
+        now = [0.0]
+        out = Terminal()
+        with mock.patch.object(ascii_art_spinner, 'getTerminalSize',
+                               lambda: (81, 25)):
+            ascii_art_spinner.start(100000, stream=out, clock=lambda: now[0])
+            for i in range(100000):
+                now[0] += 0.0001
+                ascii_art_spinner.tick()
+        # 10 seconds at 10 frames per second at most, plus the first
+        self.assertTrue(out.writes <= 101, 'Redraws should be throttled')
+        self.assertTrue(out.writes > 40, 'Every block should be drawn')
+        last = out.getvalue().split('\r')[-1]
+        self.assertTrue(len(last) == 80, 'One line of the terminal width')
+        self.assertTrue('10000/s' in last, 'Throughput should be shown')
+        self.assertTrue('ETA 00:00:00' in last, 'ETA should be shown')
+
+if __name__ == '__main__':
+    unittest.main()
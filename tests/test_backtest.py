@@ -0,0 +1,93 @@
+"""
+test_backtest.py
+
+Test the arbitrage backtester
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from decimal import *
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import backtest
+import models
+import snapshots
+from tests import fixtures
+
+
+def write_market(writer, market, timestamp):
+    """
+    Store every book of a fixtures.FakeMarket
+    """
+    for pair_id, book in market.books.items():
+        orders = [
+            models.Order(
+                order_id=i,
+                bid=row[0],
+                rate=Decimal(row[1]),
+                amount=Decimal(row[2]),
+                filled=Decimal(row[3] if len(row) > 3 else 0)
+            )
+            for i, row in enumerate(book)
+        ]
+        writer.write(pair_id, orders, timestamp=timestamp)
+
+
+class TestBacktest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.market = fixtures.triangle()
+        writer = snapshots.SnapshotWriter(self.dir)
+        write_market(writer, self.market, 1000000)
+        # two seconds later the DOGE bids dry up
+        self.market.books[11] = [
+            (True, '0.0000009', '900000'),
+            (False, '0.0000013', '800000'),
+        ]
+        write_market(writer, self.market, 3000000)
+        self.reader = snapshots.SnapshotReader(self.dir)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.dir)
+
+    def test_top_of_book(self):
+        top = backtest.top_of_book(self.reader.get_book(10, at=1000000))
+        self.assertTrue(top == (0.02, 50.0, 0.021, 45.0), 'Top should match')
+
+    def test_no_latency(self):
+        report = backtest.Backtester(self.reader, self.market.pairs).run()
+        self.assertTrue(report.books == 6, 'Should replay every book')
+        self.assertTrue(report.detected > 0, 'Should find the triangle')
+        self.assertTrue(report.hits > 0, 'Should profit without latency')
+        self.assertTrue(report.pnl[1] > 0, 'Should make BTC')
+
+    def test_latency_misses(self):
+        report = backtest.Backtester(
+            self.reader,
+            self.market.pairs,
+            latency=2.5,
+            max_trade=0.1
+        ).run(end=3000000)
+        self.assertTrue(report.detected > 0, 'Should find the triangle')
+        self.assertTrue(report.hits == 0, 'Late fills should not profit')
+        self.assertTrue(report.missed == report.detected, 'All missed')
+        self.assertTrue(report.pnl[1] < 0, 'Late fills should lose BTC')
+
+    def test_fee_parameter(self):
+        report = backtest.Backtester(
+            self.reader,
+            self.market.pairs,
+            transac_fee=0.1
+        ).run()
+        self.assertTrue(report.detected == 0, 'High fees kill the triangle')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+test_book_diff.py
+
+Test the order book change feed
+"""
+
+import io
+import os
+import sys
+import unittest
+from decimal import *
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import book_diff
+import models
+from tests import fixtures
+
+
+def make_order(order_id, bid, rate, amount, filled=0):
+    return models.Order(
+        order_id=order_id,
+        bid=bid,
+        rate=Decimal(rate),
+        amount=Decimal(amount),
+        filled=Decimal(filled)
+    )
+
+
+class TestBookDiff(unittest.TestCase):
+
+    def test_diff(self):
+        differ = book_diff.BookDiffer()
+        first = differ.diff(10, [
+            make_order(1, True, '0.02', '50'),
+            make_order(2, False, '0.021', '40'),
+            make_order(3, False, '0.022', '100'),
+        ])
+        self.assertTrue(
+            [e.kind for e in first] == ['add'] * 3 + ['top'] * 2,
+            'A new book is all adds and both tops'
+        )
+        self.assertTrue(
+            differ.diff(10, [
+                make_order(1, True, '0.02', '50'),
+                make_order(2, False, '0.021', '40'),
+                make_order(3, False, '0.022', '100'),
+            ]) == [],
+            'An unchanged book has no events'
+        )
+        events = differ.diff(10, [
+            make_order(1, True, '0.02', '50'),
+            make_order(2, False, '0.021', '40', '15'),
+            make_order(4, False, '0.023', '5'),
+        ])
+        self.assertTrue(
+            events == [
+                book_diff.BookEvent('update', 10, 2, False, Decimal('0.021'),
+                                    Decimal(25)),
+                book_diff.BookEvent('add', 10, 4, False, Decimal('0.023'),
+                                    Decimal(5)),
+                book_diff.BookEvent('remove', 10, 3, False, Decimal('0.022'),
+                                    0),
+                book_diff.BookEvent('top', 10, None, False, Decimal('0.021'),
+                                    Decimal(25)),
+            ],
+            'Only the changed orders and the ask top should be sent'
+        )
+        events = differ.diff(10, [make_order(2, False, '0.021', '40', '15')])
+        self.assertTrue(
+            events[-1] == book_diff.BookEvent('top', 10, None, True, None, 0),
+            'An emptied side should be sent'
+        )
+
+    def test_subscribers(self):
+        differ = book_diff.BookDiffer()
+        changed = book_diff.ChangedBooks()
+        out = io.StringIO()
+        differ.subscribe(changed)
+        differ.subscribe(book_diff.EventLog(out))
+        differ.attach()
+        try:
+            with fixtures.triangle():
+                for ex in models.Exchange.get_all():
+                    ex.get_orders()
+                self.assertTrue(changed.pop() == {10, 11, 12}, 'All new')
+                lines = out.getvalue().count('\n')
+                for ex in models.Exchange.get_all():
+                    ex.get_orders()
+                self.assertTrue(changed.pop() == set(), 'Nothing changed')
+                self.assertTrue(out.getvalue().count('\n') == lines,
+                                'Nothing should be logged for quiet books')
+        finally:
+            differ.detach()
+        self.assertTrue(
+            out.getvalue().startswith('add 10 10000 bid 0.02 50'),
+            'Events should be logged one per line'
+        )
+
+if __name__ == '__main__':
+    unittest.main()
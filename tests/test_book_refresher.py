@@ -0,0 +1,81 @@
+"""
+test_book_refresher.py
+
+Test the double-buffered background book refresher
+"""
+
+import os
+import sys
+import unittest
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import arbitrage
+import book_refresher
+import models
+from tests import fixtures
+
+
+class TestBookRefresher(unittest.TestCase):
+
+    def test_snapshots(self):
+        now = [100.0]
+        market = fixtures.triangle()
+        with market:
+            refresher = book_refresher.BookRefresher(clock=lambda: now[0])
+            empty = refresher.snapshot()
+            self.assertTrue(empty.get(10) is None, 'Nothing fetched yet')
+            first = refresher.refresh()
+            self.assertTrue(refresher.snapshot() is first, 'Published')
+            self.assertTrue(len(first.get(10)) == 4, 'Whole book')
+            self.assertTrue(first.skew([10, 11, 12]) == 0, 'Same time')
+            self.assertTrue(first.skew([10, 13]) is None, 'Missing book')
+            with self.assertRaises(TypeError):
+                first.books[10] = ()
+            # the LTC/DOGE book can no longer be fetched
+            market.books[12] = None
+            now[0] = 130.0
+            second = refresher.refresh()
+        self.assertTrue(second.version == first.version + 1, 'Versioned')
+        self.assertTrue(second.get(12) == first.get(12),
+                        'A failed fetch keeps the previous book')
+        self.assertTrue(second.skew([10, 11]) == 0, 'Fetched together')
+        self.assertTrue(second.skew([10, 12, 11]) == 30, 'Stale leg')
+        self.assertTrue(first.fetched_at[10] == 100.0,
+                        'Published snapshots never change')
+
+    def test_background(self):
+        with fixtures.triangle() as market:
+            refresher = book_refresher.BookRefresher(interval=0.01)
+            refresher.start()
+            try:
+                self.assertTrue(refresher.wait(5), 'Should publish')
+            finally:
+                refresher.stop()
+            self.assertTrue(refresher.snapshot().version >= 1, 'Refreshed')
+            fetched = market.calls['orders']
+        self.assertTrue(fetched % 3 == 0, 'Every book, every time')
+
+    def test_skewed_chains(self):
+        times = {10: 100.0, 11: 100.5, 12: 104.0}
+        with fixtures.triangle() as market:
+            orders = dict(
+                (ex.id, ex.get_orders()) for ex in models.Exchange.get_all()
+            )
+            snap = book_refresher.BookSnapshot(orders, times)
+            fetched = market.calls['orders']
+            ok = list(arbitrage.get_profitable_chains(snapshot=snap))
+            skewed = list(arbitrage.get_profitable_chains(
+                snapshot=snap,
+                max_skew=1
+            ))
+            self.assertTrue(market.calls['orders'] == fetched,
+                            'The snapshot should be read, not fetched')
+        self.assertTrue(len(ok) == 2, 'Both profitable chains')
+        self.assertTrue(skewed == [], 'Both use the stale LTC/DOGE book')
+        self.assertTrue(arbitrage.scan_stats['skewed'] == 2, 'Counted')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+test_chain_cache.py
+
+Test the on-disk cache of chain topologies
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import arbitrage
+import chain_cache
+from tests import fixtures
+
+
+class TestChainCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.builds = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build(self, pairs):
+        self.builds += 1
+        return arbitrage.chain_topology(pairs)
+
+    def test_cached(self):
+        pairs = fixtures.triangle().pairs
+        first = chain_cache.get_topology(pairs, self.build, self.dir)
+        second = chain_cache.get_topology(pairs, self.build, self.dir)
+        self.assertTrue(self.builds == 1, 'Built once')
+        self.assertTrue(isinstance(second.ex1, memoryview), 'Memory-mapped')
+        self.assertTrue(
+            list(first) == list(second) == arbitrage.chain_topology(pairs),
+            'The same chains should come back'
+        )
+        self.assertTrue(second[0] == (10, 12, 11, True, False), 'Indexed')
+        second.close()
+        chain_cache.get_topology(pairs[:2], self.build, self.dir)
+        self.assertTrue(self.builds == 2, 'New pairs, new topology')
+
+    def test_invalid_file(self):
+        pairs = fixtures.triangle().pairs
+        path = chain_cache.cache_path(pairs, self.dir)
+        os.makedirs(self.dir, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'CXCT\x01')
+        self.assertTrue(chain_cache.load(path) is None, 'Truncated')
+        topology = chain_cache.get_topology(pairs, self.build, self.dir)
+        self.assertTrue(len(topology) == 3, 'Rebuilt')
+        self.assertTrue(len(chain_cache.load(path)) == 3, 'Rewritten')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,19 @@ NOTE: requires active credentials in the config file
 """
 
 from decimal import *
+from hashlib import sha512
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import hmac
+import io
+import json
 import os
 import sys
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
 
 _path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _path not in sys.path:
@@ -93,5 +103,346 @@ class TestAPIFunctions(unittest.TestCase):
             )
         )
 
+
+class TestSigning(unittest.TestCase):
+
+    def test_signer(self):
+        signer = coinex_api.Signer('key', b'secret')
+        body = b'{"a":1}'
+        expected = hmac.new(b'secret', body, digestmod=sha512).hexdigest()
+        self.assertTrue(signer.sign(body) == expected, 'Signature matches')
+        self.assertTrue(
+            signer.sign(body) == expected,
+            'Signing again should not reuse the last digest'
+        )
+
+    def test_builder(self):
+        signer = coinex_api.Signer('key', b'secret')
+        builder = coinex_api.PrivateRequestBuilder(signer)
+        req = builder.build('orders', {'order': {'rate': 1, 'bid': True}})
+        self.assertTrue(
+            req.data == b'{"order":{"bid":true,"rate":1}}',
+            'Body should be compact with sorted keys'
+        )
+        self.assertTrue(req.get_header('Api-key') == 'key', 'Key header')
+        self.assertTrue(
+            req.get_header('Api-sign') == signer.sign(req.data),
+            'Sign header should sign the body'
+        )
+        self.assertTrue(
+            json.loads(req.data.decode()) == {'order': {'rate': 1,
+                                                        'bid': True}},
+            'Body should round trip'
+        )
+        req = builder.build('balances')
+        self.assertTrue(req.data is None, 'No body without data')
+        self.assertTrue(req.get_method() == 'GET', 'Should be a GET')
+        self.assertTrue(
+            req.get_header('Api-sign') == signer.sign(b''),
+            'Empty bodies are signed too'
+        )
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    posts = []
+
+    def setup(self):
+        CountingHandler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        if self.path == '/missing':
+            body = b'{"error":"missing"}'
+            self.send_response(404)
+        else:
+            body = json.dumps({'path': self.path}).encode()
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        CountingHandler.posts.append(self.path)
+        if self.path == '/drop':
+            # got the request, and drops the connection before answering
+            self.close_connection = True
+            return
+        body = json.dumps({'path': self.path}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/close':
+            # drop the connection without telling the client, as a server
+            # does with idle connections
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        CountingHandler.connections = 0
+        CountingHandler.posts = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_reuse(self):
+        pool = coinex_api.ConnectionPool()
+        for i in range(5):
+            rsp = pool.open(urllib.request.Request(self.url + '/' + str(i)))
+            body = json.loads(rsp.read().decode())
+            pool.release(rsp)
+            self.assertTrue(body['path'] == '/' + str(i), 'Path should match')
+        self.assertTrue(
+            CountingHandler.connections == 1,
+            'Requests should share one connection'
+        )
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            pool.open(urllib.request.Request(self.url + '/missing'))
+        self.assertTrue(ctx.exception.code == 404, 'Should give the status')
+        self.assertTrue(
+            b'missing' in ctx.exception.read(),
+            'Error body should be readable'
+        )
+        pool.close()
+
+    def test_post_on_closed_connection(self):
+        pool = coinex_api.ConnectionPool()
+        for path in ('/close', '/orders'):
+            rsp = pool.open(urllib.request.Request(
+                self.url + path,
+                data=b'{}',
+                method='POST'
+            ))
+            body = json.loads(rsp.read().decode())
+            pool.release(rsp)
+            self.assertTrue(body['path'] == path, 'Path should match')
+            # let the server close the idle connection
+            time.sleep(0.1)
+        self.assertTrue(
+            CountingHandler.connections == 2,
+            'The closed connection should not be reused'
+        )
+        pool.close()
+
+    def test_post_not_resent(self):
+        pool = coinex_api.ConnectionPool()
+        rsp = pool.open(urllib.request.Request(self.url + '/orders',
+                                               data=b'{}', method='POST'))
+        rsp.read()
+        pool.release(rsp)
+        with self.assertRaises(urllib.error.URLError):
+            pool.open(urllib.request.Request(self.url + '/drop',
+                                             data=b'{}', method='POST'))
+        self.assertTrue(
+            CountingHandler.posts == ['/orders', '/drop'],
+            'A POST the server may have acted on should not be sent again'
+        )
+        pool.close()
+
+    def test_idle_timeout(self):
+        now = [0]
+        pool = coinex_api.ConnectionPool(idle_timeout=10,
+                                         clock=lambda: now[0])
+        for t in (0, 5, 20):
+            now[0] = t
+            rsp = pool.open(urllib.request.Request(self.url + '/'))
+            rsp.read()
+            pool.release(rsp)
+        self.assertTrue(
+            CountingHandler.connections == 2,
+            'Connections idle for too long should not be reused'
+        )
+        pool.close()
+
+
+class TestBatchOrders(unittest.TestCase):
+
+    def fake_request(self, page, data=None, private=False, method=None,
+                     session=None):
+        self.requests.append((page, data, method))
+        if page == 'orders':
+            if data['order']['trade_pair_id'] == 2:
+                raise ValueError('rejected')
+            return {'order': [dict(data['order'], id=len(self.requests))]}
+        return {'orders': [{'id': int(page.split('/')[1]),
+                            'cancelled': True}]}
+
+    def setUp(self):
+        self.requests = []
+        self.patch = mock.patch.object(
+            coinex_api,
+            '_make_request',
+            self.fake_request
+        )
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_submit_orders(self):
+        orders = [
+            {'trade_pair_id': tp, 'amount': '1', 'bid': True, 'rate': '0.5'}
+            for tp in (1, 2, 3)
+        ]
+        rsps = coinex_api.submit_orders(orders)
+        self.assertTrue(len(rsps) == 3, 'One result per order')
+        self.assertTrue(rsps[0]['trade_pair_id'] == 1, 'Input order kept')
+        self.assertTrue(isinstance(rsps[1], ValueError), 'Error isolated')
+        self.assertTrue(rsps[2]['trade_pair_id'] == 3, 'Input order kept')
+        self.assertTrue(rsps[2]['amount'] == 100000000, 'Amount converted')
+
+    def test_cancel_orders(self):
+        rsps = coinex_api.cancel_orders([7, 8])
+        self.assertTrue(
+            [r['id'] for r in rsps] == [7, 8],
+            'Results should be in input order'
+        )
+        self.assertTrue(
+            sorted(self.requests) == [('orders/7/cancel', None, 'POST'),
+                                      ('orders/8/cancel', None, 'POST')],
+            'Should post to the cancel page of each order'
+        )
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_iter_array(self):
+        rows = [{'id': i, 'desc': 'caf\u00e9 ] "x"'} for i in range(100)]
+        body = json.dumps({'count': 100, 'orders': rows}).encode()
+        got = coinex_api.iter_array(io.BytesIO(body), 'orders', chunk_size=5)
+        self.assertTrue(
+            list(got) == rows,
+            'Rows split over chunks should decode'
+        )
+
+    def test_iter_array_lazy(self):
+        class Stream(io.BytesIO):
+            reads = 0
+
+            def read(self, size=-1):
+                Stream.reads += 1
+                return super().read(size)
+        body = json.dumps({'orders': [{'id': i} for i in range(1000)]})
+        stream = Stream(body.encode())
+        got = coinex_api.iter_array(stream, 'orders', chunk_size=64)
+        self.assertTrue(next(got) == {'id': 0}, 'First row')
+        self.assertTrue(Stream.reads < 3, 'Should not read the whole body')
+
+    def test_depth_param(self):
+        pages = []
+        with mock.patch.object(coinex_api, '_stream_request',
+                               lambda page, key: pages.append(page)):
+            coinex_api.iter_orders(2, depth=1)
+            with mock.patch.object(coinex_api, 'ORDERS_DEPTH_PARAM', 'limit'):
+                coinex_api.iter_orders(2, depth=1)
+        self.assertTrue(
+            pages == ['orders?tradePair=2', 'orders?tradePair=2&limit=1'],
+            'Depth should only be sent when the server supports it'
+        )
+
+    def test_iter_array_errors(self):
+        empty = coinex_api.iter_array(io.BytesIO(b'{"orders": [ ]}'), 'orders')
+        self.assertTrue(list(empty) == [], 'Empty arrays are empty')
+        with self.assertRaises(KeyError):
+            list(coinex_api.iter_array(io.BytesIO(b'{"error": 1}'), 'orders'))
+        with self.assertRaises(ValueError):
+            list(coinex_api.iter_array(
+                io.BytesIO(b'{"orders": [{"id": 1}, {"id"'),
+                'orders'
+            ))
+
+class TestSessions(unittest.TestCase):
+
+    def test_rate_budget(self):
+        now = [0]
+        slept = []
+        budget = coinex_api.RateBudget(rate=2, burst=2,
+                                       clock=lambda: now[0],
+                                       sleep=slept.append)
+        self.assertTrue(budget.acquire() == 0, 'Burst is free')
+        self.assertTrue(budget.acquire() == 0, 'Burst is free')
+        self.assertTrue(budget.acquire() == 0.5, 'Then one per half second')
+        self.assertTrue(budget.acquire() == 1, 'Slots are reserved in turn')
+        self.assertTrue(slept == [0.5, 1], 'Waits are slept')
+        now[0] = 10
+        self.assertTrue(budget.acquire() == 0, 'Refilled up to burst')
+        unlimited = coinex_api.RateBudget(rate=None)
+        self.assertTrue(unlimited.acquire() == 0, 'No limit')
+
+    def test_session_requests(self):
+        made = []
+
+        def fake_request(page, data=None, private=False, method=None,
+                         session=None):
+            made.append((page, private, session))
+            return {'balances': [], 'orders': [{'id': 5}]}
+        alice = coinex_api.Session('alice-key', 'alice-secret', 'alice')
+        bob = coinex_api.Session('bob-key', b'bob-secret', 'bob')
+        with mock.patch.object(coinex_api, '_make_request', fake_request):
+            alice.balances()
+            bob.cancel_orders([5, 6])
+        self.assertTrue(made[0] == ('balances', True, alice),
+                        'Made as its session')
+        self.assertTrue(
+            sorted(m[0] for m in made[1:]) ==
+            ['orders/5/cancel', 'orders/6/cancel'],
+            'Batches are made as the session'
+        )
+        self.assertTrue(all(m[2] is bob for m in made[1:]), 'As bob')
+        req = alice.builder.build('balances')
+        self.assertTrue(req.get_header('Api-key') == 'alice-key',
+                        'Each session has its own key')
+        self.assertTrue(
+            req.get_header('Api-sign') ==
+            hmac.new(b'alice-secret', b'', sha512).hexdigest(),
+            'And its own secret'
+        )
+        self.assertTrue(alice.budget is not bob.budget, 'Own budgets')
+
+    def test_get_sessions(self):
+        import configparser
+        conf = configparser.ConfigParser()
+        conf.read_string(
+            '[Credentials]\nKey = a\nSecret = b\n'
+            '[Credentials bob]\nKey = c\nSecret = d\n'
+            '[Other]\nKey = e\n'
+        )
+        saved = dict(
+            (fn, fn.__dict__.copy())
+            for fn in (coinex_api.default_session, coinex_api.get_sessions)
+        )
+        for fn in saved:
+            fn.__dict__.clear()
+        try:
+            with mock.patch.object(coinex_api, '_get_config', lambda: conf):
+                sessions = coinex_api.get_sessions()
+                self.assertTrue(
+                    [s.name for s in sessions] == ['default', 'bob'],
+                    'One session per credentials section'
+                )
+                self.assertTrue(sessions[0] is coinex_api.default_session(),
+                                'The default session comes first')
+                self.assertTrue(sessions[1].builder.signer.key == 'c',
+                                'Sections have their own keys')
+        finally:
+            for fn, attrs in saved.items():
+                fn.__dict__.clear()
+                fn.__dict__.update(attrs)
+
+
 if __name__ == '__main__':
     unittest.main()
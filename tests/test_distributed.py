@@ -0,0 +1,97 @@
+"""
+test_distributed.py
+
+Test scanning chains across worker processes
+"""
+
+import multiprocessing
+import os
+import sys
+import unittest
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import arbitrage
+import chain_cache
+import distributed
+from tests import fixtures
+
+
+class TestDistributed(unittest.TestCase):
+
+    def test_worker(self):
+        market = fixtures.triangle()
+        with market:
+            topology = arbitrage.chain_topology(market.pairs)
+            worker = distributed.Worker()
+            shard = chain_cache.ChainTopology.from_rows(
+                [row for row in topology if row[0] != 11]
+            )
+            columns = [
+                col.tobytes()
+                for col in (shard.ex1, shard.ex2, shard.ex3, shard.flags)
+            ]
+            self.assertTrue(worker.handle(('shard', [10, 12], columns)) == 2,
+                            'The shard should be taken')
+            tops = worker.handle(('fetch', 1))
+            self.assertTrue(sorted(tops) == [10, 12],
+                            'Only our exchanges are fetched')
+            self.assertTrue(market.calls['orders'] == 2, 'Once each')
+            with self.assertRaises(KeyError):
+                worker.handle(('nope',))
+
+    @unittest.skipUnless(
+        'fork' in multiprocessing.get_all_start_methods(),
+        'the workers inherit the fake market by forking'
+    )
+    def test_local_workers(self):
+        market = fixtures.triangle()
+        authkey = os.urandom(16)
+        with market:
+            local = distributed.start_local_workers(
+                2,
+                authkey,
+                multiprocessing.get_context('fork')
+            )
+            coordinator = distributed.Coordinator(
+                [address for _, address in local],
+                authkey
+            )
+            try:
+                counts = coordinator.load()
+                tops = coordinator.fetch()
+                found = coordinator.scan(tops)
+                best = coordinator.scan(tops, limit=1)
+            finally:
+                coordinator.close(stop=True)
+                for proc, _ in local:
+                    proc.join(10)
+            self.assertTrue(sum(counts) == 3, 'Every chain is sent once')
+            self.assertTrue(sorted(tops) == [10, 11, 12],
+                            'Every book is fetched')
+            self.assertTrue(
+                [row[:3] for _, row, _ in found] in (
+                    [(10, 12, 11), (12, 11, 10)],
+                    [(12, 11, 10), (10, 12, 11)]
+                ),
+                'The profitable chains are merged'
+            )
+            self.assertTrue(found[0][0] >= found[1][0], 'Ranked by ROI')
+            self.assertAlmostEqual(
+                found[0][0],
+                arbitrage.chain_roi(tops, found[0][1]),
+                msg='ROI as chain_roi() has it'
+            )
+            self.assertTrue(best == found[:1], 'Limited')
+            self.assertTrue(
+                all(not proc.is_alive() for proc, _ in local),
+                'The workers stop'
+            )
+            line = distributed.format_result(*found[0])
+            self.assertTrue(line.count('->') == 3, 'A line per chain')
+
+
+if __name__ == '__main__':
+    unittest.main()
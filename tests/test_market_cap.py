@@ -1,17 +1,32 @@
+import io
 import os
 import sys
 from decimal import *
 import unittest
+from unittest import mock
 
 _path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _path not in sys.path:
     sys.path.append(_path)
 
 import market_cap
+from tests import fixtures
+
+
+def fake_ticker(*args, **kwargs):
+    return io.BytesIO(b'{"last": "600.00"}')
 
 
 class TestMarketCap(unittest.TestCase):
 
+    def setUp(self):
+        for memo in [(market_cap.get_btc_exchange, '_excs'),
+                     (market_cap.get_bitstamp_price, '_cached'),
+                     (market_cap.get_balances, '_balances'),
+                     (market_cap.get_engine, '_engine')]:
+            if hasattr(*memo):
+                delattr(*memo)
+
     def test_bitstamp_price(self):
         prc = market_cap.get_bitstamp_price()
         self.assertTrue(
@@ -23,5 +38,125 @@ class TestMarketCap(unittest.TestCase):
             'I bet bitcoin is more than $1/BTC yo'
         )
 
+    def test_bitstamp_price_cached(self):
+        with mock.patch('urllib.request.urlopen',
+                        side_effect=fake_ticker) as urlopen:
+            prc = market_cap.get_bitstamp_price()
+            prc = market_cap.get_bitstamp_price()
+            self.assertTrue(prc == Decimal('600'), 'price should match')
+            self.assertTrue(urlopen.call_count == 1, 'Should be cached')
+            market_cap.get_bitstamp_price(max_age=0)
+            self.assertTrue(urlopen.call_count == 2, 'Should expire')
+
+    def test_market_cap(self):
+        market = fixtures.triangle()
+        with market, mock.patch('urllib.request.urlopen', fake_ticker):
+            lines = market_cap.show_market_cap()
+        self.assertTrue(
+            lines == ['  2.00119760 BTC', '1200.71860000 USD'],
+            'Should value BTC with held and sell DOGE into the bids'
+        )
+        self.assertTrue(
+            market.calls['orders'] == 1,
+            'Only the DOGE book should be fetched'
+        )
+
+    def test_market_cap_multi_hop(self):
+        market = fixtures.triangle()
+        # FTC only trades against LTC
+        market.currencies.append((4, 'FTC'))
+        market.pairs.append((13, 2, 4))
+        market.books[13] = [(True, '0.5', '10'), (False, '0.6', '10')]
+        market.balances = {4: ('2', '0')}
+        with market, mock.patch('urllib.request.urlopen', fake_ticker):
+            lines = market_cap.show_market_cap()
+        # 2 FTC -> 1 LTC -> 20000 DOGE -> 0.024 BTC, less three fees
+        self.assertTrue(
+            lines[0] == '  0.02385629 BTC',
+            'Should value FTC through LTC and DOGE'
+        )
+        self.assertTrue(
+            market.calls['orders'] == 4,
+            'Should fetch the whole graph once'
+        )
+
+    def test_value_table(self):
+        market = fixtures.triangle()
+        with market, mock.patch('urllib.request.urlopen', fake_ticker):
+            lines = market_cap.show_table()
+            plain = market_cap.show_market_cap()
+            bals = market_cap.get_balances()
+            rows, totals = market_cap.value_table(
+                bals,
+                {1: 1.0, 3: 0.000001},
+                Decimal(600)
+            )
+        self.assertTrue(
+            [r[:2] for r in rows] == [('BTC', 2.0), ('DOGE', 1000.0)],
+            'Rows should be sorted by value, with held included'
+        )
+        for row, btc, usd in zip(rows, (2.0, 0.001), (1200.0, 0.6)):
+            self.assertAlmostEqual(row[2], btc, places=8)
+            self.assertAlmostEqual(row[3], usd, places=6)
+        self.assertAlmostEqual(totals[0], 2.001, places=8)
+        self.assertAlmostEqual(totals[1], 1200.6, places=6)
+        self.assertTrue(lines[1].split()[0] == 'BTC', 'BTC first')
+        self.assertTrue(lines[-1].split()[0] == 'TOTAL', 'Total last')
+        self.assertAlmostEqual(
+            float(lines[-1].split()[1]),
+            float(plain[0].split()[0]),
+            places=8,
+            msg='The table should add up to the market cap'
+        )
+
+    def test_value_table_bitstamp_down(self):
+        def down(*args, **kwargs):
+            raise market_cap.URLError('unreachable')
+        market = fixtures.triangle()
+        with market, mock.patch('urllib.request.urlopen', down):
+            lines = market_cap.show_table()
+        self.assertTrue('USD' not in lines[0], 'No USD column')
+        self.assertTrue(lines[1].split()[0] == 'BTC', 'BTC first')
+        self.assertTrue(len(lines[1].split()) == 3, 'No made up USD values')
+        self.assertTrue(lines[-3].split()[0] == 'TOTAL', 'Total kept')
+        self.assertTrue(len(lines[-3].split()) == 2, 'BTC total only')
+        self.assertTrue(lines[-2] == 'Error: unreachable', 'Error shown')
+        self.assertTrue(lines[-1] == 'Is bitstamp down?', 'Hint shown')
+
+    def test_transient_errors(self):
+        def timeout(*args, **kwargs):
+            raise TimeoutError('timed out')
+
+        def coinex_down(*args, **kwargs):
+            raise market_cap.URLError('refused')
+        market = fixtures.triangle()
+        with market, mock.patch('urllib.request.urlopen', timeout):
+            lines = market_cap.show_market_cap()
+            self.assertTrue(lines[-2:] == ['Error: timed out',
+                                           'Is bitstamp down?'],
+                            'A bitstamp timeout is reported')
+            with mock.patch.object(market_cap.models.coinex_api,
+                                   'iter_orders', coinex_down):
+                lines = market_cap.show_market_cap(refresh=True)
+                self.assertTrue(lines == ['Error: refused',
+                                          'Is coinex down?'],
+                                'A coinex failure is reported')
+                lines = market_cap.show_table(refresh=True)
+                self.assertTrue(lines == ['Error: refused',
+                                          'Is coinex down?'],
+                                'In the table too')
+
+    def test_watch_reuses_caches(self):
+        market = fixtures.triangle()
+        with market, mock.patch('urllib.request.urlopen',
+                                wraps=fake_ticker) as ticker:
+            first = market_cap.show_market_cap(refresh=True)
+            second = market_cap.show_market_cap(refresh=True)
+        self.assertTrue(first == second, 'Same market, same value')
+        self.assertTrue(market.calls['balances'] == 1,
+                        'The cached balances are reused')
+        self.assertTrue(ticker.call_count == 1, 'The price is reused')
+
+
 if __name__ == '__main__':
     unittest.main()
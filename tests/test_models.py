@@ -14,7 +14,10 @@ _path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _path not in sys.path:
     sys.path.append(_path)
 
+import coinex_api
 import models
+from tests import fixtures
+from unittest import mock
 
 
 class TestModels(unittest.TestCase):
@@ -86,6 +89,68 @@ class TestModels(unittest.TestCase):
             'Should not fetch object after deletion'
         )
 
+    def test_registry_delete_removes(self):
+        reg = models.Registry()
+        curr = models.Currency(10, 'NMC', 'Namecoin')
+        reg.put(curr)
+        reg.delete(10, models.Currency)
+        self.assertTrue(
+            len(reg.get_all(models.Currency)) == 0,
+            'Deleted models should not be kept'
+        )
+        self.assertTrue(
+            reg.stats()[models.Currency]['entries'] == 0,
+            'Stats should not count deleted models'
+        )
+
+    def test_registry_lru(self):
+        reg = models.Registry()
+        reg.set_policy(models.Currency, models.RetentionPolicy(max_entries=2))
+        c1 = models.Currency(1, 'FOO', 'Foocoin')
+        c2 = models.Currency(2, 'BAR', 'Barcoin')
+        c3 = models.Currency(3, 'BAZ', 'Bazcoin')
+        reg.put(c1)
+        reg.put(c2)
+        # touch c1 so c2 is the least recently used
+        reg.get(models.Currency, 1)
+        reg.put(c3)
+        self.assertTrue(reg.get(models.Currency, 2) is None, 'c2 evicted')
+        self.assertTrue(reg.get(models.Currency, 1) == c1, 'c1 kept')
+        self.assertTrue(reg.get(models.Currency, 3) == c3, 'c3 kept')
+
+    def test_registry_ttl(self):
+        now = [0]
+        reg = models.Registry(clock=lambda: now[0])
+        reg.set_policy(models.Currency, models.RetentionPolicy(ttl=10))
+        curr = models.Currency(1, 'FOO', 'Foocoin')
+        reg.put(curr)
+        now[0] = 5
+        self.assertTrue(reg.get(models.Currency, 1) == curr, 'Still alive')
+        now[0] = 11
+        self.assertTrue(reg.get(models.Currency, 1) is None, 'Expired')
+        reg.put(curr)
+        now[0] = 30
+        self.assertTrue(reg.purge() == 1, 'Purge should remove one')
+        self.assertTrue(
+            reg.get_all(models.Currency) == [],
+            'Nothing should be left'
+        )
+
+    def test_registry_weak(self):
+        reg = models.Registry()
+        reg.set_policy(models.Currency, models.RetentionPolicy(weak=True))
+        reg.put(models.Currency(1, 'FOO', 'Foocoin'))
+        kept = models.Currency(2, 'BAR', 'Barcoin')
+        reg.put(kept)
+        self.assertTrue(
+            reg.get(models.Currency, 1) is None,
+            'Unreferenced model should be dropped'
+        )
+        self.assertTrue(reg.get(models.Currency, 2) == kept, 'Kept model')
+        stats = reg.stats()[models.Currency]
+        self.assertTrue(stats['entries'] == 1, 'One entry should be held')
+        self.assertTrue(stats['bytes'] > 0, 'Memory should be reported')
+
     def test_exchange(self):
         excs = models.Exchange.get_all()
         self.assertTrue(0 != len(excs), 'There should be more than 0 exchanges')
@@ -141,5 +206,397 @@ class TestModels(unittest.TestCase):
         self.assertTrue(comp.rate == Decimal(2), 'Rates should match')
         self.assertTrue(comp.amount == Decimal('1'), 'amount should match')
 
+    def test_best_levels(self):
+        rows = [
+            {'bid': True, 'rate': 5}, {'bid': True, 'rate': 7},
+            {'bid': False, 'rate': 9}, {'bid': True, 'rate': 7},
+            {'bid': False, 'rate': 8}, {'bid': True, 'rate': 6},
+            {'bid': False, 'rate': 10},
+        ]
+        kept, seen = models._best_levels(iter(rows), 2)
+        self.assertTrue(seen == 7, 'Should see every row')
+        self.assertTrue(
+            sorted((r['bid'], r['rate']) for r in kept) ==
+            [(False, 8), (False, 9), (True, 6), (True, 7), (True, 7)],
+            'Should keep every order of the two best levels of each side'
+        )
+
+    def test_orders_listeners(self):
+        seen = []
+
+        def listener(exchange, orders):
+            seen.append((exchange.id, len(orders)))
+        with fixtures.triangle():
+            ex = models.Exchange.get(10)
+            models.Exchange.add_orders_listener(listener)
+            try:
+                whole = ex.get_orders()
+                ex.get_orders(depth=1)
+            finally:
+                models.Exchange.remove_orders_listener(listener)
+        self.assertTrue(seen == [(10, len(whole))],
+                        'Only whole books go to the listeners')
+
+    def test_top_of_book(self):
+        with fixtures.triangle():
+            models.book_stats.reset()
+            ex = models.Exchange.get(10)
+            full = ex.get_orders()
+            top = ex.get_orders(depth=1)
+        self.assertTrue(len(full) == 4, 'Full book')
+        self.assertTrue(
+            sorted((o.bid, o.rate) for o in top) ==
+            [(False, Decimal('0.021')), (False, Decimal('0.021')),
+             (True, Decimal('0.02'))],
+            'Only the best level of each side should be kept'
+        )
+        self.assertTrue(models.book_stats.books == 2, 'Two books fetched')
+        self.assertTrue(models.book_stats.rows == 8, 'Rows seen counted')
+        self.assertTrue(models.book_stats.kept == 7, 'Orders built counted')
+
+    def test_submit_many(self):
+        def fake_submit(orders):
+            ret = []
+            for i, o in enumerate(orders):
+                if o['trade_pair_id'] == 11:
+                    ret.append(ValueError('rejected'))
+                    continue
+                ret.append({
+                    'id': 100 + i,
+                    'trade_pair_id': o['trade_pair_id'],
+                    'amount': int(o['amount'] * pow(10, 8)),
+                    'rate': int(o['rate'] * pow(10, 8)),
+                    'bid': o['bid'],
+                    'filled': 0,
+                    'cancelled': False,
+                    'complete': False,
+                    'created_at': '2014-02-01T10:00:00.000Z'
+                })
+            return ret
+        with fixtures.triangle():
+            ords = [
+                models.Order(
+                    order_id=-1,
+                    exchange=models.Exchange.get(ex),
+                    bid=True,
+                    amount=Decimal(1),
+                    rate=Decimal('0.5')
+                )
+                for ex in (10, 11)
+            ]
+            with mock.patch.object(coinex_api, 'submit_orders', fake_submit):
+                rsps = models.Order.submit_many(ords)
+        self.assertTrue(ords[0].id == 100, 'Accepted order should be reset')
+        self.assertTrue(ords[0].filled == 0, 'Accepted order has filled')
+        self.assertTrue(ords[1].id == -1, 'Rejected order should be kept')
+        self.assertTrue(isinstance(rsps[1], ValueError), 'Error returned')
+
+    def test_balance_cache(self):
+        now = [0]
+        market = fixtures.triangle()
+        with market:
+            cache = models.BalanceCache(interval=60, clock=lambda: now[0])
+            self.assertTrue(cache.amount(1) == Decimal('1.5'), 'Loaded')
+            self.assertTrue(cache.amount(4) == 0, 'Unknown currency')
+            now[0] = 30
+            cache.get(3)
+            self.assertTrue(market.calls['balances'] == 1, 'Still cached')
+            # buy 10 LTC at 0.02 BTC each
+            ordr = models.Order(
+                order_id=7,
+                exchange=models.Exchange.get(10),
+                bid=True,
+                amount=Decimal(10),
+                filled=Decimal(0),
+                rate=Decimal('0.02'),
+                cancelled=False,
+                complete=False
+            )
+            cache.record(ordr)
+            btc = cache.get(1)
+            self.assertTrue(btc.amount == Decimal('1.3'), 'BTC spent')
+            self.assertTrue(btc.held == Decimal('0.7'), 'BTC held')
+            ordr.filled = Decimal(4)
+            cache.record(ordr)
+            self.assertTrue(btc.held == Decimal('0.62'), 'Hold paid out')
+            self.assertTrue(cache.amount(2) == Decimal('3.992'),
+                            'LTC credited after fees')
+            ordr.cancelled = True
+            cache.record(ordr)
+            cache.record(ordr)
+            self.assertTrue(btc.amount == Decimal('1.42'), 'Rest released')
+            self.assertTrue(btc.held == Decimal('0.5'), 'Hold released')
+            self.assertTrue(cache.amount(2) == Decimal('3.992'), 'Once only')
+            now[0] = 60
+            self.assertTrue(cache.amount(1) == Decimal('1.5'), 'Refreshed')
+            self.assertTrue(market.calls['balances'] == 2, 'Refetched')
+
+    def test_balance_cache_refresh(self):
+        market = fixtures.triangle()
+        with market:
+            cache = models.BalanceCache(interval=None)
+            ordr = models.Order(
+                order_id=8,
+                exchange=models.Exchange.get(10),
+                bid=True,
+                amount=Decimal(10),
+                filled=Decimal(0),
+                rate=Decimal('0.02'),
+                cancelled=False,
+                complete=False
+            )
+            cache.amount(1)
+            cache.record(ordr)
+            # coinex reports the fill of 4 in the balances
+            market.balances[1] = ('1.3', '0.62')
+            market.balances[2] = ('3.992', '0')
+            cache.refresh()
+            ordr.filled = Decimal(4)
+            cache.record(ordr)
+            self.assertTrue(cache.amount(2) == Decimal('3.992'),
+                            'A fill the refresh included is not added again')
+            ordr.filled = Decimal(5)
+            cache.record(ordr)
+            self.assertTrue(cache.amount(2) == Decimal('4.990'),
+                            'Later fills are applied')
+            ordr.cancelled = True
+            cache.record(ordr)
+            self.assertTrue(cache._filled == {}, 'Finished orders dropped')
+            cache.refresh()
+            cache.record(ordr)
+            self.assertTrue(cache.amount(2) == Decimal('3.992'),
+                            'Still known as finished after one refresh')
+            cache.refresh()
+            self.assertTrue(not cache._finished and
+                            not cache._finished_before,
+                            'Then forgotten')
+
+    def test_own_orders(self):
+        def row(id_, pair, bid, amount, rate, filled=0):
+            return {
+                'id': id_,
+                'trade_pair_id': pair,
+                'bid': bid,
+                'amount': int(Decimal(amount) * pow(10, 8)),
+                'rate': int(Decimal(rate) * pow(10, 8)),
+                'filled': int(Decimal(filled) * pow(10, 8)),
+                'cancelled': False,
+                'complete': False,
+                'created_at': '2014-02-01T10:00:00.000Z'
+            }
+        rows = []
+        with fixtures.triangle():
+            mirror = models.OwnOrders(fetch=lambda: rows)
+            # buy 10 LTC with BTC, sell 1000 DOGE for LTC
+            mirror.track(models.Order(API_resp=row(1, 10, True, 10, '0.02')))
+            mirror.track(models.Order(API_resp=row(2, 12, False, 1000,
+                                                   '0.00005')))
+            self.assertTrue(mirror.reserved(1) == Decimal('0.2'), 'BTC held')
+            self.assertTrue(mirror.reserved(3) == 1000, 'DOGE held')
+            self.assertTrue(mirror.reserved(2) == 0, 'No LTC held')
+            self.assertTrue([o.id for o in mirror.outstanding(10)] == [1],
+                            'Outstanding by exchange')
+            mirror.track(models.Order(API_resp=row(1, 10, True, 10, '0.02',
+                                                   4)))
+            self.assertTrue(mirror.reserved(1) == Decimal('0.12'), 'Filled')
+            cancelled = row(2, 12, False, 1000, '0.00005')
+            cancelled['cancelled'] = True
+            mirror.track(models.Order(API_resp=cancelled))
+            self.assertTrue(mirror.reserved(3) == 0, 'Cancel releases')
+            self.assertTrue(mirror.outstanding(12) == [], 'Cancel removes')
+            kept = mirror.get(1)
+            rows[:] = [row(1, 10, True, 10, '0.02', 4),
+                       row(3, 11, True, 5, '0.0000013')]
+            ords = mirror.reconcile()
+            self.assertTrue(ords[0] is kept, 'Unchanged orders are reused')
+            self.assertTrue(len(mirror) == 2, 'New orders are added')
+            rows[:] = []
+            mirror.reconcile()
+            self.assertTrue(mirror.reserved(1) == 0, 'Reconciled away')
+
+    def test_own_orders_tracked_while_reconciling(self):
+        def row(id_, amount, cancelled=False):
+            return {
+                'id': id_,
+                'trade_pair_id': 10,
+                'bid': True,
+                'amount': amount * pow(10, 8),
+                'rate': 2 * pow(10, 6),
+                'filled': 0,
+                'cancelled': cancelled,
+                'complete': False,
+                'created_at': '2014-02-01T10:00:00.000Z'
+            }
+
+        def fetch():
+            # coinex answers with what it had before these two came in
+            mirror.track(models.Order(API_resp=row(1, 10)))
+            mirror.track(models.Order(API_resp=row(2, 5, cancelled=True)))
+            return [row(2, 5)]
+        with fixtures.triangle():
+            mirror = models.OwnOrders(fetch=fetch)
+            ords = mirror.reconcile()
+            self.assertTrue([o.id for o in ords] == [1],
+                            'Orders tracked meanwhile win over the report')
+            self.assertTrue(mirror.get(1) is not None, 'New order kept')
+            self.assertTrue(mirror.get(2) is None, 'Cancelled one dropped')
+            self.assertTrue(mirror.reserved(1) == Decimal('0.2'), 'BTC held')
+            self.assertTrue(mirror._tracking == [], 'Stopped recording')
+
+    def test_own_orders_lifecycle(self):
+        status = {'filled': 0, 'cancelled': False}
+
+        def reply(*args, **kwargs):
+            return {
+                'id': 21,
+                'trade_pair_id': 12,
+                'bid': False,
+                'amount': 10 * pow(10, 8),
+                'rate': 5000,
+                'filled': status['filled'] * pow(10, 8),
+                'cancelled': status['cancelled'],
+                'complete': False,
+                'created_at': '2014-02-01T10:00:00.000Z'
+            }
+        with fixtures.triangle():
+            # sell 10 DOGE for LTC, one Order object all the way through
+            ordr = models.Order(
+                order_id=-1,
+                exchange=models.Exchange.get(12),
+                bid=False,
+                amount=Decimal(10),
+                rate=Decimal('0.00005')
+            )
+            with mock.patch.multiple(coinex_api,
+                                     submit_order=reply,
+                                     order_status=reply,
+                                     cancel_order=reply):
+                ordr.submit()
+                self.assertTrue(models.own_orders.reserved(3) == 10,
+                                'Submitting holds the amount')
+                status['filled'] = 4
+                ordr.refresh()
+                self.assertTrue(models.own_orders.reserved(3) == 6,
+                                'A fill releases its part')
+                status['cancelled'] = True
+                ordr.cancel()
+                self.assertTrue(models.own_orders.reserved(3) == 0,
+                                'Cancelling releases the rest')
+            self.assertTrue(models.own_orders.get(21) is None, 'Dropped')
+
+    def test_accounts(self):
+        class FakeSession:
+            def balances(self):
+                return [{'currency_id': 1, 'amount': 25 * pow(10, 7),
+                         'held': 0}]
+
+            def open_orders(self):
+                return []
+
+            def submit_order(self, trade_pair_id, amount, bid, rate):
+                return {
+                    'id': 9,
+                    'trade_pair_id': trade_pair_id,
+                    'amount': int(amount * pow(10, 8)),
+                    'rate': int(rate * pow(10, 8)),
+                    'bid': bid,
+                    'filled': 0,
+                    'cancelled': False,
+                    'complete': False,
+                    'created_at': '2014-02-01T10:00:00.000Z'
+                }
+        session = FakeSession()
+        with fixtures.triangle():
+            account = models.get_account(session)
+            self.assertTrue(models.get_account(session) is account,
+                            'One account per session')
+            self.assertTrue(models.get_account() is models.default_account,
+                            'None is the default account')
+            default = coinex_api.Session('key', 'secret', 'default')
+            with mock.patch.object(coinex_api.default_session, '_session',
+                                   default, create=True):
+                self.assertTrue(
+                    models.get_account(default) is models.default_account,
+                    'So is the default session'
+                )
+            self.assertTrue(default not in models._accounts,
+                            'Without an account of its own')
+            btc = models.Currency.get(1)
+            self.assertTrue(
+                models.Wallet.get_balance(btc, session).amount ==
+                Decimal('2.5'),
+                'Balances come from the session'
+            )
+            self.assertTrue(
+                models.Wallet.get_balance(btc).amount == Decimal('1.5'),
+                'The default account is kept apart'
+            )
+            ordr = models.Order(
+                order_id=-1,
+                exchange=models.Exchange.get(10),
+                bid=True,
+                amount=Decimal(10),
+                rate=Decimal('0.02')
+            )
+            ordr.session = session
+            ordr.submit()
+            self.assertTrue(ordr.session is session, 'Session kept')
+            self.assertTrue(account.orders.get(9) is ordr,
+                            'Tracked by its account')
+            self.assertTrue(models.own_orders.get(9) is None,
+                            'Not by the default one')
+            self.assertTrue(
+                account.balances.amount(btc) == Decimal('2.3'),
+                'The hold is taken from its account'
+            )
+            self.assertTrue(
+                models.balance_cache.amount(btc) == Decimal('1.5'),
+                'And not from the default one'
+            )
+
+    def test_account_reconcile(self):
+        class FakeSession:
+            def __init__(self, order_id):
+                self.order_id = order_id
+                self.cancelled = []
+
+            def row(self, cancelled=False):
+                return {
+                    'id': self.order_id,
+                    'trade_pair_id': 10,
+                    'bid': True,
+                    'amount': 10 * pow(10, 8),
+                    'rate': 2 * pow(10, 6),
+                    'filled': 0,
+                    'cancelled': cancelled,
+                    'complete': False,
+                    'created_at': '2014-02-01T10:00:00.000Z'
+                }
+
+            def open_orders(self):
+                return [self.row()]
+
+            def cancel_order(self, order_id):
+                self.cancelled.append(order_id)
+                return self.row(cancelled=True)
+        alice, bob = FakeSession(31), FakeSession(32)
+        with fixtures.triangle():
+            mine = models.get_account(alice)
+            theirs = models.get_account(bob)
+            ordr = mine.orders.reconcile()[0]
+            theirs.orders.reconcile()
+            self.assertTrue(ordr.session is alice,
+                            'Rebuilt orders keep their session')
+            with mock.patch.object(coinex_api, 'cancel_order') as default:
+                ordr.cancel()
+            self.assertTrue(alice.cancelled == [31], 'Cancelled as alice')
+            self.assertTrue(not default.called, 'Not as the default')
+            self.assertTrue(bob.cancelled == [], 'Not as bob')
+            self.assertTrue(mine.orders.get(31) is None,
+                            'Dropped from its account')
+            self.assertTrue(theirs.orders.get(32) is not None,
+                            'The other account is left alone')
+
+
 if __name__ == '__main__':
     unittest.main()
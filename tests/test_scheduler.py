@@ -0,0 +1,77 @@
+"""
+test_scheduler.py
+
+Test the opportunity-weighted book refresh scheduler
+"""
+
+import os
+import sys
+import unittest
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import models
+import scheduler
+from tests import fixtures
+
+
+def two_triangles():
+    """
+    The fixtures triangle, plus FTC traded against BTC and LTC so badly
+    that its chains lose a third of what is put through them
+    """
+    market = fixtures.triangle()
+    market.currencies.append((4, 'FTC'))
+    market.pairs += [(13, 1, 4), (14, 2, 4)]
+    market.books[13] = [(True, '0.0008', '1000'), (False, '0.001', '1000')]
+    market.books[14] = [(True, '0.03', '1000'), (False, '0.05', '1000')]
+    return market
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_closeness(self):
+        self.assertTrue(scheduler.closeness(0) == 1, 'Break even is hottest')
+        self.assertTrue(scheduler.closeness(0.1) == 1, 'So is a profit')
+        self.assertTrue(scheduler.closeness(None) == 0, 'Not exchangeable')
+        self.assertTrue(scheduler.closeness(-0.01) == 0.5, 'Half as hot')
+
+    def test_budget_and_priority(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        market = two_triangles()
+        with market:
+            fetched = []
+
+            def fetch(ex):
+                fetched.append(ex.id)
+                return ex.get_orders(depth=1)
+            sched = scheduler.RefreshScheduler(
+                budget=1,
+                fetch=fetch,
+                clock=lambda: now[0],
+                sleep=sleep
+            )
+            sched.run(duration=300)
+        self.assertTrue(
+            sorted(fetched[:5]) == [10, 11, 12, 13, 14],
+            'Every book should be fetched once first'
+        )
+        self.assertTrue(len(fetched) <= 301, 'The budget should be kept')
+        self.assertTrue(len(fetched) >= 295, 'The budget should be used')
+        counts = dict((i, fetched.count(i)) for i in set(fetched))
+        self.assertTrue(
+            min(counts[11], counts[12]) > 3 * max(counts[13], counts[14]),
+            'The profitable triangle should be refreshed most'
+        )
+        self.assertTrue(counts[13] > 1, 'Cold books are still refreshed')
+        rois = dict((chain[:3], roi) for chain, roi in sched.rois())
+        self.assertAlmostEqual(rois[(10, 12, 11)], 0.136, places=3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+test_service.py
+
+Test the warm local service and its clients
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import models
+import service
+from tests import fixtures
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'coinex.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_not_running(self):
+        self.assertTrue(service.request('ping', path=self.path) is None,
+                        'Clients should fall back when nothing listens')
+        open(self.path, 'w').close()
+        self.assertTrue(service.request('ping', path=self.path) is None,
+                        'Or when the socket was left behind')
+
+    def test_requests(self):
+        market = fixtures.triangle()
+        with market:
+            svc = service.Service(book_refresh=60)
+            server = service.ServiceServer(svc, self.path)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            svc.start()
+            try:
+                self.assertTrue(
+                    service.request('ping', path=self.path) == ['pong'],
+                    'Should answer'
+                )
+                with self.assertRaises(RuntimeError):
+                    service.ServiceServer(svc, self.path)
+                lines = service.request('balances', path=self.path)
+                self.assertTrue(
+                    lines == ['BTC 2.0 (0.5 held)', 'DOGE 1000 (0 held)'],
+                    'Balances should be listed'
+                )
+                service.request('balances', path=self.path)
+                self.assertTrue(market.calls['balances'] == 1,
+                                'Balances should stay warm')
+                lines = service.request('arbitrage', path=self.path)
+                self.assertTrue(lines[-2] == 'Found 2 arbitrage chains',
+                                'Chains should be scanned')
+                fetched = market.calls['orders']
+                service.request('arbitrage', ['--min-roi', '0.2'],
+                                path=self.path)
+                self.assertTrue(market.calls['orders'] == fetched,
+                                'Scans should use the warm books')
+                self.assertTrue(
+                    service.request('nope', path=self.path) is None,
+                    'Unknown commands fail'
+                )
+            finally:
+                svc.stop()
+                server.shutdown()
+                thread.join()
+                server.server_close()
+        self.assertTrue(not os.path.exists(self.path), 'Socket removed')
+
+    def test_market_cap_without_interval(self):
+        def down(*args, **kwargs):
+            raise OSError('down')
+        market = fixtures.triangle()
+        with market, mock.patch('urllib.request.urlopen', down), \
+                mock.patch.object(models.balance_cache, 'interval', None):
+            svc = service.Service(book_refresh=60)
+            lines = svc.handle('market_cap', [])
+            self.assertTrue(lines[0].endswith(' BTC'), 'Valued')
+            svc.handle('market_cap', ['--table'])
+            self.assertTrue(market.calls['balances'] == 1,
+                            'Balances are fetched once and kept')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+test_snapshots.py
+
+Test the order book snapshot store
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from decimal import *
+from unittest import mock
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import models
+import snapshots
+from tests import fixtures
+
+
+def make_order(order_id, bid, rate, amount, filled=0):
+    return models.Order(
+        order_id=order_id,
+        bid=bid,
+        rate=Decimal(rate),
+        amount=Decimal(amount),
+        filled=Decimal(filled)
+    )
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write_and_read(self):
+        writer = snapshots.SnapshotWriter(self.dir)
+        book1 = [
+            make_order(1, True, '0.001', '2.5'),
+            make_order(2, False, '0.0012', '1', '0.25'),
+        ]
+        book2 = [make_order(3, True, '0.0011', '3')]
+        writer.write(7, book1, timestamp=100)
+        writer.write(8, book2, timestamp=150)
+        writer.write(7, book2, timestamp=200)
+
+        reader = snapshots.SnapshotReader(self.dir)
+        self.assertTrue(reader.exchanges() == [7, 8], 'Both exchanges')
+        self.assertTrue(reader.timestamps(7) == [100, 200], 'Two books')
+        view = reader.get_book(7, at=199)
+        self.assertTrue(view.timestamp == 100, 'Should get the older book')
+        self.assertTrue(len(view) == 2, 'Book should have two rows')
+        self.assertTrue(list(view.side) == [1, 0], 'Sides should match')
+        self.assertTrue(
+            list(view.rate) == [100000, 120000],
+            'Rates should be in 10^-8 units'
+        )
+        self.assertTrue(
+            list(view.filled) == [0, 25000000],
+            'Filled should match'
+        )
+        self.assertTrue(reader.get_book(7, at=99) is None, 'No book yet')
+        self.assertTrue(reader.get_book(7).timestamp == 200, 'Latest book')
+        times = [b.timestamp for b in reader.iter_books()]
+        self.assertTrue(times == [100, 150, 200], 'Books in time order')
+        del view
+        reader.close()
+
+    def test_segments_and_resume(self):
+        writer = snapshots.SnapshotWriter(self.dir, segment_rows=2)
+        book = [make_order(1, True, '1', '1'), make_order(2, False, '2', '1')]
+        writer.write(1, book, timestamp=1)
+        writer.write(1, book, timestamp=2)
+        # reopen and keep appending where we left off
+        writer = snapshots.SnapshotWriter(self.dir, segment_rows=2)
+        writer.write(1, [make_order(3, True, '3', '1')], timestamp=3)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.dir, 'seg-000002.rate')),
+            'Should have rolled over to a third segment'
+        )
+        reader = snapshots.SnapshotReader(self.dir)
+        rates = [list(b.rate) for b in reader.iter_books()]
+        self.assertTrue(
+            rates == [[100000000, 200000000], [100000000, 200000000],
+                      [300000000]],
+            'Books should read back across segments'
+        )
+
+    def test_crash_during_rollover(self):
+        writer = snapshots.SnapshotWriter(self.dir, segment_rows=2)
+        book = [make_order(1, True, '1', '1'), make_order(2, False, '2', '1')]
+        writer.write(1, book, timestamp=1)
+        # a crash while writing the columns of the next segment, before
+        # its index record
+        with open(os.path.join(self.dir, 'seg-000001.rate'), 'wb') as f:
+            f.write(b'\x01' * 8)
+        writer = snapshots.SnapshotWriter(self.dir, segment_rows=2)
+        self.assertTrue(
+            not os.path.exists(os.path.join(self.dir, 'seg-000001.rate')),
+            'Columns past the last indexed segment should be dropped'
+        )
+        writer.write(1, [make_order(3, True, '3', '1')], timestamp=2)
+        reader = snapshots.SnapshotReader(self.dir)
+        books = list(reader.iter_books())
+        self.assertTrue(
+            [list(b.rate) for b in books] ==
+            [[100000000, 200000000], [300000000]],
+            'The new segment should start clean'
+        )
+        self.assertTrue(list(books[1].side) == [1],
+                        'Its columns should line up')
+
+    def test_refresh_and_listener(self):
+        writer = snapshots.SnapshotWriter(self.dir)
+        reader = snapshots.SnapshotReader(self.dir)
+        self.assertTrue(reader.get_book(5) is None, 'Empty store')
+        exc = models.Exchange(
+            5,
+            models.Currency(1, 'FOO', 'Foocoin'),
+            models.Currency(2, 'BAR', 'Barcoin')
+        )
+        writer.attach()
+        try:
+            for cb in models.Exchange._orders_listeners:
+                cb(exc, [make_order(1, False, '0.5', '4')])
+        finally:
+            writer.detach()
+        reader.refresh()
+        self.assertTrue(
+            list(reader.get_book(5).amount) == [400000000],
+            'Listener should store the book'
+        )
+
+    def test_listener_through_get_orders(self):
+        writer = snapshots.SnapshotWriter(self.dir)
+        market = fixtures.triangle()
+        with market:
+            ex = models.Exchange.get(10)
+            writer.attach()
+            try:
+                ex.get_orders(depth=1)
+                whole = ex.get_orders()
+            finally:
+                writer.detach()
+                writer.close()
+        reader = snapshots.SnapshotReader(self.dir)
+        books = list(reader.iter_books())
+        self.assertTrue(len(books) == 1, 'Trimmed books are not stored')
+        self.assertTrue(
+            list(books[0].rate) == [int(o.rate * pow(10, 8)) for o in whole],
+            'The whole book is stored'
+        )
+
+    def test_files_kept_open(self):
+        writer = snapshots.SnapshotWriter(self.dir, segment_rows=2)
+        book = [make_order(1, True, '1', '1')]
+        with mock.patch('builtins.open', wraps=open) as opened:
+            for t in range(4):
+                writer.write(1, book, timestamp=t)
+        writer.close()
+        self.assertTrue(
+            opened.call_count == 2 * len(snapshots.COLUMNS),
+            'Column files are opened once per segment'
+        )
+        reader = snapshots.SnapshotReader(self.dir)
+        self.assertTrue(len(list(reader.iter_books())) == 4, 'All written')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+test_trade_collector.py
+
+Test the trade history collector
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import trade_collector
+
+
+def make_trade(id_, pair_id, hour='10'):
+    return {
+        'id': id_,
+        'trade_pair_id': pair_id,
+        'amount': 100000000,
+        'rate': 2000,
+        'bid': True,
+        'created_at': '2014-02-01T{0}:00:00.000Z'.format(hour)
+    }
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+class TestTradeCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_seen_set(self):
+        seen = trade_collector.SeenSet(window=4)
+        for i in range(10):
+            self.assertTrue(seen.add(i), 'New ids should be added')
+        self.assertFalse(seen.add(9), 'Kept ids should be seen')
+        self.assertFalse(seen.add(1), 'Old ids should be seen')
+        self.assertTrue(len(seen) <= 4, 'Window should stay small')
+
+    def test_dedupe_and_store(self):
+        windows = {
+            1: [make_trade(1, 1), make_trade(2, 1)],
+            2: [make_trade(5, 2, hour='11')],
+        }
+        clock = FakeClock()
+        store = trade_collector.TradeStore(self.dir)
+        collector = trade_collector.TradeCollector(
+            store,
+            pair_ids=[1, 2],
+            fetch=lambda pair_id: windows[pair_id],
+            clock=clock,
+            sleep=clock.sleep
+        )
+        self.assertTrue(collector.poll(1) == 2, 'Both trades are new')
+        windows[1] = [make_trade(2, 1), make_trade(3, 1)]
+        clock.now = 10
+        self.assertTrue(collector.poll(1) == 1, 'Only trade 3 is new')
+        collector.poll(2)
+        store.close()
+        ids = [t['id'] for t in store.read()]
+        self.assertTrue(ids == [1, 2, 3, 5], 'Trades stored once each')
+        self.assertTrue(
+            os.path.exists(os.path.join(self.dir, '2014-02-01', '11.jsonl.gz')),
+            'Trades should be partitioned by hour'
+        )
+
+    def test_adaptive_interval(self):
+        clock = FakeClock()
+        counter = [0]
+
+        def fetch(pair_id):
+            if pair_id == 1:
+                # a busy pair with three new trades on every poll
+                counter[0] += 3
+                return [make_trade(counter[0] - i, 1) for i in range(3)]
+            return []
+        collector = trade_collector.TradeCollector(
+            trade_collector.TradeStore(self.dir),
+            pair_ids=[1, 2],
+            fetch=fetch,
+            clock=clock,
+            sleep=clock.sleep
+        )
+        collector.run(duration=3600)
+        busy = collector.pairs[1]
+        quiet = collector.pairs[2]
+        self.assertTrue(
+            busy.interval < quiet.interval,
+            'Busy pairs should be polled more often'
+        )
+        self.assertTrue(
+            quiet.interval == trade_collector.MAX_INTERVAL,
+            'Quiet pairs should back off fully'
+        )
+        # the busy pair is polled at the fastest rate, the quiet one
+        # should add only a handful of requests on top
+        self.assertTrue(
+            collector.requests < 1.1 * 3600 / trade_collector.MIN_INTERVAL,
+            'Quiet pairs should cost almost no requests'
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+test_utils.py
+
+Test the coinex utilities
+"""
+
+import os
+import sys
+import unittest
+from decimal import *
+from unittest import mock
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import coinex_api
+import models
+import utils
+from tests import fixtures
+
+
+class FakeOrders:
+    """
+    Serves one order that fills by a fixed amount at every status poll
+    """
+
+    def __init__(self, step, cancel_fails=False):
+        self.step = step
+        self.cancel_fails = cancel_fails
+        self.row = None
+        self.polls = 0
+
+    def submit_order(self, trade_pair_id, amount, bid, rate):
+        self.row = {
+            'id': 55,
+            'trade_pair_id': trade_pair_id,
+            'amount': int(amount * pow(10, 8)),
+            'rate': int(rate * pow(10, 8)),
+            'bid': bid,
+            'filled': 0,
+            'cancelled': False,
+            'complete': False,
+            'created_at': '2014-02-01T10:00:00.000Z'
+        }
+        return dict(self.row)
+
+    def order_status(self, order_id):
+        self.polls += 1
+        row = self.row
+        row['filled'] = min(row['amount'], row['filled'] + self.step)
+        row['complete'] = row['filled'] == row['amount']
+        return dict(row)
+
+    def cancel_order(self, order_id):
+        if self.cancel_fails:
+            self.step = self.row['amount']
+            raise ValueError('already complete')
+        self.row['cancelled'] = True
+        return dict(self.row)
+
+    def patch(self):
+        return mock.patch.multiple(
+            coinex_api,
+            submit_order=self.submit_order,
+            order_status=self.order_status,
+            cancel_order=self.cancel_order
+        )
+
+
+class TestUtils(unittest.TestCase):
+
+    def execute(self, api, deadline):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+        with fixtures.triangle(), api.patch():
+            ordr = models.Order(
+                order_id=-1,
+                exchange=models.Exchange.get(10),
+                bid=True,
+                amount=Decimal(10),
+                rate=Decimal('0.021')
+            )
+            result = utils.execute_order(
+                ordr,
+                deadline=deadline,
+                clock=lambda: now[0],
+                sleep=sleep
+            )
+        return result, sleeps
+
+    def test_fills_in_time(self):
+        api = FakeOrders(step=int(4 * pow(10, 8)))
+        result, sleeps = self.execute(api, deadline=60)
+        self.assertTrue(result.filled == 10, 'Filled')
+        self.assertTrue(result.unfilled == 0, 'Nothing left')
+        self.assertTrue(not result.timed_out, 'Not cancelled')
+        self.assertTrue(sleeps == [0.5, 1, 2], 'Polls should back off')
+
+    def test_deadline(self):
+        api = FakeOrders(step=int(pow(10, 8)))
+        result, sleeps = self.execute(api, deadline=5)
+        self.assertTrue(sum(sleeps) == 5, 'Should stop at the deadline')
+        self.assertTrue(result.timed_out, 'The rest should be cancelled')
+        self.assertTrue(result.order.cancelled, 'Reported cancelled')
+        self.assertTrue(result.filled == api.polls, 'Filled so far')
+        self.assertTrue(result.unfilled == 10 - api.polls, 'Unfilled rest')
+
+    def test_filled_while_cancelling(self):
+        api = FakeOrders(step=int(pow(10, 8)), cancel_fails=True)
+        result, sleeps = self.execute(api, deadline=5)
+        self.assertTrue(result.filled == 10, 'It filled after all')
+        self.assertTrue(not result.timed_out, 'Nothing was cancelled')
+
+if __name__ == '__main__':
+    unittest.main()
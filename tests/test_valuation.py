@@ -0,0 +1,80 @@
+"""
+test_valuation.py
+
+Test the multi-hop valuation engine
+"""
+
+import os
+import sys
+import unittest
+from decimal import *
+
+_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _path not in sys.path:
+    sys.path.append(_path)
+
+import models
+import valuation
+from tests import fixtures
+
+
+class TestValuation(unittest.TestCase):
+
+    def setUp(self):
+        self.market = fixtures.triangle()
+        # FTC only trades against LTC
+        self.market.currencies.append((4, 'FTC'))
+        self.market.pairs.append((13, 2, 4))
+        self.market.books[13] = [(True, '0.5', '10'), (False, '0.6', '10')]
+        self.market.__enter__()
+        self.engine = valuation.ValuationEngine(transac_fee=0)
+        self.engine.set_books(dict(
+            (ex.id, ex.get_orders()) for ex in models.Exchange.get_all()
+        ))
+
+    def tearDown(self):
+        self.market.__exit__(None, None, None)
+
+    def test_paths(self):
+        self.assertTrue(
+            self.engine.get_path(models.Currency.get(3)) == [(11, False)],
+            'DOGE is best sold for BTC directly'
+        )
+        self.assertTrue(
+            self.engine.get_path(models.Currency.get(4)) ==
+            [(13, False), (12, True), (11, False)],
+            'FTC should go through LTC and DOGE, which beats LTC/BTC'
+        )
+        self.assertTrue(
+            self.engine.get_path(models.Currency.get(1)) == [],
+            'BTC needs no path'
+        )
+
+    def test_depth(self):
+        doge = models.Currency.get(3)
+        self.assertTrue(
+            self.engine.liquidate(doge, 1000) == Decimal('0.0012'),
+            'Small amounts sell at the top of book'
+        )
+        # 900000 at 0.0000012, 1000000 at 0.0000011, the rest unsold
+        self.assertTrue(
+            self.engine.liquidate(doge, 2000000) == Decimal('2.18'),
+            'Large amounts should walk the book'
+        )
+
+    def test_cache_invalidation(self):
+        self.engine.get_path(models.Currency.get(3))
+        self.assertTrue(self.engine._paths is not None, 'Paths cached')
+        self.engine.set_books({11: models.Exchange.get(11).get_orders()})
+        self.assertTrue(self.engine._paths is not None, 'Same books')
+        self.market.books[11] = [(True, '0.0000001', '10')]
+        self.engine.set_books({11: models.Exchange.get(11).get_orders()})
+        self.assertTrue(self.engine._paths is None, 'Books changed')
+        self.assertTrue(
+            self.engine.get_path(models.Currency.get(3)) ==
+            [(12, False), (10, False)],
+            'DOGE should now go through LTC'
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,298 @@
+"""
+trade_collector.py
+
+Build a continuous trade history by polling the recent trades of every
+trade pair.
+
+USAGE:  python trade_collector.py DIRECTORY
+
+Trades are deduplicated by id and appended to gzipped JSON lines files
+partitioned by the hour they happened in:
+
+    DIRECTORY/YYYY-MM-DD/HH.jsonl.gz
+
+Every pair is polled on its own interval, which shrinks for busy pairs
+and grows for quiet ones so they cost almost no requests.
+"""
+
+from datetime import datetime
+import gzip
+import heapq
+import json
+import os
+import sys
+import time
+
+import coinex_api
+
+
+# bounds of the per-pair polling interval, in seconds
+MIN_INTERVAL = 5
+MAX_INTERVAL = 900
+# how many new trades we aim to see per poll
+TARGET_TRADES = 5
+# weight of the newest observation in the trade rate average
+RATE_SMOOTHING = 0.3
+# the minimum number of seconds between any two requests
+REQUEST_SPACING = 0.5
+
+
+def _current_partition():
+    """
+    Get the (day, hour) partition of the current UTC time
+    """
+    now = datetime.utcnow()
+    return now.strftime('%Y-%m-%d'), now.strftime('%H')
+
+
+class SeenSet:
+    """
+    A compact record of the trade ids seen on one pair.
+    Trade ids only grow, so every id at or below the low mark counts as
+    seen and only the ids in a small window above it are kept.
+    Attributes:
+        low: the highest id that is no longer kept individually
+        window: the most ids to keep individually
+    """
+
+    def __init__(self, window=256):
+        self.low = -1
+        self.window = int(window)
+        self._ids = set()
+
+    def __contains__(self, id_):
+        return id_ <= self.low or id_ in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, id_):
+        """
+        Record an id.
+        Returns true if it had not been seen before
+        """
+        if id_ in self:
+            return False
+        self._ids.add(id_)
+        if len(self._ids) > self.window:
+            # forget the older half of the window
+            ids = sorted(self._ids)
+            cut = len(ids) - self.window // 2
+            self.low = ids[cut - 1]
+            self._ids = set(ids[cut:])
+        return True
+
+
+class TradeStore:
+    """
+    Appends trades to gzipped, hourly partitioned JSON lines files
+    Attributes:
+        directory: the root of the partitions
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+
+    def _partition(self, trade):
+        """
+        Get the (day, hour) partition a trade belongs in
+        """
+        created = trade.get('created_at')
+        if created:
+            return created[:10], created[11:13]
+        return _current_partition()
+
+    def append(self, trades):
+        """
+        Append a list of trades (dicts as returned by the API)
+        """
+        for trade in trades:
+            day, hour = self._partition(trade)
+            key = (day, hour)
+            if key not in self._files:
+                path = os.path.join(self.directory, day)
+                os.makedirs(path, exist_ok=True)
+                fname = os.path.join(path, hour + '.jsonl.gz')
+                self._files[key] = gzip.open(fname, 'at')
+            self._files[key].write(
+                json.dumps(trade, separators=(',', ':')) + '\n'
+            )
+
+    def flush(self, keep=None):
+        """
+        Close every open partition except the one keyed by keep, which
+        is the (day, hour) the collector is currently writing
+        """
+        for key in list(self._files.keys()):
+            if key != keep:
+                self._files.pop(key).close()
+
+    def close(self):
+        """
+        Close all open partitions
+        """
+        self.flush()
+
+    def read(self, day=None):
+        """
+        Returns a generator of the stored trades, in partition order
+        day: only read this 'YYYY-MM-DD' partition
+        NOTE: partitions still open for writing are not read
+        """
+        if not os.path.isdir(self.directory):
+            return
+        days = [day] if day is not None else sorted(
+            os.listdir(self.directory)
+        )
+        for d in days:
+            path = os.path.join(self.directory, d)
+            if not os.path.isdir(path):
+                continue
+            for fname in sorted(os.listdir(path)):
+                if (d, fname[:2]) in self._files:
+                    continue
+                with gzip.open(os.path.join(path, fname), 'rt') as f:
+                    for line in f:
+                        yield json.loads(line)
+
+
+class PairState:
+    """
+    The polling state of one trade pair
+    Attributes:
+        pair_id: the trade pair id
+        seen: the SeenSet of trade ids
+        rate: the smoothed number of trades per second
+        interval: the current polling interval in seconds
+        next_due: when the pair should be polled next
+        last_poll: when the pair was last polled, or None
+    """
+
+    def __init__(self, pair_id, now):
+        self.pair_id = pair_id
+        self.seen = SeenSet()
+        self.rate = 0.0
+        self.interval = MIN_INTERVAL
+        self.next_due = now
+        self.last_poll = None
+
+    def __lt__(self, other):
+        # busier pairs go first when due at the same time
+        return (self.next_due, -self.rate) < (other.next_due, -other.rate)
+
+
+class TradeCollector:
+    """
+    Polls the recent trades of every pair into a TradeStore
+    poll(pair_id) : poll one pair now
+    run()         : poll pairs as they come due
+    """
+
+    def __init__(self,
+                 store,
+                 pair_ids=None,
+                 fetch=coinex_api.last_trades,
+                 clock=time.time,
+                 sleep=time.sleep):
+        """
+        store: the TradeStore to append to
+        pair_ids: the trade pair ids to poll, defaults to all of them
+        fetch: a function of a pair id returning its recent trades
+        clock, sleep: the time functions to use
+        """
+        if pair_ids is None:
+            pair_ids = [tp['id'] for tp in coinex_api.trade_pairs()]
+        self.store = store
+        self.fetch = fetch
+        self.clock = clock
+        self.sleep = sleep
+        self.requests = 0
+        now = clock()
+        self.pairs = dict((i, PairState(i, now)) for i in pair_ids)
+        self._queue = list(self.pairs.values())
+        heapq.heapify(self._queue)
+
+    def _adapt(self, state, new, returned, now):
+        """
+        Update the trade rate and polling interval of a pair after a poll
+        new: how many of the returned trades were new
+        returned: how many trades the endpoint returned
+        """
+        if state.last_poll is not None and now > state.last_poll:
+            observed = new / (now - state.last_poll)
+            state.rate += RATE_SMOOTHING * (observed - state.rate)
+        state.last_poll = now
+        if returned > 0 and new == returned:
+            # every trade was new, we may have missed some in between
+            interval = state.interval / 2
+        elif state.rate > 0:
+            interval = TARGET_TRADES / state.rate
+        else:
+            interval = state.interval * 2
+        state.interval = min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+        state.next_due = now + state.interval
+
+    def poll(self, pair_id):
+        """
+        Fetch the recent trades of a pair and store the new ones.
+        Returns the number of new trades
+        """
+        state = self.pairs[pair_id]
+        trades = self.fetch(pair_id)
+        self.requests += 1
+        new = [t for t in trades if state.seen.add(t['id'])]
+        new.sort(key=lambda t: t['id'])
+        self.store.append(new)
+        self._adapt(state, len(new), len(trades), self.clock())
+        return len(new)
+
+    def run(self, duration=None, max_requests=None):
+        """
+        Poll pairs as they come due, busiest first
+        duration: stop after this many seconds, or run forever
+        max_requests: stop after this many requests
+        """
+        start = self.clock()
+        last_request = None
+        while self._queue:
+            now = self.clock()
+            if duration is not None and now - start >= duration:
+                break
+            if max_requests is not None and self.requests >= max_requests:
+                break
+            state = self._queue[0]
+            wait = state.next_due - now
+            if last_request is not None:
+                wait = max(wait, last_request + REQUEST_SPACING - now)
+            if wait > 0:
+                if duration is not None:
+                    wait = min(wait, start + duration - now)
+                self.sleep(wait)
+                continue
+            heapq.heappop(self._queue)
+            try:
+                self.poll(state.pair_id)
+            except Exception as e:
+                sys.stderr.write('WARNING: polling pair {0} failed: {1}\n'
+                                 .format(state.pair_id, e))
+                state.next_due = self.clock() + state.interval
+            last_request = self.clock()
+            heapq.heappush(self._queue, state)
+            self.store.flush(keep=_current_partition())
+        self.store.close()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return
+    collector = TradeCollector(TradeStore(sys.argv[1]))
+    try:
+        collector.run()
+    except KeyboardInterrupt:
+        collector.store.close()
+        print("Exiting")
+
+if __name__ == '__main__':
+    main()
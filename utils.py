@@ -6,9 +6,18 @@ General utilities for coinex
 
 import coinex_api
 import models
+import sys
 import time
 
 
+# seconds before the first status poll of an order, doubled after each poll
+POLL_START = 0.5
+# the most seconds between two status polls
+POLL_MAX = 10
+# seconds an order is given to fill before what is left is cancelled
+FILL_DEADLINE = 60
+
+
 def wait_for_order_to_complete(order_id):
     """
     Block (repeatedly request status) of the given
@@ -18,7 +27,72 @@ def wait_for_order_to_complete(order_id):
     time.sleep(10)
     ordr = coinex_api.order_status(order_id)
     while not ordr['cancelled'] and not ordr['complete']:
+        # keep the cached balances and own orders in step with partial fills
+        models.track_own_order(models.Order(API_resp=ordr))
         time.sleep(10)
         ordr = coinex_api.order_status(order_id)
     time.sleep(10)
-    return models.Order(API_resp=ordr)
+    ret = models.Order(API_resp=ordr)
+    models.track_own_order(ret)
+    return ret
+
+
+class ExecutionResult:
+    """
+    The outcome of an order given a deadline to fill
+    Attributes:
+        order: the Order as last reported by coinex
+        filled: the Decimal amount that was filled
+        unfilled: the Decimal amount that was not, and is no longer on the
+                  book
+        timed_out: true if the deadline passed and the rest was cancelled
+    """
+
+    def __init__(self, order, timed_out):
+        self.order = order
+        self.filled = order.filled
+        self.unfilled = order.amount - order.filled
+        self.timed_out = timed_out
+
+    def __str__(self):
+        return 'filled {0} of {1}{2}'.format(
+            self.filled,
+            self.order.amount,
+            ', cancelled the rest' if self.timed_out else ''
+        )
+
+
+def execute_order(ordr,
+                  deadline=FILL_DEADLINE,
+                  clock=time.monotonic,
+                  sleep=time.sleep):
+    """
+    Submit an order and give it until a deadline to fill.
+    The order is polled, quickly at first and less often as time goes on,
+    and whatever is left of it when the deadline passes is cancelled.
+    ordr: the models.Order to submit, it is updated as coinex reports it
+    deadline: seconds from submitting until the rest is cancelled
+    Returns an ExecutionResult
+    """
+    ordr.submit()
+    end = clock() + deadline
+    wait = POLL_START
+    while not ordr.complete and not ordr.cancelled:
+        left = end - clock()
+        if left <= 0:
+            break
+        sleep(min(wait, left))
+        wait = min(wait * 2, POLL_MAX)
+        ordr.refresh()
+    if ordr.complete or ordr.cancelled:
+        return ExecutionResult(ordr, False)
+    try:
+        ordr.cancel()
+    except Exception as e:
+        # it may have filled in the meantime, see what became of it
+        sys.stderr.write('WARNING: cancelling order {0} failed: {1}\n'
+                         .format(ordr.id, e))
+        ordr.refresh()
+        if not ordr.complete and not ordr.cancelled:
+            raise e
+    return ExecutionResult(ordr, not ordr.complete)
@@ -0,0 +1,205 @@
+"""
+valuation.py
+
+Value balances in BTC through the best series of exchanges, so coins
+without a direct BTC pair can be valued too.
+
+The best path from every currency to BTC is a shortest path on -log of
+the top-of-book rates (after fees), found once and reused until a top of
+book changes. Balances are then valued by selling them through the depth
+of each book along the path, so large holdings are not valued at the top
+of book alone.
+"""
+
+from decimal import *
+import math
+
+import models
+
+
+# set the decimal precision to 8
+getcontext().prec = 8
+
+# the coinex transaction fee
+TRANSAC_FEE = Decimal('0.002')
+# the longest path considered, in exchanges
+MAX_HOPS = 3
+
+
+class ValuationEngine:
+    """
+    Values currencies in BTC over the exchange graph
+    Attributes:
+        max_hops: the longest path considered
+        transac_fee: the Decimal fee taken by each exchange
+    set_books(books)        : give the engine the current order books
+    get_path(currency)      : the best path from currency to BTC
+    rates()                 : the top-of-book BTC rate of every currency
+    liquidate(currency, amt): the BTC received selling amt along the path
+    """
+
+    def __init__(self,
+                 exchanges=None,
+                 max_hops=MAX_HOPS,
+                 transac_fee=TRANSAC_FEE):
+        """
+        exchanges: the Exchanges of the graph, defaults to all of them
+        """
+        if exchanges is None:
+            exchanges = models.Exchange.get_all()
+        self._exchanges = dict((ex.id, ex) for ex in exchanges)
+        self.max_hops = max_hops
+        self.transac_fee = Decimal(transac_fee)
+        self._books = dict()
+        self._tops = dict()
+        self._paths = None
+        self._btc = None
+        for ex in exchanges:
+            for cur in (ex.from_currency, ex.to_currency):
+                if cur.abbreviation == 'BTC':
+                    self._btc = cur.id
+
+    def set_books(self, books):
+        """
+        Update the order books, dropping the cached paths if any top of
+        book changed
+        books: a dict of exchange id to a list of Orders
+        """
+        for id_, orders in books.items():
+            bids = [o.rate for o in orders if o.bid is True]
+            asks = [o.rate for o in orders if o.bid is False]
+            top = (max(bids) if bids else None, min(asks) if asks else None)
+            if self._tops.get(id_) != top:
+                self._tops[id_] = top
+                self._paths = None
+            self._books[id_] = orders
+
+    def _edges(self):
+        """
+        Returns a generator of (from currency id, to currency id,
+        exchange id, buy, rate after fees) for each side of every book
+        """
+        tfee = 1 - self.transac_fee
+        for id_, (bid, ask) in self._tops.items():
+            ex = self._exchanges.get(id_)
+            if ex is None:
+                continue
+            if bid:
+                # sell to_currency into the bids
+                yield (ex.to_currency.id, ex.from_currency.id, id_, False,
+                       bid * tfee)
+            if ask:
+                # buy to_currency from the asks
+                yield (ex.from_currency.id, ex.to_currency.id, id_, True,
+                       tfee / ask)
+
+    def _find_paths(self):
+        """
+        Find the best path from every currency to BTC, of at most max_hops
+        exchanges and never visiting a currency twice
+        """
+        # currency id -> (cost, legs, currencies visited)
+        best = {self._btc: (0.0, (), (self._btc,))}
+        edges = list(self._edges())
+        for _ in range(self.max_hops):
+            new = dict(best)
+            for src, dst, ex, buy, rate in edges:
+                if dst not in best or rate <= 0:
+                    continue
+                cost, legs, visited = best[dst]
+                if src in visited:
+                    continue
+                cost += -math.log(rate)
+                if src not in new or cost < new[src][0]:
+                    new[src] = (cost, ((ex, buy),) + legs, (src,) + visited)
+            best = new
+        self._paths = dict((cur, path[1]) for cur, path in best.items())
+        self._rates = dict(
+            (cur, math.exp(-path[0])) for cur, path in best.items()
+        )
+
+    def get_path(self, currency):
+        """
+        Get the best path to convert a currency to BTC
+        currency: a Currency
+        Returns a list of (exchange id, buy) legs, where buy is true when
+        the leg buys the to_currency of the exchange, or None if there is
+        no path
+        NOTE: this is cached until a top of book changes
+        """
+        if self._paths is None:
+            self._find_paths()
+        path = self._paths.get(currency.id)
+        if path is None:
+            return None
+        return list(path)
+
+    def rates(self):
+        """
+        Get the float BTC per unit of every currency with a path to BTC,
+        at the top of book along the path and after fees
+        Returns a dict of currency id to rate
+        NOTE: this is cached until a top of book changes
+        """
+        if self._paths is None:
+            self._find_paths()
+        return self._rates
+
+    def _sell(self, orders, buy, amt):
+        """
+        Trade amt through the depth of a book, returning the amount
+        received after fees
+        """
+        tfee = 1 - self.transac_fee
+        got = Decimal(0)
+        if buy:
+            levels = sorted(
+                (o for o in orders if o.bid is False),
+                key=lambda x: x.rate
+            )
+        else:
+            levels = sorted(
+                (o for o in orders if o.bid is True),
+                key=lambda x: x.rate,
+                reverse=True
+            )
+        for ordr in levels:
+            if amt <= 0:
+                break
+            qty = ordr.amount - ordr.filled
+            if buy:
+                take = min(qty, amt / ordr.rate)
+                amt -= take * ordr.rate
+            else:
+                take = min(qty, amt)
+                amt -= take
+                take *= ordr.rate
+            got += take
+        # whatever the book could not take is not worth anything
+        return got * tfee
+
+    def liquidate(self, currency, amt):
+        """
+        Get the Decimal BTC received by selling an amount of a currency
+        along its best path, through the depth of every book.
+        Raises ValueError if there is no path to BTC
+        """
+        amt = Decimal(amt)
+        if currency.id == self._btc:
+            return amt
+        path = self.get_path(currency)
+        if path is None:
+            raise ValueError(
+                'No path was found that can convert {0} to BTC'.format(
+                    currency.abbreviation
+                )
+            )
+        for ex, buy in path:
+            amt = self._sell(self._books[ex], buy, amt)
+        return amt
+
+    def value(self, balance):
+        """
+        Get the Decimal BTC value of a Balance, including what is held
+        """
+        return self.liquidate(balance.currency, balance.amount + balance.held)